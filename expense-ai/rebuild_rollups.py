@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from datetime import date
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from src.models.user import db
+from src.models.expense import Expense, CreditCardTransaction
+from src.services.rollups import rebuild_rollups, verify_rollups
+from src.main import app
+
+def rebuild_analytics_rollups():
+    """Recompute the analytics rollup tables from expenses and card transactions"""
+    with app.app_context():
+        stats = rebuild_rollups()
+        db.session.commit()
+        print("Analytics rollups rebuilt successfully!")
+        print(f"{stats['category_buckets']} category buckets, {stats['merchant_buckets']} merchant buckets")
+
+def check_analytics_rollups() -> bool:
+    """Check the stored rollups, then that create, update and delete keep them equal to a rebuild.
+
+    The sample writes run in one transaction that is rolled back afterwards.
+    """
+    with app.app_context():
+        passed = _report('stored rollups', verify_rollups())
+        try:
+            expense = Expense(merchant='Rollup Check Cafe', amount=12.5, date=date(2001, 1, 15))
+            # No status, so the column default has to land in the right bucket
+            transaction = CreditCardTransaction(merchant='ROLLUP CHECK CAFE #12', amount=12.5,
+                                                date=date(2001, 1, 16))
+            db.session.add_all([expense, transaction])
+            db.session.flush()
+            passed &= _report('create', verify_rollups())
+
+            # Expired like after a commit, so the old values must be loaded
+            db.session.expire_all()
+            expense.amount = 20.0
+            expense.date = date(2001, 2, 1)
+            transaction.merchant = 'Rollup Check Bakery'
+            transaction.status = 'matched'
+            db.session.flush()
+            passed &= _report('update', verify_rollups())
+
+            db.session.expire_all()
+            db.session.delete(expense)
+            db.session.delete(transaction)
+            db.session.flush()
+            passed &= _report('delete', verify_rollups())
+        finally:
+            db.session.rollback()
+        return passed
+
+def _report(step: str, differences) -> bool:
+    if not differences:
+        print(f"{step}: rollups match a rebuild")
+        return True
+    print(f"{step}: {len(differences)} buckets differ from a rebuild")
+    for difference in differences[:20]:
+        print(f"  {difference}")
+    return False
+
+if __name__ == '__main__':
+    if '--check' in sys.argv[1:]:
+        sys.exit(0 if check_analytics_rollups() else 1)
+    rebuild_analytics_rollups()
@@ -7,12 +7,22 @@ from flask import Flask, send_from_directory
 from flask_cors import CORS
 from src.models.user import db
 from src.models.expense import Category
+from src.models.extraction_cache import ExtractionCacheEntry
+from src.models.storage import StoredBlob
+from src.models.merchant_rule import MerchantCategoryRule
+from src.models.statement_import import StatementImport
+from src.models.match_state import MatchState
+from src.models.rollup import CategoryMonthRollup, MerchantMonthRollup
 from src.routes.user import user_bp
 from src.routes.expense import expense_bp
 from src.routes.receipt import receipt_bp
 from src.routes.ai_assistant import ai_assistant_bp
 from src.routes.credit_card import credit_card_bp
 from src.routes.receipt_review import receipt_review_bp
+from src.services.receipt_storage import start_orphan_sweeper
+from src.services.statement_jobs import resume_statement_imports
+from src.services.rollups import register_rollup_listeners, rebuild_rollups, rollups_missing
+from src.services.known_merchants import register_known_merchant_listeners
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -32,6 +42,10 @@ app.register_blueprint(receipt_review_bp, url_prefix='/api')
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join('/tmp', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
+# Keep analytics rollups in step with expense and card transaction writes
+register_rollup_listeners()
+# Keep the similar-merchant index in step with committed merchant writes
+register_known_merchant_listeners()
 with app.app_context():
     db.create_all()
     
@@ -54,6 +68,21 @@ with app.app_context():
             db.session.add(category)
         
         db.session.commit()
+    
+    # Databases created before the rollup tables existed
+    if rollups_missing():
+        rebuild_rollups()
+        db.session.commit()
+
+# Under app.run(debug=True) the reloader's watcher process also runs this
+# module but never serves requests, so only the serving process starts
+# background work
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    # Periodically reconcile stored receipt files with the database
+    start_orphan_sweeper(app)
+    
+    # Continue statement imports a previous run left unfinished
+    resume_statement_imports(app)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
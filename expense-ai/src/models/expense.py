@@ -1,6 +1,9 @@
+import hashlib
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy.orm import validates
 from src.models.user import db
+from src.services.merchant_normalizer import normalize_merchant, merchant_token_set
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -19,6 +22,8 @@ class Category(db.Model):
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     merchant = db.Column(db.String(200), nullable=False)
+    merchant_key = db.Column(db.String(200), index=True)  # normalize_merchant(merchant)
+    merchant_tokens = db.Column(db.String(200))  # distinct tokens of merchant_key
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.Text)
@@ -27,16 +32,23 @@ class Expense(db.Model):
     reimbursement_status = db.Column(db.String(20), default='pending')  # pending, approved, reimbursed
     verification_status = db.Column(db.String(20), default='pending')  # pending, verified, rejected
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     category = db.relationship('Category', backref='expenses')
     receipt = db.relationship('Receipt', backref='expense', uselist=False)
     
+    @validates('merchant')
+    def _set_merchant_key(self, _, merchant):
+        self.merchant_key = normalize_merchant(merchant or '')
+        self.merchant_tokens = merchant_token_set(self.merchant_key)
+        return merchant
+    
     def to_dict(self):
         return {
             'id': self.id,
             'merchant': self.merchant,
+            'merchant_key': self.merchant_key,
             'amount': self.amount,
             'date': self.date.isoformat() if self.date else None,
             'description': self.description,
@@ -54,8 +66,13 @@ class Receipt(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_type = db.Column(db.String(10), nullable=False)  # jpg, png, pdf
+    file_size = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64), index=True)  # sha256 of the file bytes
     extracted_data = db.Column(db.JSON)  # AI extracted data
     is_processed = db.Column(db.Boolean, default=False)
+    processing_status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    processing_error = db.Column(db.Text)
+    job_id = db.Column(db.String(36), index=True)  # background extraction job
     review_status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
     reviewed_data = db.Column(db.JSON)  # Human-reviewed/corrected data
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -66,8 +83,13 @@ class Receipt(db.Model):
             'filename': self.filename,
             'file_path': self.file_path,
             'file_type': self.file_type,
+            'file_size': self.file_size,
+            'content_hash': self.content_hash,
             'extracted_data': self.extracted_data,
             'is_processed': self.is_processed,
+            'processing_status': self.processing_status,
+            'processing_error': self.processing_error,
+            'job_id': self.job_id,
             'review_status': self.review_status,
             'reviewed_data': self.reviewed_data,
             'created_at': self.created_at.isoformat() if self.created_at else None
@@ -77,26 +99,56 @@ class CreditCardTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     merchant = db.Column(db.String(200), nullable=False)
+    merchant_key = db.Column(db.String(200), index=True)  # normalize_merchant(merchant)
+    merchant_tokens = db.Column(db.String(200))  # distinct tokens of merchant_key
     amount = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(100))
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
     description = db.Column(db.Text)
+    status = db.Column(db.String(20), default='unmatched', index=True)  # unmatched, matched
     is_matched = db.Column(db.Boolean, default=False)
     matched_expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=True)
+    statement_file = db.Column(db.String(255))
+    fingerprint = db.Column(db.String(40), unique=True, nullable=True)  # make_fingerprint(date, merchant, amount)
+    external_id = db.Column(db.String(255))  # the bank's own id, e.g. OFX "ACCTID:FITID"
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     matched_expense = db.relationship('Expense', backref='credit_card_transaction', foreign_keys=[matched_expense_id])
     
+    @validates('merchant')
+    def _set_merchant_key(self, _, merchant):
+        self.merchant_key = normalize_merchant(merchant or '')
+        self.merchant_tokens = merchant_token_set(self.merchant_key)
+        return merchant
+    
+    @staticmethod
+    def make_fingerprint(date, merchant: str, amount: float) -> str:
+        """Identity used to recognize a transaction that was already imported"""
+        return hashlib.sha1(f"{date.isoformat()}|{merchant}|{float(amount):.2f}".encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def make_external_fingerprint(external_id: str) -> str:
+        """Identity of a transaction the bank gave its own id, which beats matching on its fields"""
+        return hashlib.sha1(f"external|{external_id}".encode('utf-8')).hexdigest()
+    
     def to_dict(self):
         return {
             'id': self.id,
             'date': self.date.isoformat() if self.date else None,
             'merchant': self.merchant,
+            'merchant_key': self.merchant_key,
             'amount': self.amount,
             'category': self.category,
+            'category_id': self.category_id,
             'description': self.description,
+            'status': self.status,
             'is_matched': self.is_matched,
             'matched_expense_id': self.matched_expense_id,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'statement_file': self.statement_file,
+            'external_id': self.external_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
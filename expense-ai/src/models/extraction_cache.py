@@ -0,0 +1,25 @@
+from datetime import datetime
+from src.models.user import db
+
+class ExtractionCacheEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False)  # sha256(content hash + extractor version)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    extractor_version = db.Column(db.String(100), nullable=False)
+    data = db.Column(db.JSON, nullable=False)
+    extraction_ms = db.Column(db.Float, default=0.0)  # model latency the entry saves on every hit
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'cache_key': self.cache_key,
+            'content_hash': self.content_hash,
+            'extractor_version': self.extractor_version,
+            'extraction_ms': self.extraction_ms,
+            'hit_count': self.hit_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_used_at': self.last_used_at.isoformat() if self.last_used_at else None
+        }
@@ -0,0 +1,21 @@
+from src.models.user import db
+
+class MatchState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)  # one row per matcher, e.g. 'auto_match'
+    transaction_watermark = db.Column(db.DateTime)  # newest CreditCardTransaction.updated_at already considered
+    expense_watermark = db.Column(db.DateTime)  # newest Expense.updated_at already considered
+    last_run_at = db.Column(db.DateTime)
+    last_full_run_at = db.Column(db.DateTime)
+    last_results = db.Column(db.JSON)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'transaction_watermark': self.transaction_watermark.isoformat() if self.transaction_watermark else None,
+            'expense_watermark': self.expense_watermark.isoformat() if self.expense_watermark else None,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_full_run_at': self.last_full_run_at.isoformat() if self.last_full_run_at else None,
+            'last_results': self.last_results
+        }
@@ -0,0 +1,24 @@
+from datetime import datetime
+from src.models.user import db
+
+class MerchantCategoryRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    merchant_key = db.Column(db.String(200), unique=True, nullable=False)  # normalize_merchant() output
+    category_name = db.Column(db.String(100), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=True)
+    source = db.Column(db.String(20), nullable=False, default='model')  # model, human
+    example_merchant = db.Column(db.String(200))  # a raw name the rule was learned from
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'merchant_key': self.merchant_key,
+            'category_name': self.category_name,
+            'category_id': self.category_id,
+            'source': self.source,
+            'example_merchant': self.example_merchant,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,45 @@
+from src.models.user import db
+
+class CategoryMonthRollup(db.Model):
+    """Count and total per (source, month, category, status), kept in step by src.services.rollups"""
+    __table_args__ = (db.UniqueConstraint('source', 'month', 'category_id', 'status'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(10), nullable=False)  # expense, card
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    category_id = db.Column(db.Integer, nullable=False, default=0)  # 0 when uncategorized
+    status = db.Column(db.String(20), nullable=False, default='')  # card match status, '' for expenses
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'month': self.month,
+            'category_id': self.category_id or None,
+            'status': self.status or None,
+            'count': self.count,
+            'total': self.total
+        }
+
+class MerchantMonthRollup(db.Model):
+    """Count and total per (source, month, normalized merchant), kept in step by src.services.rollups"""
+    __table_args__ = (db.UniqueConstraint('source', 'month', 'merchant_key'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(10), nullable=False)  # expense, card
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    merchant_key = db.Column(db.String(200), nullable=False)  # merchant_key, or the raw merchant when empty
+    merchant = db.Column(db.String(200))  # a raw spelling to display
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'month': self.month,
+            'merchant_key': self.merchant_key,
+            'merchant': self.merchant,
+            'count': self.count,
+            'total': self.total
+        }
@@ -0,0 +1,47 @@
+from datetime import datetime
+from src.models.user import db
+
+class StatementImport(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of the uploaded file
+    filename = db.Column(db.String(255))
+    file_path = db.Column(db.String(500))  # the stored upload, removed once the job finishes
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, partial, failed
+    phase = db.Column(db.String(20))  # parse, dedup, categorize, save, match
+    rows = db.Column(db.Integer, default=0)
+    imported = db.Column(db.Integer, default=0)
+    duplicates = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    matched = db.Column(db.Integer, default=0)
+    rows_committed = db.Column(db.Integer, default=0)  # parsed rows covered by committed batches; resume point
+    stats = db.Column(db.JSON)  # StatementProcessor.save_transactions counters
+    layout = db.Column(db.JSON)  # detected file layout, None for AI extraction
+    result = db.Column(db.JSON)  # extraction and auto-match details, once finished
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'file_hash': self.file_hash,
+            'filename': self.filename,
+            'status': self.status,
+            'phase': self.phase,
+            'rows': self.rows,
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'matched': self.matched,
+            'rows_committed': self.rows_committed,
+            'stats': self.stats,
+            'layout': self.layout,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from src.services.ai_assistant import AIAssistant
+from src.services.llm_client import get_llm_client
 
 ai_assistant_bp = Blueprint('ai_assistant', __name__)
 
@@ -54,6 +55,14 @@ def get_expense_insights():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@ai_assistant_bp.route('/ai-assistant/status', methods=['GET'])
+def get_llm_status():
+    """Get model call scheduler, rate budget and circuit breaker state"""
+    try:
+        return jsonify(get_llm_client().get_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @ai_assistant_bp.route('/ai-assistant/suggestions', methods=['GET'])
 def get_expense_suggestions():
     """Get AI suggestions for expense management"""
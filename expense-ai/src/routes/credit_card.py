@@ -1,13 +1,26 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import json
+import time
 from src.services.statement_processor import StatementProcessor
+from src.services.statement_jobs import (get_statement_job_queue, store_statement_file,
+                                         ACTIVE_STATUSES, FINISHED_STATUSES)
+from src.services.merchant_rules import get_merchant_rules
+from src.services.upload_storage import UploadRejected
 from src.models.expense import CreditCardTransaction, Expense, Category
+from src.models.statement_import import StatementImport
+from src.models.rollup import CategoryMonthRollup, MerchantMonthRollup
 from src.models.user import db
 from sqlalchemy import func, desc
 
 credit_card_bp = Blueprint('credit_card', __name__)
 
+# Configuration
+SSE_POLL_INTERVAL = 0.5  # seconds between progress checks
+SSE_KEEPALIVE_SECONDS = 15  # comment line that keeps idle proxies from closing the stream
+IMPORT_LIST_LIMIT = 50
+
 # CORS headers for all routes
 @credit_card_bp.after_request
 def after_request(response):
@@ -18,7 +31,7 @@ def after_request(response):
 
 @credit_card_bp.route('/credit-card/upload-statement', methods=['POST'])
 def upload_statement():
-    """Upload and process credit card statement"""
+    """Upload a credit card statement and queue it for import"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -28,40 +41,107 @@ def upload_statement():
             return jsonify({'error': 'No file selected'}), 400
         
         # Check file type
-        allowed_extensions = {'csv', 'txt', 'pdf'}
+        allowed_extensions = {'csv', 'txt', 'pdf', 'ofx', 'qfx'}
         if not ('.' in file.filename and 
                 file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-            return jsonify({'error': 'Unsupported file type. Please upload CSV, TXT, or PDF files.'}), 400
+            return jsonify({'error': 'Unsupported file type. Please upload CSV, OFX, QFX, TXT, or PDF files.'}), 400
         
-        # Read file content
-        file_content = file.read().decode('utf-8')
         filename = secure_filename(file.filename)
+        file_path, file_hash = store_statement_file(file.stream, filename.rsplit('.', 1)[-1])
         
-        # Process statement
-        processor = StatementProcessor()
-        
-        if filename.endswith('.csv'):
-            transactions = processor.parse_csv_statement(file_content, filename)
-        else:
-            # Use AI for other formats
-            transactions = processor.extract_transactions_with_ai(file_content)
+        # An identical file imports nothing new, so don't parse it again; a partial
+        # import runs again and fingerprint dedup skips the rows it already saved
+        statement_import = StatementImport.query.filter_by(file_hash=file_hash).first()
+        if statement_import and statement_import.status == 'completed':
+            os.remove(file_path)
+            return jsonify({
+                'message': 'This statement was already imported',
+                'transactions_imported': 0,
+                'already_imported': True,
+                'statement_import': statement_import.to_dict(),
+                'filename': filename
+            })
+        if statement_import and statement_import.status in ACTIVE_STATUSES:
+            return jsonify({'error': 'This statement is already being imported',
+                            'statement_import': statement_import.to_dict()}), 409
         
-        if not transactions:
-            return jsonify({'error': 'No transactions found in the statement'}), 400
-        
-        # Save transactions
-        saved_transactions = processor.save_transactions(transactions, filename)
-        
-        # Auto-match transactions
-        match_results = processor.auto_match_transactions()
+        if statement_import is None:
+            statement_import = StatementImport(file_hash=file_hash)
+            db.session.add(statement_import)
+        statement_import.filename = filename
+        statement_import.file_path = file_path
+        get_statement_job_queue().enqueue(statement_import)
         
         return jsonify({
-            'message': 'Statement processed successfully',
-            'transactions_imported': len(saved_transactions),
-            'auto_match_results': match_results,
+            'message': 'Statement queued for import',
+            'statement_import': statement_import.to_dict(),
+            'events_url': f'/api/credit-card/imports/{statement_import.id}/events',
             'filename': filename
-        })
+        }), 202
         
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@credit_card_bp.route('/credit-card/imports', methods=['GET'])
+def get_statement_imports():
+    """Get the most recent statement imports"""
+    try:
+        imports = StatementImport.query.order_by(StatementImport.created_at.desc()).limit(IMPORT_LIST_LIMIT).all()
+        return jsonify([statement_import.to_dict() for statement_import in imports])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@credit_card_bp.route('/credit-card/imports/<int:import_id>', methods=['GET'])
+def get_statement_import(import_id):
+    """Get one statement import's status and progress"""
+    try:
+        statement_import = StatementImport.query.get_or_404(import_id)
+        return jsonify(statement_import.to_dict())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@credit_card_bp.route('/credit-card/imports/<int:import_id>/events', methods=['GET'])
+def stream_statement_import(import_id):
+    """Stream an import's progress as Server-Sent Events until it finishes"""
+    StatementImport.query.get_or_404(import_id)
+    
+    def generate():
+        last_payload = None
+        last_sent = time.monotonic()
+        while True:
+            statement_import = db.session.get(StatementImport, import_id)
+            if statement_import is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Import was deleted'})}\n\n"
+                return
+            
+            payload = json.dumps(statement_import.to_dict())
+            finished = statement_import.status in FINISHED_STATUSES
+            # End the read transaction so the next poll sees the worker's commits
+            db.session.rollback()
+            
+            if payload != last_payload:
+                yield f"event: {'done' if finished else 'progress'}\ndata: {payload}\n\n"
+                last_payload = payload
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            
+            if finished:
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@credit_card_bp.route('/credit-card/merchant-rules/stats', methods=['GET'])
+def get_merchant_rule_stats():
+    """Get learned merchant rule counts and lookup hit rates"""
+    try:
+        return jsonify(get_merchant_rules().get_stats())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -91,7 +171,7 @@ def get_transactions():
                 'amount': float(transaction.amount),
                 'description': transaction.description,
                 'status': transaction.status,
-                'category': transaction.category.name if transaction.category else None,
+                'category': transaction.category,
                 'matched_expense_id': transaction.matched_expense_id
             }
             result.append(tx_data)
@@ -129,6 +209,7 @@ def create_expense_from_transaction(transaction_id):
         
         # Update transaction status
         transaction.status = 'matched'
+        transaction.is_matched = True
         transaction.matched_expense_id = expense.id
         
         db.session.commit()
@@ -147,8 +228,9 @@ def create_expense_from_transaction(transaction_id):
 def run_auto_match():
     """Manually trigger auto-matching of transactions"""
     try:
+        full = request.args.get('full', '').lower() in ('1', 'true')
         processor = StatementProcessor()
-        results = processor.auto_match_transactions()
+        results = processor.auto_match_transactions(full=full)
         
         return jsonify({
             'message': 'Auto-matching completed',
@@ -156,40 +238,46 @@ def run_auto_match():
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @credit_card_bp.route('/credit-card/analytics', methods=['GET'])
 def get_credit_card_analytics():
     """Get credit card analytics and insights"""
     try:
+        # Everything below reads the monthly rollups, not every transaction
+        card = CategoryMonthRollup.source == 'card'
+        
         # Transaction status breakdown
         status_breakdown = db.session.query(
-            CreditCardTransaction.status,
-            func.count(CreditCardTransaction.id).label('count'),
-            func.sum(CreditCardTransaction.amount).label('total_amount')
-        ).group_by(CreditCardTransaction.status).all()
+            func.nullif(CategoryMonthRollup.status, ''),
+            func.sum(CategoryMonthRollup.count).label('count'),
+            func.sum(CategoryMonthRollup.total).label('total_amount')
+        ).filter(card).group_by(CategoryMonthRollup.status).all()
         
         # Monthly transaction trends
         monthly_trends = db.session.query(
-            func.strftime('%Y-%m', CreditCardTransaction.date).label('month'),
-            func.count(CreditCardTransaction.id).label('count'),
-            func.sum(CreditCardTransaction.amount).label('total_amount')
-        ).group_by(func.strftime('%Y-%m', CreditCardTransaction.date)).all()
+            CategoryMonthRollup.month,
+            func.sum(CategoryMonthRollup.count).label('count'),
+            func.sum(CategoryMonthRollup.total).label('total_amount')
+        ).filter(card).group_by(CategoryMonthRollup.month).order_by(CategoryMonthRollup.month).all()
         
         # Category breakdown
         category_breakdown = db.session.query(
             Category.name,
-            func.count(CreditCardTransaction.id).label('count'),
-            func.sum(CreditCardTransaction.amount).label('total_amount')
-        ).join(CreditCardTransaction).group_by(Category.id, Category.name).all()
+            func.sum(CategoryMonthRollup.count).label('count'),
+            func.sum(CategoryMonthRollup.total).label('total_amount')
+        ).join(CategoryMonthRollup, CategoryMonthRollup.category_id == Category.id).filter(
+            card
+        ).group_by(Category.id, Category.name).all()
         
-        # Top merchants
+        # Top merchants, grouping descriptor variants of the same merchant
         top_merchants = db.session.query(
-            CreditCardTransaction.merchant,
-            func.count(CreditCardTransaction.id).label('count'),
-            func.sum(CreditCardTransaction.amount).label('total_amount')
-        ).group_by(CreditCardTransaction.merchant).order_by(
-            func.sum(CreditCardTransaction.amount).desc()
+            func.min(MerchantMonthRollup.merchant),
+            func.sum(MerchantMonthRollup.count).label('count'),
+            func.sum(MerchantMonthRollup.total).label('total_amount')
+        ).filter(MerchantMonthRollup.source == 'card').group_by(MerchantMonthRollup.merchant_key).order_by(
+            func.sum(MerchantMonthRollup.total).desc()
         ).limit(10).all()
         
         return jsonify({
@@ -2,6 +2,9 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime, date
 from src.models.user import db
 from src.models.expense import Expense, Category, Receipt, CreditCardTransaction
+from src.models.rollup import CategoryMonthRollup, MerchantMonthRollup
+from src.services.merchant_index import MERCHANT_SIMILARITY_THRESHOLD
+from src.services.known_merchants import get_known_merchants
 import json
 
 expense_bp = Blueprint('expense', __name__)
@@ -133,13 +136,16 @@ def create_category():
 def get_analytics_summary():
     """Get expense analytics summary"""
     try:
-        # Total expenses
-        total_expenses = db.session.query(db.func.sum(Expense.amount)).scalar() or 0
+        # Totals come from the monthly rollups, not a scan of every expense
+        total_expenses = db.session.query(db.func.sum(CategoryMonthRollup.total)).filter(
+            CategoryMonthRollup.source == 'expense'
+        ).scalar() or 0
         
         # This month expenses
-        current_month = date.today().replace(day=1)
-        this_month_expenses = db.session.query(db.func.sum(Expense.amount)).filter(
-            Expense.date >= current_month
+        current_month = date.today().strftime('%Y-%m')
+        this_month_expenses = db.session.query(db.func.sum(CategoryMonthRollup.total)).filter(
+            CategoryMonthRollup.source == 'expense',
+            CategoryMonthRollup.month >= current_month
         ).scalar() or 0
         
         # Total receipts
@@ -154,9 +160,11 @@ def get_analytics_summary():
         # Top categories
         category_spending = db.session.query(
             Category.name,
-            db.func.sum(Expense.amount).label('total')
-        ).join(Expense).group_by(Category.id, Category.name).order_by(
-            db.func.sum(Expense.amount).desc()
+            db.func.sum(CategoryMonthRollup.total).label('total')
+        ).join(CategoryMonthRollup, CategoryMonthRollup.category_id == Category.id).filter(
+            CategoryMonthRollup.source == 'expense'
+        ).group_by(Category.id, Category.name).order_by(
+            db.func.sum(CategoryMonthRollup.total).desc()
         ).limit(3).all()
         
         return jsonify({
@@ -176,11 +184,11 @@ def get_monthly_spending():
     try:
         # Get spending by month for the last 12 months
         monthly_data = db.session.query(
-            db.func.strftime('%Y-%m', Expense.date).label('month'),
-            db.func.sum(Expense.amount).label('total')
-        ).group_by(
-            db.func.strftime('%Y-%m', Expense.date)
-        ).order_by('month').all()
+            CategoryMonthRollup.month,
+            db.func.sum(CategoryMonthRollup.total).label('total')
+        ).filter(
+            CategoryMonthRollup.source == 'expense'
+        ).group_by(CategoryMonthRollup.month).order_by(CategoryMonthRollup.month).all()
         
         return jsonify([{
             'month': month,
@@ -196,8 +204,10 @@ def get_category_breakdown():
         category_data = db.session.query(
             Category.name,
             Category.color,
-            db.func.sum(Expense.amount).label('total')
-        ).join(Expense).group_by(Category.id, Category.name, Category.color).all()
+            db.func.sum(CategoryMonthRollup.total).label('total')
+        ).join(CategoryMonthRollup, CategoryMonthRollup.category_id == Category.id).filter(
+            CategoryMonthRollup.source == 'expense'
+        ).group_by(Category.id, Category.name, Category.color).all()
         
         return jsonify([{
             'name': name,
@@ -211,11 +221,14 @@ def get_category_breakdown():
 def get_merchant_spending():
     """Get top merchants by spending"""
     try:
+        # Rollups group spellings of the same merchant ("STARBUCKS #12", "Starbucks #40") together
         merchant_data = db.session.query(
-            Expense.merchant,
-            db.func.sum(Expense.amount).label('total')
-        ).group_by(Expense.merchant).order_by(
-            db.func.sum(Expense.amount).desc()
+            db.func.min(MerchantMonthRollup.merchant),
+            db.func.sum(MerchantMonthRollup.total).label('total')
+        ).filter(
+            MerchantMonthRollup.source == 'expense'
+        ).group_by(MerchantMonthRollup.merchant_key).order_by(
+            db.func.sum(MerchantMonthRollup.total).desc()
         ).limit(10).all()
         
         return jsonify([{
@@ -225,6 +238,24 @@ def get_merchant_spending():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@expense_bp.route('/merchants/similar', methods=['GET'])
+def get_similar_merchants():
+    """Fuzzy-find known merchants by name"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
+        min_score = request.args.get('min_score', MERCHANT_SIMILARITY_THRESHOLD, type=float)
+        limit = min(request.args.get('limit', 10, type=int), 100)
+        
+        return jsonify([{
+            'merchant_key': key,
+            'merchant': merchant,
+            'score': score
+        } for key, merchant, score in get_known_merchants().search(query, min_score=min_score, limit=limit)])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Credit Card Transaction endpoints
 @expense_bp.route('/credit-card-transactions', methods=['GET'])
 def get_credit_card_transactions():
@@ -249,6 +280,11 @@ def create_credit_card_transaction():
             description=data.get('description', '')
         )
         
+        # Let statement imports recognize this transaction, unless an identical one already claims it
+        fingerprint = CreditCardTransaction.make_fingerprint(transaction.date, transaction.merchant, transaction.amount)
+        if CreditCardTransaction.query.filter_by(fingerprint=fingerprint).first() is None:
+            transaction.fingerprint = fingerprint
+        
         db.session.add(transaction)
         db.session.commit()
         
@@ -277,6 +313,7 @@ def create_expense_from_transaction(transaction_id):
         
         # Mark transaction as matched
         transaction.is_matched = True
+        transaction.status = 'matched'
         transaction.matched_expense_id = expense.id
         
         db.session.commit()
@@ -1,26 +1,60 @@
 import os
-import uuid
-from flask import Blueprint, request, jsonify
+import json
+import zipfile
+from flask import Blueprint, request, jsonify, Response, stream_with_context, send_file
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
 from src.models.user import db
 from src.models.expense import Receipt, Expense, Category
-from src.services.receipt_processor import ReceiptProcessor
+from src.services.receipt_jobs import get_receipt_job_queue, QueueFullError
+from src.services.extraction_cache import ExtractionCache
+from src.services.extraction_router import ExtractionRouter
+from src.services.upload_storage import UploadRejected
+from src.services.receipt_storage import get_receipt_storage
+from src.services.receipt_batch import ReceiptBatchProcessor, BATCH_CONCURRENCY
+from src.services.receipt_images import get_derivative_cache, DERIVATIVE_SIZES
 
 receipt_bp = Blueprint('receipt', __name__)
 
 # Configuration
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
-
-# Ensure upload directory exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+MAX_BATCH_FILES = 200
+MAX_BATCH_UPLOAD_SIZE = 512 * 1024 * 1024  # 512MB per batch request
+IMAGE_MAX_AGE = 24 * 60 * 60  # receipt files never change, only get deleted
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def store_receipt_file(stream, filename):
+    """Stream one receipt file into content-addressed storage and build its Receipt row"""
+    original_filename = secure_filename(os.path.basename(filename))
+    file_extension = os.path.splitext(original_filename)[1]
+    
+    # Enforces size and content type while copying; identical files are stored once
+    stored = get_receipt_storage().store(
+        stream, MAX_FILE_SIZE, ALLOWED_EXTENSIONS, expected_type=file_extension
+    )
+    
+    return Receipt(
+        filename=original_filename,
+        file_path=stored.path,
+        file_type=file_extension[1:],  # Remove the dot
+        file_size=stored.size,
+        content_hash=stored.content_hash,
+        is_processed=False
+    )
+
+@receipt_bp.before_request
+def limit_upload_size():
+    # Reject oversized uploads before the body is parsed
+    if request.endpoint == 'receipt.upload_receipt':
+        request.max_content_length = MAX_FILE_SIZE + 64 * 1024  # room for multipart framing
+    elif request.endpoint == 'receipt.upload_receipt_batch':
+        request.max_content_length = MAX_BATCH_UPLOAD_SIZE
+
 # CORS headers for all routes
 @receipt_bp.after_request
 def after_request(response):
@@ -31,7 +65,7 @@ def after_request(response):
 
 @receipt_bp.route('/receipts/upload', methods=['POST'])
 def upload_receipt():
-    """Upload and process a receipt"""
+    """Upload a receipt and queue it for processing"""
     try:
         # Check if file is in request
         if 'file' not in request.files:
@@ -45,48 +79,179 @@ def upload_receipt():
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not allowed'}), 400
         
-        # Generate unique filename
-        original_filename = secure_filename(file.filename)
-        file_extension = os.path.splitext(original_filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        
-        # Save file
-        file.save(file_path)
-        
-        # Create receipt record
-        receipt = Receipt(
-            filename=original_filename,
-            file_path=file_path,
-            file_type=file_extension[1:],  # Remove the dot
-            is_processed=False
-        )
+        # Stream the file to disk and build its record; extraction runs in the background
+        receipt = store_receipt_file(file.stream, file.filename)
+        stored_file = (receipt.content_hash, receipt.file_path)
         
         db.session.add(receipt)
-        db.session.flush()  # Get the receipt ID
+        job_id = get_receipt_job_queue().enqueue(receipt)
         
-        # Process the receipt with AI
-        processor = ReceiptProcessor()
-        extracted_data = processor.process_receipt_file(file_path, original_filename)
+        return jsonify({
+            'receipt_id': receipt.id,
+            'job_id': job_id,
+            'filename': receipt.filename,
+            'status': 'queued',
+            'message': 'Receipt uploaded and queued for processing'
+        }), 202
+        
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'File exceeds the maximum size of {MAX_FILE_SIZE // (1024 * 1024)}MB'}), 413
+    except QueueFullError as e:
+        db.session.rollback()
+        if 'stored_file' in locals():
+            get_receipt_storage().release(*stored_file)
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        db.session.rollback()
+        # Drop our reference to the file if it was saved
+        if 'stored_file' in locals():
+            get_receipt_storage().release(*stored_file)
+        return jsonify({'error': str(e)}), 500
+
+@receipt_bp.route('/receipts/upload-batch', methods=['POST'])
+def upload_receipt_batch():
+    """Upload many receipts (files and/or ZIP archives) and extract them concurrently"""
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
         
-        # Update receipt with extracted data
-        receipt.extracted_data = extracted_data
-        receipt.is_processed = True
+        concurrency = request.args.get('concurrency', BATCH_CONCURRENCY, type=int)
+        stream_progress = request.args.get('stream', 'false').lower() == 'true'
         
+        receipts, results = _collect_batch_receipts(files)
+        
+        # One commit for every stored file
+        for receipt in receipts:
+            receipt.processing_status = 'running'
+            db.session.add(receipt)
         db.session.commit()
         
+        processor = ReceiptBatchProcessor(concurrency=concurrency)
+        
+        if stream_progress:
+            def generate():
+                total = len(receipts) + len(results)
+                completed = len(results)
+                for result in results:
+                    yield json.dumps({**result, 'completed': completed, 'total': total}) + '\n'
+                for result in processor.process(receipts):
+                    completed += 1
+                    yield json.dumps({**result, 'completed': completed, 'total': total}) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        results.extend(processor.process(receipts))
+        
         return jsonify({
+            'total': len(results),
+            'processed': sum(1 for r in results if r['status'] == 'done'),
+            'failed': sum(1 for r in results if r['status'] != 'done'),
+            'results': results
+        })
+        
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Batch exceeds the maximum size of {MAX_BATCH_UPLOAD_SIZE // (1024 * 1024)}MB'}), 413
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def _collect_batch_receipts(files):
+    """Store every file in the batch, expanding ZIP archives.
+    
+    Returns the Receipt rows to create and a result entry for every file
+    that was rejected, so one bad file doesn't fail the whole batch.
+    """
+    receipts = []
+    rejected = []
+    
+    def add(stream, filename):
+        if len(receipts) + len(rejected) >= MAX_BATCH_FILES:
+            raise UploadRejected(f'Batches are limited to {MAX_BATCH_FILES} files')
+        if not allowed_file(filename):
+            rejected.append({'filename': filename, 'status': 'rejected', 'error': 'File type not allowed'})
+            return
+        try:
+            receipts.append(store_receipt_file(stream, filename))
+        except UploadRejected as e:
+            rejected.append({'filename': filename, 'status': 'rejected', 'error': str(e)})
+    
+    try:
+        for file in files:
+            if file.filename.lower().endswith('.zip'):
+                if not zipfile.is_zipfile(file.stream):
+                    rejected.append({'filename': file.filename, 'status': 'rejected', 'error': 'Invalid ZIP archive'})
+                    continue
+                file.stream.seek(0)
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        name = member.filename
+                        # Skip folders and macOS metadata
+                        if member.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                            continue
+                        if member.file_size > MAX_FILE_SIZE:
+                            rejected.append({'filename': name, 'status': 'rejected', 'error': 'File too large'})
+                            continue
+                        with archive.open(member) as member_stream:
+                            add(member_stream, name)
+            else:
+                add(file.stream, file.filename)
+    except Exception:
+        # Don't leave references behind for receipts that will never be created
+        for receipt in receipts:
+            get_receipt_storage().release(receipt.content_hash, receipt.file_path)
+        raise
+    
+    return receipts, rejected
+
+@receipt_bp.route('/receipts/jobs/<job_id>', methods=['GET'])
+def get_receipt_job(job_id):
+    """Get the status of a background extraction job"""
+    try:
+        receipt = Receipt.query.filter_by(job_id=job_id).first()
+        if receipt is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        result = {
+            'job_id': job_id,
             'receipt_id': receipt.id,
-            'filename': original_filename,
-            'extracted_data': extracted_data,
-            'message': 'Receipt uploaded and processed successfully'
-        }), 201
+            'status': receipt.processing_status,
+            'error': receipt.processing_error
+        }
+        if receipt.processing_status == 'done':
+            result['extracted_data'] = receipt.extracted_data
         
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@receipt_bp.route('/receipts/cache/stats', methods=['GET'])
+def get_extraction_cache_stats():
+    """Get extraction cache hit/miss statistics"""
+    try:
+        return jsonify(ExtractionCache().get_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@receipt_bp.route('/receipts/extraction/stats', methods=['GET'])
+def get_extraction_stats():
+    """Get per-model latency, cost and escalation statistics"""
+    try:
+        return jsonify(ExtractionRouter.get_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@receipt_bp.route('/receipts/storage/sweep', methods=['POST'])
+def sweep_receipt_storage():
+    """Reconcile stored files with receipts and remove orphans"""
+    try:
+        return jsonify(get_receipt_storage().sweep_orphans())
     except Exception as e:
         db.session.rollback()
-        # Clean up file if it was saved
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'error': str(e)}), 500
 
 @receipt_bp.route('/receipts/<int:receipt_id>/create-expense', methods=['POST'])
@@ -149,20 +314,60 @@ def get_receipt(receipt_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@receipt_bp.route('/receipts/<int:receipt_id>/image', methods=['GET'])
+def get_receipt_image(receipt_id):
+    """Serve a receipt image: size=thumb, review (default) or original"""
+    try:
+        receipt = Receipt.query.get_or_404(receipt_id)
+        size = request.args.get('size', 'review')
+        
+        if size != 'original' and size not in DERIVATIVE_SIZES:
+            return jsonify({'error': f"Unknown size '{size}'"}), 400
+        if not os.path.exists(receipt.file_path):
+            return jsonify({'error': 'Receipt file not found'}), 404
+        
+        # The content hash identifies the bytes, so it makes a strong ETag
+        content_key = receipt.content_hash or f"receipt-{receipt.id}"
+        etag = content_key if size == 'original' else get_derivative_cache().derivative_key(content_key, size)
+        
+        # Answer revalidations without touching the image at all
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        if size == 'original':
+            path = receipt.file_path
+            mimetype = 'application/pdf' if receipt.file_type == 'pdf' else None
+        else:
+            path = get_derivative_cache().get_path(receipt.file_path, receipt.file_type, content_key, size)
+            mimetype = 'image/jpeg'
+            if path is None:
+                return jsonify({'error': 'No image available for this receipt'}), 415
+        
+        response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=IMAGE_MAX_AGE)
+        # Receipts are personal data; keep them out of shared caches
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @receipt_bp.route('/receipts/<int:receipt_id>', methods=['DELETE'])
 def delete_receipt(receipt_id):
     """Delete a receipt and its file"""
     try:
         receipt = Receipt.query.get_or_404(receipt_id)
-        
-        # Delete the file
-        if os.path.exists(receipt.file_path):
-            os.remove(receipt.file_path)
+        content_hash, file_path = receipt.content_hash, receipt.file_path
         
         # Delete from database
         db.session.delete(receipt)
         db.session.commit()
         
+        # The file goes only when no other receipt shares it
+        get_receipt_storage().release(content_hash, file_path)
+        
         return jsonify({'message': 'Receipt deleted successfully'})
         
     except Exception as e:
@@ -178,22 +383,26 @@ def reprocess_receipt(receipt_id):
         if not os.path.exists(receipt.file_path):
             return jsonify({'error': 'Receipt file not found'}), 404
         
-        # Reprocess with AI
-        processor = ReceiptProcessor()
-        extracted_data = processor.process_receipt_file(receipt.file_path, receipt.filename)
+        # force=true re-queues jobs left behind by a restarted worker,
+        # refresh=true skips the extraction cache and calls the model again
+        force = request.args.get('force', 'false').lower() == 'true'
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
+        if receipt.processing_status in ('queued', 'running') and not force:
+            return jsonify({'error': 'Receipt is already being processed', 'job_id': receipt.job_id}), 409
         
-        # Update receipt
-        receipt.extracted_data = extracted_data
-        receipt.is_processed = True
-        
-        db.session.commit()
+        # Reprocess with AI in the background
+        job_id = get_receipt_job_queue().enqueue(receipt, use_cache=not refresh)
         
         return jsonify({
             'receipt_id': receipt.id,
-            'extracted_data': extracted_data,
-            'message': 'Receipt reprocessed successfully'
-        })
+            'job_id': job_id,
+            'status': 'queued',
+            'message': 'Receipt queued for reprocessing'
+        }), 202
         
+    except QueueFullError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
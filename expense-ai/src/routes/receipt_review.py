@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from src.models.expense import Receipt, Expense, Category
 from src.models.user import db
 from sqlalchemy import desc
+from src.services.merchant_rules import get_merchant_rules
 
 receipt_review_bp = Blueprint('receipt_review', __name__)
 
@@ -27,6 +28,9 @@ def get_pending_receipts():
         result = []
         for receipt in receipts.items:
             receipt_data = receipt.to_dict()
+            # Small cached renditions, so paging the queue doesn't pull originals
+            receipt_data['thumbnail_url'] = f'/api/receipts/{receipt.id}/image?size=thumb'
+            receipt_data['image_url'] = f'/api/receipts/{receipt.id}/image?size=review'
             # Add expense data if linked
             if receipt.expense:
                 receipt_data['expense'] = receipt.expense.to_dict()
@@ -49,6 +53,8 @@ def get_receipt_details(receipt_id):
         receipt = Receipt.query.get_or_404(receipt_id)
         
         receipt_data = receipt.to_dict()
+        receipt_data['thumbnail_url'] = f'/api/receipts/{receipt.id}/image?size=thumb'
+        receipt_data['image_url'] = f'/api/receipts/{receipt.id}/image?size=review'
         
         # Add expense data if linked
         if receipt.expense:
@@ -98,6 +104,8 @@ def approve_receipt(receipt_id):
                 category = Category.query.filter_by(name=category_name).first()
                 if category:
                     expense.category_id = category.id
+                    # A reviewer's category is the best rule we can learn for this merchant
+                    get_merchant_rules().learn(expense.merchant, category.name, category.id, source='human')
         
         expense.verification_status = 'verified'
         
@@ -114,6 +122,7 @@ def approve_receipt(receipt_id):
         
     except Exception as e:
         db.session.rollback()
+        get_merchant_rules().invalidate()
         return jsonify({'error': str(e)}), 500
 
 @receipt_review_bp.route('/receipt-review/<int:receipt_id>/reject', methods=['POST'])
@@ -1,13 +1,14 @@
-import openai
 from datetime import datetime, date
 from typing import Dict, Any, List
 from src.models.expense import Expense, Category, CreditCardTransaction
 from src.models.user import db
 from sqlalchemy import func
+from src.services.llm_client import get_llm_client
+from src.services.llm_scheduler import LLMUnavailableError, PRIORITY_INTERACTIVE
 
 class AIAssistant:
     def __init__(self):
-        self.client = openai.OpenAI()
+        self.client = get_llm_client()
     
     def get_expense_context(self) -> str:
         """Get current expense data to provide context for AI responses"""
@@ -35,9 +36,9 @@ class AIAssistant:
             
             # Get top merchants
             top_merchants = db.session.query(
-                Expense.merchant,
+                func.min(Expense.merchant),
                 func.sum(Expense.amount).label('total')
-            ).group_by(Expense.merchant).order_by(
+            ).group_by(func.coalesce(func.nullif(Expense.merchant_key, ''), Expense.merchant)).order_by(
                 func.sum(Expense.amount).desc()
             ).limit(5).all()
             
@@ -90,7 +91,8 @@ Guidelines:
 """
 
             # Call OpenAI API
-            response = self.client.chat.completions.create(
+            response = self.client.chat_completion(
+                priority=PRIORITY_INTERACTIVE,
                 model="gpt-4.1-mini",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -102,6 +104,9 @@ Guidelines:
             
             return response.choices[0].message.content
             
+        except LLMUnavailableError:
+            return ("The AI assistant is temporarily unavailable. "
+                    "Your expense data is still accessible from the dashboard; please try again in a minute.")
         except Exception as e:
             return f"I'm sorry, I encountered an error while processing your request: {str(e)}"
     
@@ -119,7 +124,8 @@ Each insight should be one sentence and actionable or informative.
 Format as a simple list of insights.
 """
             
-            response = self.client.chat.completions.create(
+            response = self.client.chat_completion(
+                priority=PRIORITY_INTERACTIVE,
                 model="gpt-4.1-mini",
                 messages=[
                     {"role": "system", "content": system_prompt}
@@ -134,6 +140,8 @@ Format as a simple list of insights.
             
             return insights[:5]  # Limit to 5 insights
             
+        except LLMUnavailableError:
+            return ["Insights are temporarily unavailable, please check back shortly."]
         except Exception as e:
             return [f"Unable to generate insights: {str(e)}"]
 
@@ -0,0 +1,158 @@
+import os
+import copy
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from src.models.user import db
+from src.models.extraction_cache import ExtractionCacheEntry
+
+# Configuration
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', 5000))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(file_path: str) -> str:
+    """Compute the SHA-256 of a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """Persistent cache of receipt extraction results keyed by file content"""
+
+    # Process-wide counters, shared by every instance
+    _lock = threading.Lock()
+    _counters = {
+        'hits': 0,
+        'misses': 0,
+        'stores': 0,
+        'evictions': 0,
+        'errors': 0,
+        'saved_ms': 0.0
+    }
+
+    def __init__(self, max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+
+    @staticmethod
+    def make_key(content_hash: str, extractor_version: str) -> str:
+        """Combine the content hash with the prompt/model version"""
+        return hashlib.sha256(f"{content_hash}:{extractor_version}".encode('utf-8')).hexdigest()
+
+    def get(self, content_hash: str, extractor_version: str) -> Optional[Dict[str, Any]]:
+        """Return cached extraction data or None on a miss"""
+        try:
+            return self._get(content_hash, extractor_version)
+        except SQLAlchemyError as e:
+            # A busy database should cost a model call, not fail the extraction
+            db.session.rollback()
+            print(f"Error reading extraction cache: {str(e)}")
+            self._count('errors')
+            self._count('misses')
+            return None
+
+    def _get(self, content_hash: str, extractor_version: str) -> Optional[Dict[str, Any]]:
+        key = self.make_key(content_hash, extractor_version)
+        entry = ExtractionCacheEntry.query.filter_by(cache_key=key).first()
+
+        if entry is None:
+            self._count('misses')
+            return None
+
+        entry.hit_count = (entry.hit_count or 0) + 1
+        entry.last_used_at = datetime.utcnow()
+        data = copy.deepcopy(entry.data)
+        saved_ms = entry.extraction_ms or 0.0
+        db.session.commit()
+
+        self._count('hits')
+        self._count('saved_ms', saved_ms)
+        return data
+
+    def put(self, content_hash: str, extractor_version: str, data: Dict[str, Any], extraction_ms: float):
+        """Store an extraction result and evict the least recently used entries"""
+        try:
+            self._put(content_hash, extractor_version, data, extraction_ms)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"Error writing extraction cache: {str(e)}")
+            self._count('errors')
+
+    def _put(self, content_hash: str, extractor_version: str, data: Dict[str, Any], extraction_ms: float):
+        key = self.make_key(content_hash, extractor_version)
+        entry = ExtractionCacheEntry(
+            cache_key=key,
+            content_hash=content_hash,
+            extractor_version=extractor_version,
+            data=data,
+            extraction_ms=extraction_ms
+        )
+
+        try:
+            db.session.add(entry)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker cached the same content first
+            db.session.rollback()
+            return
+
+        self._count('stores')
+        self._evict()
+
+    def _evict(self):
+        """Trim the cache back under its size bound, oldest use first"""
+        total = db.session.query(func.count(ExtractionCacheEntry.id)).scalar() or 0
+        overflow = total - self.max_entries
+        if overflow <= 0:
+            return
+
+        # Evict a little extra so we don't run this on every insert
+        overflow += max(1, self.max_entries // 20)
+        stale_ids = [
+            entry_id for (entry_id,) in db.session.query(ExtractionCacheEntry.id)
+            .order_by(ExtractionCacheEntry.last_used_at.asc())
+            .limit(overflow)
+            .all()
+        ]
+        ExtractionCacheEntry.query.filter(
+            ExtractionCacheEntry.id.in_(stale_ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        self._count('evictions', len(stale_ids))
+
+    @classmethod
+    def _count(cls, name: str, amount: float = 1):
+        with cls._lock:
+            cls._counters[name] += amount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and persistent cache totals"""
+        with self._lock:
+            counters = dict(self._counters)
+
+        lookups = counters['hits'] + counters['misses']
+        entries, lifetime_hits, lifetime_saved_ms = db.session.query(
+            func.count(ExtractionCacheEntry.id),
+            func.sum(ExtractionCacheEntry.hit_count),
+            func.sum(ExtractionCacheEntry.hit_count * ExtractionCacheEntry.extraction_ms)
+        ).one()
+
+        return {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'hit_rate': counters['hits'] / lookups if lookups else 0.0,
+            'stores': counters['stores'],
+            'evictions': counters['evictions'],
+            'errors': counters['errors'],
+            'model_calls_saved': counters['hits'],
+            'latency_saved_ms': round(counters['saved_ms'], 1),
+            'entries': entries or 0,
+            'max_entries': self.max_entries,
+            'lifetime_hits': lifetime_hits or 0,
+            'lifetime_latency_saved_ms': round(float(lifetime_saved_ms or 0), 1)
+        }
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+from typing import Dict, Any, List, Callable, Tuple, Optional
+from src.services.llm_scheduler import LLMUnavailableError
+
+# Configuration
+VISION_MODEL_TIERS = os.environ.get('RECEIPT_VISION_TIERS', 'gpt-4o-mini,gpt-4o').split(',')
+TEXT_MODEL_TIERS = os.environ.get('RECEIPT_TEXT_TIERS', 'gpt-4.1-mini,gpt-4o').split(',')
+ESCALATION_CONFIDENCE_THRESHOLD = float(os.environ.get('RECEIPT_ESCALATION_THRESHOLD', 0.8))
+# A cheap answer that had to fall back on any of these is not worth keeping
+CRITICAL_FIELDS = ['merchant', 'amount', 'date']
+
+# USD per 1M tokens (input, output), used to estimate spend per tier
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1-nano': (0.10, 0.40)
+}
+
+def estimate_cost(model: str, usage) -> float:
+    """Estimate the USD cost of one call from its token usage"""
+    if usage is None or model not in MODEL_PRICES:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[model]
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+class ExtractionRouter:
+    """Try the cheapest model tier first and escalate only when the answer is weak"""
+
+    # Process-wide counters, shared by every router
+    _lock = threading.Lock()
+    _tier_stats: Dict[str, Dict[str, float]] = {}
+    _documents = {'total': 0, 'escalated': 0}
+
+    def __init__(self, tiers: List[str], threshold: float = ESCALATION_CONFIDENCE_THRESHOLD,
+                 critical_fields: Optional[List[str]] = None):
+        self.tiers = [tier.strip() for tier in tiers if tier.strip()]
+        self.threshold = threshold
+        self.critical_fields = critical_fields if critical_fields is not None else CRITICAL_FIELDS
+
+    def signature(self) -> str:
+        """Identify the routing setup, so cached results follow config changes"""
+        return f"{'>'.join(self.tiers)}@{self.threshold}"
+
+    def needs_escalation(self, result: Dict[str, Any]) -> bool:
+        if result.get('error'):
+            return True
+        if result.get('confidence', 0.0) < self.threshold:
+            return True
+        defaulted = result.get('defaulted_fields', [])
+        return any(field in defaulted for field in self.critical_fields)
+
+    def run(self, call: Callable[[str], Tuple[Dict[str, Any], Any]]) -> Dict[str, Any]:
+        """Run call(model) tier by tier; call returns (validated data, token usage)"""
+        attempts = []
+        results = []
+
+        for model in self.tiers:
+            started = time.perf_counter()
+            unavailable = False
+            try:
+                result, usage = call(model)
+            except LLMUnavailableError as e:
+                result, usage = {"error": str(e), "confidence": 0.0}, None
+                unavailable = True
+            except Exception as e:
+                result, usage = {"error": str(e), "confidence": 0.0}, None
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            cost = estimate_cost(model, usage)
+            self._record_call(model, latency_ms, cost, bool(result.get('error')))
+            attempts.append({
+                'model': model,
+                'confidence': result.get('confidence', 0.0),
+                'latency_ms': round(latency_ms, 1),
+                'cost_usd': round(cost, 6),
+                'error': result.get('error')
+            })
+            results.append((model, result))
+
+            # Higher tiers share the same provider, so don't queue for them
+            if unavailable or not self.needs_escalation(result):
+                break
+
+        self._record_document(escalated=len(attempts) > 1)
+
+        # The last tier wins unless it failed outright; then keep the most
+        # confident answer an earlier tier gave
+        model, result = results[-1]
+        if result.get('error'):
+            usable = [(m, r) for m, r in results if not r.get('error')]
+            if usable:
+                model, result = max(usable, key=lambda item: item[1].get('confidence', 0.0))
+
+        if not result.get('error'):
+            result['routing'] = {
+                'model': model,
+                'escalated': len(attempts) > 1,
+                'attempts': attempts
+            }
+        return result
+
+    @classmethod
+    def _record_call(cls, model: str, latency_ms: float, cost: float, failed: bool):
+        with cls._lock:
+            stats = cls._tier_stats.setdefault(model, {
+                'calls': 0, 'errors': 0, 'total_latency_ms': 0.0, 'total_cost_usd': 0.0
+            })
+            stats['calls'] += 1
+            stats['errors'] += 1 if failed else 0
+            stats['total_latency_ms'] += latency_ms
+            stats['total_cost_usd'] += cost
+
+    @classmethod
+    def _record_document(cls, escalated: bool):
+        with cls._lock:
+            cls._documents['total'] += 1
+            cls._documents['escalated'] += 1 if escalated else 0
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """Per-tier latency, cost and the overall escalation rate"""
+        with cls._lock:
+            tiers = {model: dict(stats) for model, stats in cls._tier_stats.items()}
+            documents = dict(cls._documents)
+
+        for stats in tiers.values():
+            stats['avg_latency_ms'] = round(stats['total_latency_ms'] / stats['calls'], 1) if stats['calls'] else 0.0
+            stats['total_latency_ms'] = round(stats['total_latency_ms'], 1)
+            stats['total_cost_usd'] = round(stats['total_cost_usd'], 6)
+
+        return {
+            'documents': documents['total'],
+            'escalated': documents['escalated'],
+            'escalation_rate': documents['escalated'] / documents['total'] if documents['total'] else 0.0,
+            'threshold': ESCALATION_CONFIDENCE_THRESHOLD,
+            'tiers': tiers
+        }
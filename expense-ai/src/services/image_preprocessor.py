@@ -0,0 +1,155 @@
+import io
+import os
+from typing import Dict, Any, Optional
+from PIL import Image, ImageOps, ImageStat
+
+# Configuration
+IMAGE_MAX_DIMENSION = int(os.environ.get('RECEIPT_IMAGE_MAX_DIMENSION', 2048))  # longest side in pixels
+IMAGE_TARGET_BYTES = int(os.environ.get('RECEIPT_IMAGE_TARGET_BYTES', 800 * 1024))
+IMAGE_GRAYSCALE = os.environ.get('RECEIPT_IMAGE_GRAYSCALE', 'auto')  # auto, always, never
+IMAGE_START_QUALITY = 85
+IMAGE_MIN_QUALITY = 45
+GRAYSCALE_SATURATION_THRESHOLD = 24  # mean HSV saturation (0-255) below which colour adds nothing
+EXIF_ORIENTATION = 0x0112  # 1 means already upright
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp'
+}
+
+class PreprocessedImage:
+    """Image bytes ready for the vision API plus what preprocessing did to them"""
+
+    def __init__(self, data: bytes, mime_type: str, original_bytes: int,
+                 width: Optional[int] = None, height: Optional[int] = None,
+                 grayscale: bool = False, reencoded: bool = False):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.width = width
+        self.height = height
+        self.grayscale = grayscale
+        self.reencoded = reencoded
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'original_bytes': self.original_bytes,
+            'sent_bytes': len(self.data),
+            'bytes_saved': self.bytes_saved,
+            'mime_type': self.mime_type,
+            'width': self.width,
+            'height': self.height,
+            'grayscale': self.grayscale,
+            'reencoded': self.reencoded
+        }
+
+class ImagePreprocessor:
+    """Normalize receipt images before they are sent to the vision model"""
+
+    def __init__(self, max_dimension: int = IMAGE_MAX_DIMENSION,
+                 target_bytes: int = IMAGE_TARGET_BYTES,
+                 grayscale: str = IMAGE_GRAYSCALE):
+        self.max_dimension = max_dimension
+        self.target_bytes = target_bytes
+        self.grayscale = grayscale
+
+    def signature(self) -> str:
+        """Identify the settings, so cached extractions follow config changes"""
+        return f"img:{self.max_dimension}:{self.target_bytes}:{self.grayscale}"
+
+    def preprocess(self, image_bytes: bytes) -> PreprocessedImage:
+        """Apply EXIF orientation, cap dimensions, optionally drop colour and re-encode"""
+        original_size = len(image_bytes)
+
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            source_format = image.format
+            image.load()
+        except Exception as e:
+            # Let the API decide what to do with something Pillow can't read
+            print(f"Error opening receipt image, sending as-is: {str(e)}")
+            return PreprocessedImage(image_bytes, 'image/jpeg', original_size)
+
+        # exif_transpose copies even upright images, so decide from the tag itself
+        needs_rotation = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+        if needs_rotation:
+            image = ImageOps.exif_transpose(image)
+        image = self._flatten(image)
+
+        needs_resize = max(image.size) > self.max_dimension
+        if needs_resize:
+            image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+
+        use_grayscale = self._should_use_grayscale(image)
+        if use_grayscale:
+            image = image.convert('L')
+
+        # Small, upright, supported files are already as good as we can make them
+        if (not needs_rotation and not needs_resize and not use_grayscale
+                and source_format in MIME_TYPES and original_size <= self.target_bytes):
+            return PreprocessedImage(image_bytes, MIME_TYPES[source_format], original_size,
+                                     width=image.width, height=image.height)
+
+        data, output_format = self._encode(image, prefer_png=source_format in ('PNG', 'GIF'))
+
+        # Re-encoding can lose to the original; only keep it if it helped or was required
+        if (len(data) >= original_size and not needs_rotation and not needs_resize
+                and source_format in MIME_TYPES):
+            return PreprocessedImage(image_bytes, MIME_TYPES[source_format], original_size,
+                                     width=image.width, height=image.height)
+
+        return PreprocessedImage(data, MIME_TYPES[output_format], original_size,
+                                 width=image.width, height=image.height,
+                                 grayscale=use_grayscale, reencoded=True)
+
+    def _flatten(self, image: Image.Image) -> Image.Image:
+        """Convert to RGB, compositing any transparency onto white"""
+        if image.mode in ('RGB', 'L'):
+            return image
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        if image.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+    def _should_use_grayscale(self, image: Image.Image) -> bool:
+        """Receipts are mostly black on white; colour only matters when it's really there"""
+        if self.grayscale == 'always':
+            return True
+        if self.grayscale == 'never' or image.mode == 'L':
+            return False
+
+        # Sample a small copy; the mean saturation tells us if there's meaningful colour
+        sample = image.copy()
+        sample.thumbnail((128, 128))
+        saturation = ImageStat.Stat(sample.convert('HSV').getchannel('S')).mean[0]
+        return saturation < GRAYSCALE_SATURATION_THRESHOLD
+
+    def _encode(self, image: Image.Image, prefer_png: bool = False):
+        """Encode to the smallest acceptable format, stepping JPEG quality down to the target"""
+        if prefer_png:
+            # Screenshots compress well losslessly and keep text crisp
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', optimize=True)
+            if buffer.tell() <= self.target_bytes:
+                return buffer.getvalue(), 'PNG'
+
+        data = b''
+        quality = IMAGE_START_QUALITY
+        while quality >= IMAGE_MIN_QUALITY:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            data = buffer.getvalue()
+            if len(data) <= self.target_bytes:
+                break
+            quality -= 10
+
+        return data, 'JPEG'
@@ -0,0 +1,108 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from src.models.user import db
+from src.models.expense import Expense, CreditCardTransaction
+from src.services.merchant_index import MerchantTrigramIndex, MERCHANT_SIMILARITY_THRESHOLD
+
+MERCHANT_SOURCES = (Expense, CreditCardTransaction)
+
+class KnownMerchants:
+    """Process-wide trigram index over every normalized merchant in expenses and card transactions.
+
+    Built lazily with one grouped scan per table, then kept current from
+    committed ORM writes: new merchants are added in place, while a delete
+    or a changed merchant, whose old key may now be unused, marks the index
+    for a rebuild on the next search.
+    """
+
+    def __init__(self):
+        self._index: Optional[MerchantTrigramIndex] = None
+        self._examples: Dict[str, str] = {}  # merchant_key -> a raw spelling to display
+        self._lock = threading.Lock()
+
+    def search(self, merchant: str, min_score: float = MERCHANT_SIMILARITY_THRESHOLD,
+               limit: int = 10) -> List[Tuple[str, str, float]]:
+        """Return (merchant_key, merchant, score) for known merchants similar to merchant, best first"""
+        with self._lock:
+            if self._index is None:
+                self._load()
+            return [(key, self._examples[key], score)
+                    for key, score in self._index.search(merchant, min_score=min_score, limit=limit)]
+
+    def add(self, merchants: Dict[str, str]):
+        """Index newly written merchant keys; a no-op until the index has been built"""
+        with self._lock:
+            if self._index is None:
+                return
+            for key, merchant in merchants.items():
+                if key not in self._examples:
+                    self._examples[key] = merchant
+                    self._index.add(key)
+
+    def invalidate(self):
+        """Drop the index so the next search rebuilds it"""
+        with self._lock:
+            self._index = None
+            self._examples = {}
+
+    def _load(self):
+        examples = {}
+        for model in MERCHANT_SOURCES:
+            for key, merchant in db.session.query(model.merchant_key, db.func.min(model.merchant)) \
+                    .filter(model.merchant_key.isnot(None), model.merchant_key != '') \
+                    .group_by(model.merchant_key):
+                examples.setdefault(key, merchant)
+        self._examples = examples
+        self._index = MerchantTrigramIndex(examples)
+
+_known_merchants: Optional[KnownMerchants] = None
+_known_merchants_lock = threading.Lock()
+
+def get_known_merchants() -> KnownMerchants:
+    """Return the process-wide known merchant index"""
+    global _known_merchants
+    if _known_merchants is None:
+        with _known_merchants_lock:
+            if _known_merchants is None:
+                _known_merchants = KnownMerchants()
+    return _known_merchants
+
+def _collect_merchants(session: Session, flush_context, instances):
+    """before_flush: note merchants this transaction adds, and whether any may have gone away"""
+    changes = session.info.setdefault('merchant_changes', {'added': {}, 'stale': False})
+    for obj in session.new:
+        if type(obj) in MERCHANT_SOURCES and obj.merchant_key:
+            changes['added'].setdefault(obj.merchant_key, obj.merchant)
+    for obj in session.deleted:
+        if type(obj) in MERCHANT_SOURCES:
+            changes['stale'] = True
+    for obj in session.dirty:
+        if type(obj) in MERCHANT_SOURCES and inspect(obj).attrs['merchant_key'].history.has_changes():
+            changes['stale'] = True
+            if obj.merchant_key:
+                changes['added'].setdefault(obj.merchant_key, obj.merchant)
+
+def _apply_merchants(session: Session):
+    """after_commit: the written merchants are now visible to every session"""
+    changes = session.info.pop('merchant_changes', None)
+    if not changes:
+        return
+    if changes['stale']:
+        get_known_merchants().invalidate()
+    elif changes['added']:
+        get_known_merchants().add(changes['added'])
+
+def _discard_merchants(session: Session, previous_transaction=None):
+    session.info.pop('merchant_changes', None)
+
+def register_known_merchant_listeners():
+    """Keep the known merchant index in step with committed ORM writes.
+
+    Bulk query.update()/delete() bypass the ORM and need invalidate().
+    """
+    for name, listener in (('before_flush', _collect_merchants), ('after_commit', _apply_merchants),
+                           ('after_soft_rollback', _discard_merchants)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
@@ -0,0 +1,155 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+import httpx
+import openai
+from src.services.llm_scheduler import LLMScheduler, LLMUnavailableError, PRIORITY_EXTRACTION
+
+# Configuration
+# Point LLM_BASE_URL at a local OpenAI-compatible stub (e.g. http://localhost:8089/v1)
+# to run without the real API
+LLM_BASE_URL = os.environ.get('LLM_BASE_URL')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 10))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 4))
+LLM_BACKOFF_BASE = 0.5  # seconds; doubles every attempt
+LLM_BACKOFF_MAX = 30.0
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 20))
+LLM_KEEPALIVE_EXPIRY = 30.0
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+class LLMClient:
+    """Process-wide OpenAI client with pooled connections and coordinated retries"""
+
+    def __init__(self, base_url: Optional[str] = LLM_BASE_URL, max_retries: int = LLM_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.scheduler = LLMScheduler()
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        )
+
+        api_key = os.environ.get('OPENAI_API_KEY')
+        if base_url and not api_key:
+            api_key = 'stub'  # Local stubs don't check keys
+
+        # Retries are ours, so the SDK must not retry underneath us
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.http_client,
+            max_retries=0
+        )
+
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'retries': 0, 'failures': 0}
+
+    def chat_completion(self, priority: int = PRIORITY_EXTRACTION, **kwargs):
+        """Create a chat completion, retrying transient failures with jittered backoff.
+
+        Every attempt is admitted by the scheduler in its priority class, and
+        raises LLMUnavailableError without calling out while the circuit is open.
+        """
+        self._count('requests')
+        attempt = 0
+
+        while True:
+            try:
+                with self.scheduler.slot(priority):
+                    try:
+                        response = self.client.chat.completions.create(**kwargs)
+                    except Exception as e:
+                        if self._is_provider_failure(e):
+                            self.scheduler.breaker.record_failure()
+                        else:
+                            self.scheduler.breaker.record_success()
+                        raise
+                    self.scheduler.breaker.record_success()
+                    return response
+            except LLMUnavailableError:
+                self._count('failures')
+                raise
+            except Exception as e:
+                if not self._is_retryable(e) or attempt >= self.max_retries:
+                    self._count('failures')
+                    raise
+                delay = self._retry_delay(attempt, e)
+                attempt += 1
+                self._count('retries')
+                time.sleep(delay)
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+        return False
+
+    def _is_provider_failure(self, error: Exception) -> bool:
+        """Errors that say the provider is unhealthy, as opposed to busy or rejecting the request"""
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Honor the provider's Retry-After, else use exponential backoff with full jitter"""
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, LLM_BACKOFF_MAX)
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    def _retry_after(self, error: Exception) -> Optional[float]:
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+
+        headers = response.headers
+        retry_after_ms = headers.get('retry-after-ms')
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+
+        retry_after = headers.get('retry-after')
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            # HTTP-date form
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats['scheduler'] = self.scheduler.get_stats()
+        return stats
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+def get_llm_client() -> LLMClient:
+    """Return the process-wide LLM client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
@@ -0,0 +1,200 @@
+import os
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+# Priority classes, most urgent first
+PRIORITY_INTERACTIVE = 0  # chat and insights a user is waiting on
+PRIORITY_EXTRACTION = 1   # receipt extraction
+PRIORITY_BULK = 2         # statement parsing and categorization
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_EXTRACTION: 'extraction',
+    PRIORITY_BULK: 'bulk'
+}
+
+# Configuration
+CLASS_CONCURRENCY = {
+    PRIORITY_INTERACTIVE: int(os.environ.get('LLM_INTERACTIVE_CONCURRENCY', 8)),
+    PRIORITY_EXTRACTION: int(os.environ.get('LLM_EXTRACTION_CONCURRENCY', 4)),
+    PRIORITY_BULK: int(os.environ.get('LLM_BULK_CONCURRENCY', 4))
+}
+# How long a call may wait for a slot before giving up
+CLASS_QUEUE_TIMEOUT = {
+    PRIORITY_INTERACTIVE: 30.0,
+    PRIORITY_EXTRACTION: 120.0,
+    PRIORITY_BULK: 600.0
+}
+LLM_RATE_PER_SECOND = float(os.environ.get('LLM_RATE_PER_SECOND', 5))
+LLM_RATE_BURST = int(os.environ.get('LLM_RATE_BURST', 10))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('LLM_CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_SECONDS = float(os.environ.get('LLM_CIRCUIT_RESET_SECONDS', 30))
+
+class LLMUnavailableError(Exception):
+    """Raised instead of calling the provider while it is unhealthy or saturated"""
+    pass
+
+class TokenBucket:
+    """Request-rate budget; not thread-safe on its own, callers hold the scheduler lock"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_take(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class CircuitBreaker:
+    """Open after consecutive provider failures, then let one probe call through"""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self.probe_in_flight = False
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def cancel_probe(self):
+        """Give the probe slot back when the admitted call never reached the provider"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'seconds_until_probe': max(0.0, round(self.reset_seconds - (time.monotonic() - self.opened_at), 1))
+                if self.state == 'open' else 0.0
+            }
+
+class LLMScheduler:
+    """Admit model calls by priority under per-class concurrency and a shared rate budget.
+
+    Waiting calls are served highest priority first (FIFO within a class),
+    skipping classes that are at their concurrency limit, so a backlog of
+    bulk categorization never delays an interactive chat request.
+    """
+
+    def __init__(self):
+        self.limits = dict(CLASS_CONCURRENCY)
+        self.active = {priority: 0 for priority in self.limits}
+        self.bucket = TokenBucket(LLM_RATE_PER_SECOND, LLM_RATE_BURST)
+        self.breaker = CircuitBreaker()
+        self._cond = threading.Condition()
+        self._waiting = set()
+        self._sequence = itertools.count()
+        self._counters = {name: {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'total_wait_ms': 0.0}
+                          for name in PRIORITY_NAMES.values()}
+
+    @contextmanager
+    def slot(self, priority: int):
+        """Hold a call slot for the duration of one provider request"""
+        self._acquire(priority)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active[priority] -= 1
+                self._cond.notify_all()
+
+    def _acquire(self, priority: int):
+        counters = self._counters[PRIORITY_NAMES[priority]]
+        if not self.breaker.allow():
+            with self._cond:
+                counters['rejected'] += 1
+            raise LLMUnavailableError('AI provider is temporarily unavailable')
+
+        ticket = (priority, next(self._sequence))
+        started = time.monotonic()
+        deadline = started + CLASS_QUEUE_TIMEOUT[priority]
+
+        with self._cond:
+            self._waiting.add(ticket)
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        counters['timed_out'] += 1
+                        self.breaker.cancel_probe()
+                        raise LLMUnavailableError('AI provider is busy, please retry shortly')
+
+                    if self._is_next(ticket):
+                        wait = self.bucket.try_take()
+                        if wait == 0:
+                            break
+                        self._cond.wait(min(wait, remaining))
+                    else:
+                        self._cond.wait(remaining)
+            finally:
+                self._waiting.discard(ticket)
+                self._cond.notify_all()
+
+            self.active[priority] += 1
+            counters['admitted'] += 1
+            counters['total_wait_ms'] += (time.monotonic() - started) * 1000
+
+    def _is_next(self, ticket) -> bool:
+        """True when ticket is the most urgent waiter whose class has a free slot"""
+        eligible = [t for t in self._waiting if self.active[t[0]] < self.limits[t[0]]]
+        return bool(eligible) and min(eligible) == ticket
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            classes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                counters = dict(self._counters[name])
+                counters['avg_wait_ms'] = round(counters.pop('total_wait_ms') / counters['admitted'], 1) \
+                    if counters['admitted'] else 0.0
+                counters['active'] = self.active[priority]
+                counters['limit'] = self.limits[priority]
+                counters['waiting'] = sum(1 for t in self._waiting if t[0] == priority)
+                classes[name] = counters
+
+        return {
+            'classes': classes,
+            'rate_per_second': self.bucket.rate,
+            'circuit': self.breaker.get_stats()
+        }
@@ -0,0 +1,61 @@
+import os
+from collections import defaultdict
+from typing import Dict, List, Tuple, Iterable
+from src.services.merchant_normalizer import normalize_merchant, trigrams
+
+# Configuration
+MERCHANT_SIMILARITY_THRESHOLD = float(os.environ.get('MERCHANT_SIMILARITY_THRESHOLD', 0.6))
+
+class MerchantTrigramIndex:
+    """Inverted index from character trigrams to merchant keys for fuzzy lookup.
+
+    Scores are Dice coefficients over trigram sets, so "starbuck" still finds
+    "starbucks" while unrelated names sharing a word score low.
+    """
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self._postings: Dict[str, set] = defaultdict(set)
+        self._grams: Dict[str, frozenset] = {}
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def add(self, merchant_key: str):
+        if not merchant_key or merchant_key in self._grams:
+            return
+        grams = trigrams(merchant_key)
+        self._grams[merchant_key] = grams
+        for gram in grams:
+            self._postings[gram].add(merchant_key)
+
+    def remove(self, merchant_key: str):
+        grams = self._grams.pop(merchant_key, None)
+        for gram in grams or ():
+            self._postings[gram].discard(merchant_key)
+            if not self._postings[gram]:
+                del self._postings[gram]
+
+    def search(self, merchant: str, min_score: float = MERCHANT_SIMILARITY_THRESHOLD,
+               limit: int = 10, normalized: bool = False) -> List[Tuple[str, float]]:
+        """Return (merchant_key, score) pairs scoring at least min_score, best first"""
+        key = merchant if normalized else normalize_merchant(merchant)
+        grams = trigrams(key)
+        if not grams:
+            return []
+
+        # Count shared trigrams only for keys that share at least one
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                shared[candidate] += 1
+
+        results = []
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self._grams[candidate]))
+            if score >= min_score:
+                results.append((candidate, round(score, 4)))
+
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
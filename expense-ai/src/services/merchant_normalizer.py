@@ -0,0 +1,60 @@
+import re
+
+# Payment processors that prefix the real merchant, e.g. "SQ *BLUE BOTTLE"
+PROCESSOR_PREFIXES = {'SQ', 'TST', 'SP', 'PY', 'PAYPAL', 'GOOGLE', 'IN', 'PP'}
+
+_TOKEN_SPLIT = re.compile(r"[^A-Z0-9&'-]+")
+_NOISE_TOKEN = re.compile(r'''
+    ^\#?\d[\d-]*$         # store numbers and reference codes: 1234, #0042, 555-1234
+    | ^[A-Z]*\d[A-Z\d]*$  # mixed codes: 2K3JX8, F12345
+''', re.VERBOSE)
+_DOMAIN = re.compile(r'^(?:[A-Z0-9-]+\.)*([A-Z0-9-]+)\.(?:COM|NET|ORG|CO|IO)(?:/\S*)?$')
+
+def normalize_merchant(merchant: str) -> str:
+    """Reduce a statement or receipt merchant name to a stable lookup key.
+
+    "STARBUCKS #1234" -> "starbucks", "UBER *TRIP HELP.UBER.COM" -> "uber",
+    "SQ *BLUE BOTTLE 19" -> "blue bottle", "PAYPAL *NETFLIX.COM" -> "netflix".
+    """
+    if not merchant:
+        return ''
+    name = merchant.upper().strip()
+
+    if '*' in name:
+        prefix, _, rest = name.partition('*')
+        if prefix.strip() in PROCESSOR_PREFIXES:
+            name = rest  # The merchant comes after the processor
+        elif prefix.strip():
+            name = prefix  # "UBER *TRIP", "AMZN MKTP US*2K3": the detail after * varies
+
+    tokens = []
+    for raw in name.split():
+        domain = _DOMAIN.match(raw)
+        if domain:
+            # A web address names the merchant only when nothing else does
+            if not tokens:
+                tokens.append(domain.group(1))
+            continue
+        if _NOISE_TOKEN.search(raw):
+            continue
+        tokens.extend(t for t in _TOKEN_SPLIT.split(raw) if t.strip('-') and not _NOISE_TOKEN.search(t))
+
+    return ' '.join(tokens).lower()
+
+def merchant_token_set(merchant_key: str) -> str:
+    """The distinct tokens of a merchant key, sorted and space-separated for storage"""
+    return ' '.join(sorted(set(merchant_key.split())))
+
+def trigrams(merchant_key: str) -> frozenset:
+    """Character trigrams of each word, padded so short names and word edges still count"""
+    grams = set()
+    for word in merchant_key.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+def trigram_similarity(grams1: frozenset, grams2: frozenset) -> float:
+    """Dice coefficient of two trigram sets, from 0.0 to 1.0"""
+    if not grams1 or not grams2:
+        return 0.0
+    return 2 * len(grams1 & grams2) / (len(grams1) + len(grams2))
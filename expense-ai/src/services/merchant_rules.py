@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy.dialects.sqlite import insert
+from src.models.user import db
+from src.models.merchant_rule import MerchantCategoryRule
+from src.services.merchant_normalizer import normalize_merchant
+
+# Configuration
+MERCHANT_RULE_CACHE_SIZE = int(os.environ.get('MERCHANT_RULE_CACHE_SIZE', 10000))
+
+# Marks a merchant known to have no rule, so repeats skip the database
+_NO_RULE = object()
+
+class MerchantRuleStore:
+    """Learned merchant -> category rules with an in-process LRU in front of the table.
+
+    Rules come from model answers during statement import and from human
+    corrections in receipt review. A human rule is never overwritten by a
+    model answer. Writes join the caller's transaction.
+    """
+
+    def __init__(self, capacity: int = MERCHANT_RULE_CACHE_SIZE):
+        self.capacity = capacity
+        self._cache = OrderedDict()  # merchant_key -> category name or _NO_RULE
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'learned': 0, 'corrections': 0}
+
+    def lookup(self, merchant: str) -> Optional[str]:
+        """Return the category learned for a merchant, or None"""
+        return self.lookup_many([merchant])[0]
+
+    def lookup_many(self, merchants: List[str]) -> List[Optional[str]]:
+        """Look up many merchants with at most one query for the ones not in memory"""
+        keys = [normalize_merchant(merchant) for merchant in merchants]
+        found = {}
+        missing = set()
+
+        with self._lock:
+            for key in keys:
+                if not key or key in found:
+                    continue
+                cached = self._cache.get(key)
+                if cached is None:
+                    missing.add(key)
+                    continue
+                self._cache.move_to_end(key)
+                found[key] = cached
+
+        if missing:
+            rows = db.session.query(MerchantCategoryRule.merchant_key, MerchantCategoryRule.category_name) \
+                .filter(MerchantCategoryRule.merchant_key.in_(missing)).all()
+            loaded = dict(rows)
+            with self._lock:
+                for key in missing:
+                    found[key] = loaded.get(key, _NO_RULE)
+                    self._remember(key, found[key])
+
+        results = []
+        with self._lock:
+            for key in keys:
+                category = found.get(key, _NO_RULE)
+                if category is _NO_RULE:
+                    self._counters['misses'] += 1
+                    results.append(None)
+                else:
+                    self._counters['db_hits' if key in missing else 'memory_hits'] += 1
+                    results.append(category)
+        return results
+
+    def learn(self, merchant: str, category_name: str, category_id: Optional[int] = None,
+              source: str = 'model'):
+        """Record a category for a merchant; model answers never replace a human rule"""
+        key = normalize_merchant(merchant)
+        if not key or not category_name:
+            return
+
+        values = {'merchant_key': key, 'category_name': category_name, 'category_id': category_id,
+                  'source': source, 'example_merchant': merchant[:200], 'updated_at': datetime.utcnow()}
+        statement = insert(MerchantCategoryRule).values(created_at=datetime.utcnow(), **values)
+        update = {name: statement.excluded[name] for name in
+                  ('category_name', 'category_id', 'source', 'example_merchant', 'updated_at')}
+        if source == 'human':
+            db.session.execute(statement.on_conflict_do_update(index_elements=['merchant_key'], set_=update))
+        else:
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['merchant_key'], set_=update,
+                where=MerchantCategoryRule.source != 'human'
+            ))
+
+        with self._lock:
+            self._counters['corrections' if source == 'human' else 'learned'] += 1
+            if source == 'human' or self._cache.get(key) in (None, _NO_RULE):
+                self._remember(key, category_name)
+            else:
+                # A human rule may be in place; let the next lookup reload it
+                self._cache.pop(key, None)
+
+    def invalidate(self):
+        """Drop the in-memory cache, e.g. after a rolled-back transaction"""
+        with self._lock:
+            self._cache.clear()
+
+    def _remember(self, key: str, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['cached'] = len(self._cache)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        stats['memory_hit_rate'] = stats['memory_hits'] / lookups if lookups else 0.0
+        stats['rules'] = MerchantCategoryRule.query.count()
+        return stats
+
+_store: Optional[MerchantRuleStore] = None
+_store_lock = threading.Lock()
+
+def get_merchant_rules() -> MerchantRuleStore:
+    """Return the process-wide merchant rule store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MerchantRuleStore()
+    return _store
@@ -0,0 +1,57 @@
+import os
+from typing import List, Optional
+
+# Configuration
+MAX_PDF_PAGES = int(os.environ.get('RECEIPT_MAX_PDF_PAGES', 20))
+MIN_PAGE_TEXT_CHARS = 40  # less than this is a scan with stray OCR noise, not a text layer
+
+class PdfPage:
+    """Locally extracted content of one PDF page"""
+
+    def __init__(self, page_number: int, text: str, image: Optional[bytes]):
+        self.page_number = page_number
+        self.text = text
+        self.image = image
+
+    @property
+    def has_text_layer(self) -> bool:
+        return len(self.text) >= MIN_PAGE_TEXT_CHARS
+
+def load_pdf_pages(file_path: str, max_pages: int = MAX_PDF_PAGES) -> List[PdfPage]:
+    """Pull the text layer and the main embedded image from each page.
+
+    Images are only read for pages without a usable text layer, since
+    those are the only pages that need the vision model.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("PDF support requires the pypdf package")
+
+    reader = PdfReader(file_path)
+    if reader.is_encrypted:
+        # Most "encrypted" receipts only carry an empty owner password
+        reader.decrypt('')
+
+    pages = []
+    for index, page in enumerate(reader.pages[:max_pages]):
+        text = (page.extract_text() or '').strip()
+        page_content = PdfPage(index + 1, text, None)
+
+        if not page_content.has_text_layer:
+            page_content.image = _largest_image(page)
+
+        pages.append(page_content)
+
+    return pages
+
+def _largest_image(page) -> Optional[bytes]:
+    """Scanned pages are usually one full-page image plus small logos"""
+    largest = None
+    try:
+        for image in page.images:
+            if largest is None or len(image.data) > len(largest):
+                largest = image.data
+    except Exception as e:
+        print(f"Error reading PDF page images: {str(e)}")
+    return largest
@@ -0,0 +1,94 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Iterator
+from flask import current_app
+from src.models.user import db
+from src.models.expense import Receipt
+from src.services.receipt_processor import ReceiptProcessor
+from src.services.receipt_jobs import apply_extraction_result
+
+# Configuration
+BATCH_CONCURRENCY = int(os.environ.get('RECEIPT_BATCH_CONCURRENCY', 8))
+MAX_BATCH_CONCURRENCY = int(os.environ.get('RECEIPT_MAX_BATCH_CONCURRENCY', 16))
+BATCH_COMMIT_SIZE = 20
+
+class ReceiptBatchProcessor:
+    """Extract a batch of stored receipts concurrently on a bounded thread pool"""
+
+    def __init__(self, concurrency: int = BATCH_CONCURRENCY, commit_size: int = BATCH_COMMIT_SIZE):
+        self.concurrency = max(1, min(concurrency, MAX_BATCH_CONCURRENCY))
+        self.commit_size = commit_size
+
+    def process(self, receipts: List[Receipt]) -> Iterator[Dict[str, Any]]:
+        """Extract every receipt, yielding a result per file as it completes.
+
+        Results are written back in batches of commit_size so the database
+        write lock is only held briefly, never across model calls.
+        """
+        if not receipts:
+            return
+
+        app = current_app._get_current_object()
+        jobs = [
+            (receipt.id, receipt.file_path, receipt.filename, receipt.content_hash)
+            for receipt in receipts
+        ]
+        pending = []
+        finished = set()
+
+        executor = ThreadPoolExecutor(max_workers=min(self.concurrency, len(jobs)),
+                                      thread_name_prefix='receipt-batch')
+        try:
+            futures = {executor.submit(self._extract, app, *job): job for job in jobs}
+
+            for future in as_completed(futures):
+                receipt_id, _, filename, _ = futures[future]
+                try:
+                    extracted_data = future.result()
+                except Exception as e:
+                    extracted_data = {"error": str(e), "confidence": 0.0}
+
+                pending.append((receipt_id, extracted_data))
+                finished.add(receipt_id)
+                if len(pending) >= self.commit_size:
+                    self._save(pending)
+                    pending = []
+
+                result = {
+                    'receipt_id': receipt_id,
+                    'filename': filename,
+                    'status': 'failed' if extracted_data.get('error') else 'done'
+                }
+                if extracted_data.get('error'):
+                    result['error'] = extracted_data['error']
+                else:
+                    result['extracted_data'] = extracted_data
+                yield result
+        finally:
+            # Also runs when a streaming client disconnects mid-batch
+            executor.shutdown(wait=False, cancel_futures=True)
+            # Receipts the batch never got to would otherwise stay 'running' and
+            # block reprocessing; a retry is cheap since finished calls were cached
+            pending.extend(
+                (receipt_id, {"error": "Batch was interrupted before this receipt was processed", "confidence": 0.0})
+                for receipt_id, _, _, _ in jobs if receipt_id not in finished
+            )
+            if pending:
+                self._save(pending)
+
+    def _extract(self, app, receipt_id: int, file_path: str, filename: str, content_hash: str) -> Dict[str, Any]:
+        with app.app_context():
+            processor = ReceiptProcessor()
+            return processor.process_receipt_file(file_path, filename, content_hash=content_hash)
+
+    def _save(self, results: List[tuple]):
+        """Write a batch of extraction results in one transaction"""
+        try:
+            for receipt_id, extracted_data in results:
+                receipt = db.session.get(Receipt, receipt_id)
+                if receipt is not None:
+                    apply_extraction_result(receipt, extracted_data)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving receipt batch results: {str(e)}")
@@ -0,0 +1,134 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+from PIL import Image, ImageOps
+from src.services.pdf_pages import load_pdf_pages
+
+# Configuration
+DERIVATIVE_FOLDER = os.environ.get(
+    'RECEIPT_DERIVATIVE_FOLDER',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'derivatives')
+)
+DERIVATIVE_CACHE_MAX_BYTES = int(os.environ.get('RECEIPT_DERIVATIVE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+DERIVATIVE_VERSION = 'v1'  # bump when rendering changes so old derivatives get new ETags
+
+# Longest side in pixels and JPEG quality for each derivative
+DERIVATIVE_SIZES = {
+    'thumb': (240, 70),
+    'review': (1200, 82)
+}
+
+class DerivativeCache:
+    """On-disk cache of resized receipt images, trimmed least recently used first"""
+
+    def __init__(self, folder: str = DERIVATIVE_FOLDER, max_bytes: int = DERIVATIVE_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._render_locks = {}
+        self._entries = None  # path -> size, oldest use first
+        self._total_bytes = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def derivative_key(content_key: str, size: str) -> str:
+        """Stable name (and ETag) for one rendition of one file's content"""
+        return f"{content_key}-{size}-{DERIVATIVE_VERSION}"
+
+    def get_path(self, source_path: str, file_type: str, content_key: str, size: str) -> Optional[str]:
+        """Return the path of a cached derivative, rendering it on first request"""
+        key = self.derivative_key(content_key, size)
+        path = os.path.join(self.folder, f"{key}.jpg")
+
+        with self._lock:
+            self._load_index()
+            if path in self._entries and os.path.exists(path):
+                self._entries.move_to_end(path)
+                return path
+            render_lock = self._render_locks.setdefault(key, threading.Lock())
+
+        # Only one request renders a given derivative; others wait for it
+        try:
+            with render_lock:
+                if not os.path.exists(path):
+                    data = self._render(source_path, file_type, size)
+                    if data is None:
+                        return None
+                    temp_path = f"{path}.{threading.get_ident()}.part"
+                    with open(temp_path, 'wb') as f:
+                        f.write(data)
+                    os.replace(temp_path, path)
+        finally:
+            # Also when nothing could be rendered, e.g. a PDF without images
+            with self._lock:
+                self._render_locks.pop(key, None)
+
+        with self._lock:
+            if path not in self._entries:
+                size_bytes = os.path.getsize(path)
+                self._entries[path] = size_bytes
+                self._total_bytes += size_bytes
+            self._entries.move_to_end(path)
+            self._evict(keep=path)
+
+        return path
+
+    def _load_index(self):
+        """Rebuild the LRU order from file times the first time it's needed"""
+        if self._entries is not None:
+            return
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith('.jpg'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        self._entries = OrderedDict((path, size) for _, path, size in files)
+        self._total_bytes = sum(size for _, _, size in files)
+
+    def _evict(self, keep: str):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, size_bytes = next(iter(self._entries.items()))
+            if path == keep:
+                break
+            del self._entries[path]
+            self._total_bytes -= size_bytes
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _render(self, source_path: str, file_type: str, size: str) -> Optional[bytes]:
+        """Render a JPEG derivative of a receipt image or a PDF's first scanned page"""
+        max_dimension, quality = DERIVATIVE_SIZES[size]
+
+        if file_type == 'pdf':
+            pages = load_pdf_pages(source_path, max_pages=1)
+            if not pages or not pages[0].image:
+                return None  # Text-only PDFs have nothing to show as an image
+            image = Image.open(io.BytesIO(pages[0].image))
+        else:
+            image = Image.open(source_path)
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+        return buffer.getvalue()
+
+_cache: Optional[DerivativeCache] = None
+_cache_lock = threading.Lock()
+
+def get_derivative_cache() -> DerivativeCache:
+    """Return the process-wide derivative cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DerivativeCache()
+    return _cache
@@ -0,0 +1,108 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+from flask import current_app
+from src.models.user import db
+from src.models.expense import Receipt
+from src.services.receipt_processor import ReceiptProcessor
+
+# Configuration
+RECEIPT_WORKERS = int(os.environ.get('RECEIPT_WORKERS', 4))
+MAX_PENDING_JOBS = int(os.environ.get('RECEIPT_MAX_PENDING_JOBS', 100))
+
+class QueueFullError(Exception):
+    """Raised when the extraction queue cannot accept more jobs"""
+    pass
+
+class ReceiptJobQueue:
+    """Bounded worker pool that runs receipt extraction outside the request cycle"""
+
+    def __init__(self, max_workers: int = RECEIPT_WORKERS, max_pending: int = MAX_PENDING_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='receipt-extract')
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def enqueue(self, receipt: Receipt, use_cache: bool = True) -> str:
+        """Mark a receipt as queued, commit it and schedule its extraction.
+
+        The receipt row is committed before the job is submitted so the worker
+        always sees it. Raises QueueFullError when too many jobs are pending.
+        Pass use_cache=False to force a fresh model call.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise QueueFullError('Too many receipts are waiting for processing, please retry shortly')
+
+        try:
+            receipt.job_id = str(uuid.uuid4())
+            receipt.processing_status = 'queued'
+            receipt.processing_error = None
+            db.session.commit()
+        except Exception:
+            self.slots.release()
+            raise
+
+        app = current_app._get_current_object()
+        self.executor.submit(self._run, app, receipt.id, use_cache)
+        return receipt.job_id
+
+    def _run(self, app, receipt_id: int, use_cache: bool):
+        """Worker entry point: extract data for one receipt"""
+        try:
+            with app.app_context():
+                self._process(receipt_id, use_cache)
+        except Exception as e:
+            print(f"Error running receipt job for receipt {receipt_id}: {e}")
+        finally:
+            self.slots.release()
+
+    def _process(self, receipt_id: int, use_cache: bool):
+        receipt = db.session.get(Receipt, receipt_id)
+        if receipt is None:
+            return  # Deleted while queued
+
+        receipt.processing_status = 'running'
+        file_path = receipt.file_path
+        filename = receipt.filename
+        content_hash = receipt.content_hash
+        # Commit so no transaction is held open during the model call
+        db.session.commit()
+
+        try:
+            processor = ReceiptProcessor()
+            extracted_data = processor.process_receipt_file(
+                file_path, filename, use_cache=use_cache, content_hash=content_hash
+            )
+        except Exception as e:
+            extracted_data = {"error": str(e), "confidence": 0.0}
+
+        receipt = db.session.get(Receipt, receipt_id)
+        if receipt is None:
+            return  # Deleted while running
+
+        apply_extraction_result(receipt, extracted_data)
+        db.session.commit()
+
+def apply_extraction_result(receipt: Receipt, extracted_data: Dict[str, Any]):
+    """Record an extraction outcome on a receipt; the caller commits"""
+    receipt.extracted_data = extracted_data
+    if extracted_data.get('error'):
+        receipt.is_processed = False
+        receipt.processing_status = 'failed'
+        receipt.processing_error = extracted_data['error']
+    else:
+        receipt.is_processed = True
+        receipt.processing_status = 'done'
+        receipt.processing_error = None
+
+_queue: Optional[ReceiptJobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_receipt_job_queue() -> ReceiptJobQueue:
+    """Return the process-wide receipt job queue"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = ReceiptJobQueue()
+    return _queue
@@ -1,31 +1,26 @@
 import os
 import json
+import time
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, Optional
-import openai
+from typing import Dict, Any, List, Optional, Tuple
 from PIL import Image
 import io
+from src.services.extraction_cache import ExtractionCache, hash_file
+from src.services.image_preprocessor import ImagePreprocessor, PreprocessedImage
+from src.services.pdf_pages import load_pdf_pages
+from src.services.extraction_router import ExtractionRouter, VISION_MODEL_TIERS, TEXT_MODEL_TIERS
+from src.services.llm_client import get_llm_client
+from src.services.llm_scheduler import PRIORITY_EXTRACTION
 
-class ReceiptProcessor:
-    def __init__(self):
-        self.client = openai.OpenAI()
-    
-    def encode_image(self, image_path: str) -> str:
-        """Encode image to base64 string"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    
-    def extract_receipt_data(self, image_path: str) -> Dict[str, Any]:
-        """Extract expense data from receipt image using OpenAI Vision API"""
-        try:
-            # Encode the image
-            base64_image = self.encode_image(image_path)
-            
-            # Create the prompt for expense data extraction
-            prompt = """
-            Analyze this receipt image and extract the following information in JSON format:
-            
+# Bump PROMPT_VERSION whenever the extraction prompt or validation changes
+# so cached results from the old prompt are no longer served
+PROMPT_VERSION = "v2"
+PDF_PAGE_CONCURRENCY = int(os.environ.get('RECEIPT_PDF_PAGE_CONCURRENCY', 4))
+PDF_SINGLE_CALL_CHARS = 12000  # text PDFs shorter than this go to the model in one call
+
+RECEIPT_FIELDS_PROMPT = """
             {
                 "merchant": "Name of the business/merchant",
                 "amount": "Total amount as a number (e.g., 25.99)",
@@ -43,42 +38,91 @@ class ReceiptProcessor:
             If any information is not clearly visible or cannot be determined, use null for that field.
             Make sure the amount is the total amount paid.
             For the category, choose the most appropriate one from the list provided.
-            """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000
-            )
-            
-            # Parse the JSON response
-            content = response.choices[0].message.content
+"""
+
+# Fields taken from the most confident page when merging a multi-page receipt
+MERGE_BEST_FIELDS = ['merchant', 'date', 'category', 'payment_method', 'address', 'phone']
+# Totals are printed at the end, so these come from the last page that has them
+MERGE_LAST_FIELDS = ['amount', 'tax', 'tip']
+
+class ReceiptProcessor:
+    def __init__(self, cache: Optional[ExtractionCache] = None,
+                 preprocessor: Optional[ImagePreprocessor] = None):
+        self.client = get_llm_client()
+        self.cache = cache or ExtractionCache()
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        # Cheap model first, escalating to the large one on weak answers;
+        # text-layer PDFs don't need vision at all
+        self.vision_router = ExtractionRouter(VISION_MODEL_TIERS)
+        self.text_router = ExtractionRouter(TEXT_MODEL_TIERS)
+    
+    def extractor_version(self) -> str:
+        """Identify the prompt/model/preprocessing combination that produced a result"""
+        return ':'.join([
+            PROMPT_VERSION,
+            self.vision_router.signature(),
+            self.text_router.signature(),
+            self.preprocessor.signature()
+        ])
+    
+    def encode_image(self, image_path: str) -> Tuple[str, PreprocessedImage]:
+        """Normalize an image and encode it to a base64 string"""
+        with open(image_path, "rb") as image_file:
+            return self.encode_image_bytes(image_file.read())
+    
+    def encode_image_bytes(self, image_bytes: bytes) -> Tuple[str, PreprocessedImage]:
+        """Normalize in-memory image bytes and encode them to a base64 string"""
+        image = self.preprocessor.preprocess(image_bytes)
+        return base64.b64encode(image.data).decode('utf-8'), image
+    
+    def extract_receipt_data(self, image_path: str) -> Dict[str, Any]:
+        """Extract expense data from receipt image using OpenAI Vision API"""
+        try:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+        except Exception as e:
+            return {"error": str(e), "confidence": 0.0}
+        return self.extract_receipt_image(image_bytes)
+    
+    def extract_receipt_image(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Extract expense data from receipt image bytes using OpenAI Vision API"""
+        try:
+            # Normalize and encode the image once for every tier
+            base64_image, image = self.encode_image_bytes(image_bytes)
             
-            # Extract JSON from the response (in case there's extra text)
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
+            # Create the prompt for expense data extraction
+            prompt = f"""
+            Analyze this receipt image and extract the following information in JSON format:
+            {RECEIPT_FIELDS_PROMPT}"""
             
-            if start_idx != -1 and end_idx != -1:
-                json_str = content[start_idx:end_idx]
-                extracted_data = json.loads(json_str)
-                
+            def call(model):
+                response = self.client.chat_completion(
+                    priority=PRIORITY_EXTRACTION,
+                    model=model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": prompt},
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:{image.mime_type};base64,{base64_image}"
+                                    }
+                                }
+                            ]
+                        }
+                    ],
+                    max_tokens=1000
+                )
                 # Validate and clean the data
-                return self._validate_extracted_data(extracted_data)
-            else:
-                raise ValueError("No valid JSON found in response")
+                extracted_data = self._parse_json_response(response.choices[0].message.content)
+                return self._validate_extracted_data(extracted_data), response.usage
+            
+            validated_data = self.vision_router.run(call)
+            if not validated_data.get('error'):
+                validated_data['preprocessing'] = image.to_dict()
+            return validated_data
                 
         except Exception as e:
             print(f"Error extracting receipt data: {str(e)}")
@@ -87,12 +131,124 @@ class ReceiptProcessor:
                 "confidence": 0.0
             }
     
+    def extract_receipt_text(self, text: str) -> Dict[str, Any]:
+        """Extract expense data from receipt text with a cheaper text-only model"""
+        prompt = f"""
+            Analyze this receipt text and extract the following information in JSON format:
+            {RECEIPT_FIELDS_PROMPT}
+            Receipt text:
+            {text}
+            """
+        
+        def call(model):
+            response = self.client.chat_completion(
+                priority=PRIORITY_EXTRACTION,
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=1000,
+                temperature=0.1
+            )
+            extracted_data = self._parse_json_response(response.choices[0].message.content)
+            return self._validate_extracted_data(extracted_data), response.usage
+        
+        return self.text_router.run(call)
+    
+    def extract_pdf_receipt(self, file_path: str) -> Dict[str, Any]:
+        """Extract a PDF receipt page by page and merge the results.
+        
+        Pages with a text layer use text extraction; scanned pages send their
+        embedded image to the vision model. Pages are extracted in parallel.
+        """
+        try:
+            pages = load_pdf_pages(file_path)
+        except Exception as e:
+            return {"error": f"Could not read PDF: {str(e)}", "confidence": 0.0}
+        
+        pages = [page for page in pages if page.has_text_layer or page.image]
+        if not pages:
+            return {"error": "No text or images found in PDF", "confidence": 0.0}
+        
+        # Short e-receipts are cheapest and most coherent as one text call
+        if all(page.has_text_layer for page in pages):
+            full_text = '\n\n'.join(page.text for page in pages)
+            if len(full_text) <= PDF_SINGLE_CALL_CHARS:
+                result = self.extract_receipt_text(full_text)
+                if not result.get('error'):
+                    result['pages'] = len(pages)
+                    result['extraction_mode'] = 'text'
+                return result
+        
+        def extract_page(page):
+            if page.has_text_layer:
+                return self.extract_receipt_text(page.text)
+            return self.extract_receipt_image(page.image)
+        
+        with ThreadPoolExecutor(max_workers=min(PDF_PAGE_CONCURRENCY, len(pages))) as executor:
+            page_results = list(executor.map(extract_page, pages))
+        
+        modes = {'text' if page.has_text_layer else 'vision' for page in pages}
+        merged = self._merge_page_results(page_results)
+        if not merged.get('error'):
+            merged['pages'] = len(pages)
+            merged['extraction_mode'] = modes.pop() if len(modes) == 1 else 'mixed'
+        return merged
+    
+    def _merge_page_results(self, page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combine per-page extractions (in page order) into one receipt record"""
+        successful = [result for result in page_results if not result.get('error')]
+        if not successful:
+            return page_results[0]
+        if len(successful) == 1:
+            return successful[0]
+        
+        by_confidence = sorted(successful, key=lambda r: r.get('confidence', 0.0), reverse=True)
+        merged = dict(by_confidence[0])
+        merged.pop('preprocessing', None)
+        merged.pop('routing', None)
+        
+        for field in MERGE_BEST_FIELDS:
+            for result in by_confidence:
+                if field not in result.get('defaulted_fields', []) and result.get(field) is not None:
+                    merged[field] = result[field]
+                    break
+        
+        for field in MERGE_LAST_FIELDS:
+            for result in reversed(successful):
+                if field not in result.get('defaulted_fields', []) and result.get(field) is not None:
+                    merged[field] = result[field]
+                    break
+        
+        merged['items'] = [item for result in successful for item in result.get('items', [])]
+        merged['defaulted_fields'] = [
+            field for field in by_confidence[0].get('defaulted_fields', [])
+            if all(field in result.get('defaulted_fields', []) for result in successful)
+        ]
+        
+        # Pages that failed make the whole record less trustworthy
+        mean_confidence = sum(r.get('confidence', 0.0) for r in successful) / len(successful)
+        merged['confidence'] = round(mean_confidence * len(successful) / len(page_results), 3)
+        
+        return merged
+    
+    def _parse_json_response(self, content: str) -> Dict[str, Any]:
+        """Extract the JSON object from a model response (in case there's extra text)"""
+        start_idx = content.find('{') if content else -1
+        end_idx = content.rfind('}') + 1 if content else 0
+        
+        if start_idx == -1 or end_idx <= start_idx:
+            raise ValueError("No valid JSON found in response")
+        
+        return json.loads(content[start_idx:end_idx])
+    
     def _validate_extracted_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Validate and clean extracted data"""
         validated_data = {}
+        defaulted_fields = []
         
         # Merchant name
-        validated_data['merchant'] = data.get('merchant', 'Unknown Merchant')
+        validated_data['merchant'] = data.get('merchant') or 'Unknown Merchant'
+        if not data.get('merchant'):
+            defaulted_fields.append('merchant')
         
         # Amount - ensure it's a float
         try:
@@ -104,8 +260,10 @@ class ReceiptProcessor:
                 validated_data['amount'] = float(amount)
             else:
                 validated_data['amount'] = 0.0
+                defaulted_fields.append('amount')
         except (ValueError, TypeError):
             validated_data['amount'] = 0.0
+            defaulted_fields.append('amount')
         
         # Date - validate format
         try:
@@ -116,8 +274,10 @@ class ReceiptProcessor:
                 validated_data['date'] = date_str
             else:
                 validated_data['date'] = datetime.now().strftime('%Y-%m-%d')
+                defaulted_fields.append('date')
         except (ValueError, TypeError):
             validated_data['date'] = datetime.now().strftime('%Y-%m-%d')
+            defaulted_fields.append('date')
         
         # Items
         validated_data['items'] = data.get('items', [])
@@ -132,6 +292,8 @@ class ReceiptProcessor:
         ]
         category = data.get('category', 'Other')
         validated_data['category'] = category if category in valid_categories else 'Other'
+        if category not in valid_categories:
+            defaulted_fields.append('category')
         
         # Optional fields
         validated_data['tax'] = self._safe_float(data.get('tax'))
@@ -147,6 +309,9 @@ class ReceiptProcessor:
         except (ValueError, TypeError):
             validated_data['confidence'] = 0.5
         
+        # Fields the model didn't supply, so a reviewer knows what to check
+        validated_data['defaulted_fields'] = defaulted_fields
+        
         return validated_data
     
     def _safe_float(self, value) -> Optional[float]:
@@ -160,35 +325,49 @@ class ReceiptProcessor:
         except (ValueError, TypeError):
             return None
     
-    def process_receipt_file(self, file_path: str, filename: str) -> Dict[str, Any]:
+    def process_receipt_file(self, file_path: str, filename: str, use_cache: bool = True,
+                             content_hash: Optional[str] = None) -> Dict[str, Any]:
         """Process a receipt file and return extracted data"""
         try:
             # Check if file exists
             if not os.path.exists(file_path):
                 return {"error": "File not found", "confidence": 0.0}
             
-            # Get file extension
-            file_ext = os.path.splitext(filename)[1].lower()
+            # Repeat uploads of the same file are served from the cache
+            content_hash = content_hash or hash_file(file_path)
+            version = self.extractor_version()
+            if use_cache:
+                cached = self.cache.get(content_hash, version)
+                if cached is not None:
+                    return cached
             
-            # For now, we'll handle images. PDF support can be added later
-            if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
-                return self.extract_receipt_data(file_path)
-            elif file_ext == '.pdf':
-                # For PDF files, we'd need to convert to images first
-                # This is a placeholder for PDF processing
-                return {
-                    "error": "PDF processing not yet implemented",
-                    "confidence": 0.0
-                }
-            else:
-                return {
-                    "error": f"Unsupported file type: {file_ext}",
-                    "confidence": 0.0
-                }
+            started = time.perf_counter()
+            extracted_data = self._extract_file(file_path, filename)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            
+            # Only successful extractions are worth remembering
+            if not extracted_data.get('error'):
+                self.cache.put(content_hash, version, extracted_data, elapsed_ms)
+            
+            return extracted_data
                 
         except Exception as e:
             return {
                 "error": str(e),
                 "confidence": 0.0
             }
-
+    
+    def _extract_file(self, file_path: str, filename: str) -> Dict[str, Any]:
+        """Dispatch a receipt file to the extractor for its type"""
+        # Get file extension
+        file_ext = os.path.splitext(filename)[1].lower()
+        
+        if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
+            return self.extract_receipt_data(file_path)
+        elif file_ext == '.pdf':
+            return self.extract_pdf_receipt(file_path)
+        else:
+            return {
+                "error": f"Unsupported file type: {file_ext}",
+                "confidence": 0.0
+            }
@@ -0,0 +1,219 @@
+import os
+import time
+import threading
+from typing import Dict, Any, Iterable, BinaryIO, Optional
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from src.models.user import db
+from src.models.expense import Receipt
+from src.models.storage import StoredBlob
+from src.services.upload_storage import stream_to_temp_file, StoredUpload, TEMP_PREFIX
+
+# Configuration
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
+ORPHAN_GRACE_SECONDS = int(os.environ.get('RECEIPT_ORPHAN_GRACE_SECONDS', 3600))  # leave in-flight uploads alone
+ORPHAN_SWEEP_INTERVAL = int(os.environ.get('RECEIPT_ORPHAN_SWEEP_INTERVAL', 6 * 3600))  # 0 disables the sweeper
+
+class ReceiptStorage:
+    """Content-addressed receipt files at hash-sharded paths, shared by reference count.
+
+    Identical uploads are stored once at uploads/ab/cd/<sha256>.<ext>. A
+    StoredBlob row counts the receipts using each file, and the file is only
+    removed when the last one goes away. Blob changes are committed straight
+    away under a process lock so a release can never delete a file that a
+    concurrent upload just claimed; the orphan sweeper repairs anything a
+    crash leaves inconsistent.
+    """
+
+    def __init__(self, root: str = UPLOAD_FOLDER):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob_path(self, content_hash: str, file_type: str) -> str:
+        """Two levels of 256-way sharding keep every directory small"""
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], f"{content_hash}.{file_type}")
+
+    def store(self, stream: BinaryIO, max_size: int, allowed_types: Iterable[str],
+              expected_type: Optional[str] = None) -> StoredUpload:
+        """Stream an upload in and add a reference to its content's blob"""
+        stored = stream_to_temp_file(stream, self.root, max_size, allowed_types, expected_type)
+
+        try:
+            with self._lock:
+                blob = StoredBlob.query.filter_by(content_hash=stored.content_hash).first()
+                if blob is not None and os.path.exists(blob.file_path):
+                    # Duplicate content: keep the copy we already have, touching
+                    # it so the sweeper's grace period covers this new reference
+                    os.remove(stored.path)
+                    path = blob.file_path
+                    os.utime(path)
+                else:
+                    path = self.blob_path(stored.content_hash, stored.file_type)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(stored.path, path)
+
+                db.session.execute(
+                    insert(StoredBlob)
+                    .values(content_hash=stored.content_hash, file_path=path,
+                            size=stored.size, ref_count=1)
+                    .on_conflict_do_update(
+                        index_elements=['content_hash'],
+                        set_={'ref_count': StoredBlob.ref_count + 1, 'file_path': path}
+                    )
+                )
+                db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            if os.path.exists(stored.path):
+                os.remove(stored.path)
+            raise
+
+        stored.path = path
+        return stored
+
+    def release(self, content_hash: Optional[str], file_path: str):
+        """Drop one reference, deleting the file when nothing else uses it.
+
+        Receipts stored before content addressing have no blob row; their
+        file is removed once no other receipt points at it.
+        """
+        with self._lock:
+            blob = StoredBlob.query.filter_by(content_hash=content_hash).first() if content_hash else None
+
+            if blob is None:
+                if Receipt.query.filter_by(file_path=file_path).count() == 0 and os.path.exists(file_path):
+                    os.remove(file_path)
+                return
+
+            StoredBlob.query.filter_by(id=blob.id).update(
+                {'ref_count': StoredBlob.ref_count - 1}, synchronize_session=False
+            )
+            db.session.commit()
+            db.session.refresh(blob)
+
+            if blob.ref_count <= 0:
+                path = blob.file_path
+                db.session.delete(blob)
+                db.session.commit()
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def sweep_orphans(self, grace_seconds: int = ORPHAN_GRACE_SECONDS) -> Dict[str, Any]:
+        """Reconcile files on disk, blob rows and Receipt.file_path.
+
+        Reference counts are reset from the receipts that actually use each
+        blob, unreferenced blobs and stray files older than the grace period
+        are deleted, and receipts whose file is gone are counted.
+        """
+        cutoff = time.time() - grace_seconds
+        stats = {'blobs_checked': 0, 'ref_counts_fixed': 0, 'blobs_removed': 0,
+                 'files_removed': 0, 'bytes_freed': 0, 'missing_files': 0}
+
+        # Snapshot without the lock so uploads and releases are never held up
+        # by the scan; each candidate is re-checked under the lock before acting
+        references = dict(
+            db.session.query(Receipt.file_path, func.count(Receipt.id))
+            .group_by(Receipt.file_path).all()
+        )
+        blobs = db.session.query(StoredBlob.id, StoredBlob.file_path, StoredBlob.ref_count).all()
+        db.session.rollback()
+        known_paths = set(references)
+        known_paths.update(path for _, path, _ in blobs)
+        stats['blobs_checked'] = len(blobs)
+
+        for blob_id, path, ref_count in blobs:
+            actual = references.get(path, 0)
+            if actual == ref_count or (actual == 0 and self._mtime(path) > cutoff):
+                continue
+            with self._lock:
+                self._reconcile_blob(blob_id, cutoff, stats)
+
+        stray = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if path in known_paths or self._mtime(path) > cutoff:
+                    continue
+                # Unreferenced blobs, legacy flat files and abandoned temp files
+                if filename.startswith(TEMP_PREFIX) or not filename.startswith('.'):
+                    stray.append(path)
+
+        for path in stray:
+            with self._lock:
+                self._remove_stray(path, cutoff, stats)
+
+        stats['missing_files'] = sum(1 for path in references if not os.path.exists(path))
+        return stats
+
+    def _reconcile_blob(self, blob_id: int, cutoff: float, stats: Dict[str, Any]):
+        """Reset one blob's reference count, or delete it if nothing uses it; caller holds the lock"""
+        blob = db.session.get(StoredBlob, blob_id)
+        if blob is None:
+            return
+        actual = Receipt.query.filter_by(file_path=blob.file_path).count()
+        if actual > 0:
+            if blob.ref_count != actual:
+                blob.ref_count = actual
+                stats['ref_counts_fixed'] += 1
+                db.session.commit()
+            return
+        if self._mtime(blob.file_path) > cutoff:
+            return  # Probably an upload whose receipt isn't committed yet
+        path = blob.file_path
+        db.session.delete(blob)
+        db.session.commit()
+        if os.path.exists(path):
+            stats['bytes_freed'] += os.path.getsize(path)
+            os.remove(path)
+        stats['blobs_removed'] += 1
+
+    def _remove_stray(self, path: str, cutoff: float, stats: Dict[str, Any]):
+        """Delete a file no blob or receipt points at; caller holds the lock"""
+        if self._mtime(path) > cutoff or not os.path.exists(path):
+            return
+        if (StoredBlob.query.filter_by(file_path=path).first() is not None
+                or Receipt.query.filter_by(file_path=path).first() is not None):
+            return
+        stats['bytes_freed'] += os.path.getsize(path)
+        os.remove(path)
+        stats['files_removed'] += 1
+
+    @staticmethod
+    def _mtime(path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+_storage: Optional[ReceiptStorage] = None
+_storage_lock = threading.Lock()
+
+def get_receipt_storage() -> ReceiptStorage:
+    """Return the process-wide receipt storage"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = ReceiptStorage()
+    return _storage
+
+def start_orphan_sweeper(app, interval: int = ORPHAN_SWEEP_INTERVAL) -> Optional[threading.Thread]:
+    """Run sweep_orphans every interval seconds on a daemon thread"""
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    stats = get_receipt_storage().sweep_orphans()
+                if stats['blobs_removed'] or stats['files_removed'] or stats['ref_counts_fixed']:
+                    print(f"Receipt storage sweep: {stats}")
+            except Exception as e:
+                print(f"Error sweeping receipt storage: {str(e)}")
+
+    thread = threading.Thread(target=run, name='receipt-orphan-sweeper', daemon=True)
+    thread.start()
+    return thread
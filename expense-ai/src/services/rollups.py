@@ -0,0 +1,203 @@
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import event, inspect, func, select, literal, insert as sql_insert
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from src.models.user import db
+from src.models.expense import Expense, CreditCardTransaction
+from src.models.rollup import CategoryMonthRollup, MerchantMonthRollup
+
+# Which rollup source each model feeds, and the columns its buckets depend on
+ROLLUP_SOURCES = {
+    Expense: ('expense', ('date', 'amount', 'category_id', 'merchant', 'merchant_key')),
+    CreditCardTransaction: ('card', ('date', 'amount', 'category_id', 'merchant', 'merchant_key', 'status'))
+}
+
+def _bucket_values(obj, old: bool) -> Optional[Dict[str, Any]]:
+    """The row's rollup-relevant values, as last flushed (old) or as pending"""
+    _, columns = ROLLUP_SOURCES[type(obj)]
+    state = inspect(obj)
+    values = {}
+    for name in columns:
+        if old:
+            # Loads expired values; active_history keeps the replaced ones
+            history = state.attrs[name].load_history()
+            if history.deleted:
+                values[name] = history.deleted[0]
+                continue
+            if history.unchanged:
+                values[name] = history.unchanged[0]
+                continue
+        values[name] = getattr(obj, name)
+        if values[name] is None and state.key is None:
+            # Not inserted yet, so the column default the INSERT will apply
+            default = state.mapper.columns[name].default
+            if default is not None and default.is_scalar:
+                values[name] = default.arg
+    if values['date'] is None or values['amount'] is None:
+        return None
+    return values
+
+def _add(deltas: Dict[str, Dict[Tuple, list]], source: str, values: Optional[Dict[str, Any]], sign: int):
+    if values is None:
+        return
+    month = values['date'].strftime('%Y-%m')
+    amount = float(values['amount']) * sign
+
+    category = deltas['category'][(source, month, values['category_id'] or 0, values.get('status') or '')]
+    category[0] += sign
+    category[1] += amount
+
+    merchant_key = values['merchant_key'] or values['merchant']
+    merchant = deltas['merchant'][(source, month, merchant_key)]
+    merchant[0] += sign
+    merchant[1] += amount
+    merchant[2] = merchant[2] or values['merchant']
+
+def _collect_deltas(session: Session, flush_context, instances):
+    """before_flush: turn pending inserts, updates and deletes into bucket deltas"""
+    deltas = session.info.setdefault('rollup_deltas', {
+        'category': defaultdict(lambda: [0, 0.0]),
+        'merchant': defaultdict(lambda: [0, 0.0, None])
+    })
+
+    with session.no_autoflush:
+        for obj in session.new:
+            if type(obj) in ROLLUP_SOURCES:
+                _add(deltas, ROLLUP_SOURCES[type(obj)][0], _bucket_values(obj, old=False), 1)
+
+        for obj in session.deleted:
+            if type(obj) in ROLLUP_SOURCES and inspect(obj).persistent:
+                _add(deltas, ROLLUP_SOURCES[type(obj)][0], _bucket_values(obj, old=True), -1)
+
+        for obj in session.dirty:
+            if type(obj) not in ROLLUP_SOURCES:
+                continue
+            source, columns = ROLLUP_SOURCES[type(obj)]
+            state = inspect(obj)
+            if not any(state.attrs[name].load_history().has_changes() for name in columns):
+                continue
+            _add(deltas, source, _bucket_values(obj, old=True), -1)
+            _add(deltas, source, _bucket_values(obj, old=False), 1)
+
+def _apply_deltas(session: Session, flush_context):
+    """after_flush: upsert the collected deltas in the flush's own transaction"""
+    deltas = session.info.pop('rollup_deltas', None)
+    if not deltas:
+        return
+    connection = session.connection()
+
+    category_rows = [{'source': source, 'month': month, 'category_id': category_id, 'status': status,
+                      'count': count, 'total': total}
+                     for (source, month, category_id, status), (count, total) in deltas['category'].items()
+                     if count or total]
+    if category_rows:
+        statement = insert(CategoryMonthRollup)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['source', 'month', 'category_id', 'status'],
+            set_={'count': CategoryMonthRollup.count + statement.excluded.count,
+                  'total': CategoryMonthRollup.total + statement.excluded.total}
+        ), category_rows)
+
+    merchant_rows = [{'source': source, 'month': month, 'merchant_key': merchant_key, 'merchant': merchant,
+                      'count': count, 'total': total}
+                     for (source, month, merchant_key), (count, total, merchant) in deltas['merchant'].items()
+                     if count or total]
+    if merchant_rows:
+        statement = insert(MerchantMonthRollup)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['source', 'month', 'merchant_key'],
+            set_={'count': MerchantMonthRollup.count + statement.excluded.count,
+                  'total': MerchantMonthRollup.total + statement.excluded.total,
+                  'merchant': func.coalesce(MerchantMonthRollup.merchant, statement.excluded.merchant)}
+        ), merchant_rows)
+
+    # Buckets whose last row moved out
+    for model in (CategoryMonthRollup, MerchantMonthRollup):
+        connection.execute(model.__table__.delete().where(model.count <= 0))
+
+def _discard_deltas(session: Session, previous_transaction=None):
+    """Deltas of a flush that never happened must not leak into the next one"""
+    session.info.pop('rollup_deltas', None)
+
+def _keep_replaced_value(target, value, oldvalue, initiator):
+    """No-op 'set' listener; registering it with active_history is what counts"""
+
+def register_rollup_listeners():
+    """Keep the rollup tables in step with every ORM flush of expenses and card transactions.
+
+    Bulk query.update()/delete() bypass the ORM and need rebuild_rollups().
+    """
+    for name, listener in (('before_flush', _collect_deltas), ('after_flush', _apply_deltas),
+                           ('after_soft_rollback', _discard_deltas)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+
+    # Setting an expired column would otherwise lose the value its old bucket needs
+    for model, (_, columns) in ROLLUP_SOURCES.items():
+        for name in columns:
+            attribute = getattr(model, name)
+            if not event.contains(attribute, 'set', _keep_replaced_value):
+                event.listen(attribute, 'set', _keep_replaced_value, active_history=True)
+
+def _recomputed_buckets():
+    """(rollup model, columns, grouped select) producing every bucket from the source tables"""
+    for model, (source, _) in ROLLUP_SOURCES.items():
+        month = func.strftime('%Y-%m', model.date)
+        category_id = func.coalesce(model.category_id, 0)
+        # Only card transactions have a match status
+        card = model is CreditCardTransaction
+        status = func.coalesce(model.status, '') if card else literal('')
+        yield CategoryMonthRollup, ['source', 'month', 'category_id', 'status', 'count', 'total'], \
+            select(literal(source), month, category_id, status, func.count(model.id), func.sum(model.amount)) \
+            .group_by(month, category_id, *([status] if card else []))
+
+        merchant_key = func.coalesce(func.nullif(model.merchant_key, ''), model.merchant)
+        yield MerchantMonthRollup, ['source', 'month', 'merchant_key', 'merchant', 'count', 'total'], \
+            select(literal(source), month, merchant_key, func.min(model.merchant),
+                   func.count(model.id), func.sum(model.amount)) \
+            .group_by(month, merchant_key)
+
+def rebuild_rollups() -> Dict[str, int]:
+    """Recompute every bucket from the source tables in one grouped scan each; the caller commits"""
+    db.session.execute(CategoryMonthRollup.__table__.delete())
+    db.session.execute(MerchantMonthRollup.__table__.delete())
+
+    for rollup, columns, query in _recomputed_buckets():
+        db.session.execute(sql_insert(rollup.__table__).from_select(columns, query))
+
+    return {
+        'category_buckets': db.session.query(func.count(CategoryMonthRollup.id)).scalar(),
+        'merchant_buckets': db.session.query(func.count(MerchantMonthRollup.id)).scalar()
+    }
+
+def verify_rollups() -> List[Dict[str, Any]]:
+    """Compare the incrementally kept buckets with what rebuild_rollups() would write.
+
+    Returns one entry per bucket whose count or total differs; empty when
+    the rollups are consistent. Reads only, within the current transaction.
+    """
+    expected = {CategoryMonthRollup: {}, MerchantMonthRollup: {}}
+    for rollup, columns, query in _recomputed_buckets():
+        key_size = 4 if rollup is CategoryMonthRollup else 3
+        for row in db.session.execute(query):
+            expected[rollup][tuple(row[:key_size])] = (row[-2], round(row[-1] or 0.0, 2))
+
+    differences = []
+    for rollup, buckets in expected.items():
+        key_columns = ([rollup.source, rollup.month, rollup.category_id, rollup.status]
+                       if rollup is CategoryMonthRollup else [rollup.source, rollup.month, rollup.merchant_key])
+        actual = {tuple(row[:-2]): (row[-2], round(row[-1], 2))
+                  for row in db.session.query(*key_columns, rollup.count, rollup.total)}
+        for key in set(buckets) | set(actual):
+            if buckets.get(key) != actual.get(key):
+                differences.append({'table': rollup.__tablename__, 'bucket': list(key),
+                                    'expected': buckets.get(key), 'actual': actual.get(key)})
+    return differences
+
+def rollups_missing() -> bool:
+    """True when there is data to roll up but no buckets, e.g. right after the tables were added"""
+    if db.session.query(CategoryMonthRollup.id).first() is not None:
+        return False
+    return (db.session.query(Expense.id).first() is not None
+            or db.session.query(CreditCardTransaction.id).first() is not None)
@@ -0,0 +1,228 @@
+import os
+import json
+import math
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from src.models.expense import CreditCardTransaction
+from src.services.merchant_normalizer import normalize_merchant
+from src.services.llm_scheduler import LLMUnavailableError, PRIORITY_BULK
+from src.services.statement_prefilter import prefilter_statement
+
+# Configuration
+CHUNK_MAX_LINES = int(os.environ.get('STATEMENT_CHUNK_LINES', 80))
+CHUNK_MAX_CHARS = int(os.environ.get('STATEMENT_CHUNK_CHARS', 6000))
+CHUNK_OVERLAP_LINES = 4  # a transaction wrapped over a chunk boundary is seen whole by one side
+EXTRACTION_CONCURRENCY = int(os.environ.get('STATEMENT_EXTRACTION_CONCURRENCY', 4))
+CHUNK_ATTEMPTS = 2  # a chunk whose reply fails validation is asked once more
+
+EXTRACTION_PROMPT = """
+You are a financial data extraction expert. Extract credit card transactions from the provided
+statement excerpt. Every line starts with its line number, like "L12: ...". Lines that
+are not transactions have been removed, so numbers may skip.
+Return a JSON object in exactly this format:
+{
+  "transactions": [
+    {
+      "line": 12,
+      "date": "YYYY-MM-DD",
+      "merchant": "Merchant Name",
+      "amount": 123.45,
+      "description": "Transaction description"
+    }
+  ]
+}
+
+Rules:
+- "line" is the number of the line the transaction's date is on
+- Only extract actual transactions (ignore headers, totals, etc.)
+- Use positive amounts for all transactions
+- Parse dates to YYYY-MM-DD format
+- Clean up merchant names (remove extra spaces, codes)
+- If you can't parse a transaction clearly, skip it
+- The excerpt may start or end mid-statement; skip transactions cut off at its edges
+"""
+
+class StatementChunk:
+    """A run of statement lines, each tagged with its line number in the whole file"""
+
+    def __init__(self, numbered_lines: List[Tuple[int, str]]):
+        self.numbered_lines = numbered_lines
+        self.line_numbers = {number for number, _ in numbered_lines}
+
+    @property
+    def first_line(self) -> int:
+        return self.numbered_lines[0][0]
+
+    @property
+    def last_line(self) -> int:
+        return self.numbered_lines[-1][0]
+
+    def numbered_text(self) -> str:
+        return '\n'.join(f"L{number}: {line}" for number, line in self.numbered_lines)
+
+def split_into_chunks(text: str, max_lines: int = CHUNK_MAX_LINES, max_chars: int = CHUNK_MAX_CHARS,
+                      overlap: int = CHUNK_OVERLAP_LINES) -> List[StatementChunk]:
+    """Split text on line boundaries into chunks that overlap by a few lines"""
+    return chunk_lines(list(enumerate(text.splitlines(), start=1)), max_lines, max_chars, overlap)
+
+def chunk_lines(lines: List[Tuple[int, str]], max_lines: int = CHUNK_MAX_LINES, max_chars: int = CHUNK_MAX_CHARS,
+                overlap: int = CHUNK_OVERLAP_LINES) -> List[StatementChunk]:
+    """Chunk already numbered lines, which need not be consecutive"""
+    chunks = []
+    start = 0
+
+    while start < len(lines):
+        end, size = start, 0
+        while end < len(lines) and end - start < max_lines:
+            line_size = len(lines[end][1]) + 1
+            if end > start and size + line_size > max_chars:
+                break
+            size += line_size
+            end += 1
+
+        chunk = lines[start:end]
+        if any(line.strip() for _, line in chunk):
+            chunks.append(StatementChunk(chunk))
+        if end >= len(lines):
+            break
+        # Step back for the overlap, but always move forward
+        start = max(end - overlap, start + 1)
+
+    return chunks
+
+def validate_chunk_output(data: Any, chunk: StatementChunk) -> Tuple[List[Dict[str, Any]], int]:
+    """Check a chunk's reply against the extraction schema.
+
+    Returns the valid transactions and how many items were dropped. Raises
+    ValueError when the reply as a whole doesn't have the expected shape.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('transactions'), list):
+        raise ValueError('Reply is not an object with a "transactions" list')
+
+    transactions = []
+    invalid = 0
+    for item in data['transactions']:
+        try:
+            line = int(item['line'])
+            amount = float(item['amount'])
+            merchant = str(item['merchant']).strip()
+            if line not in chunk.line_numbers:
+                raise ValueError(f'line {line} is not in the chunk')
+            if not math.isfinite(amount) or not merchant:
+                raise ValueError('missing amount or merchant')
+            transactions.append({
+                'line': line,
+                'date': datetime.strptime(str(item['date']), '%Y-%m-%d').date(),
+                'merchant': merchant,
+                'amount': abs(amount),
+                'description': str(item.get('description') or merchant).strip()
+            })
+        except (KeyError, TypeError, ValueError):
+            invalid += 1
+
+    return transactions, invalid
+
+class StatementExtractor:
+    """Map-reduce transaction extraction for long unstructured statements.
+
+    A local pre-filter first parses unambiguous charge lines itself and drops
+    boilerplate. The remaining lines are split into overlapping chunks, which
+    are extracted concurrently (bounded by EXTRACTION_CONCURRENCY and the LLM
+    scheduler's bulk class). Each reply is validated, and transactions seen
+    by two neighbouring chunks are merged on date, amount and normalized
+    merchant, pairing repeated charges by nearest line. Chunks that still
+    fail are counted in stats['failed_chunks'], and the result is then
+    incomplete; only when every chunk fails does extract raise.
+    """
+
+    def __init__(self, client, concurrency: int = EXTRACTION_CONCURRENCY):
+        self.client = client
+        self.concurrency = concurrency
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def extract(self, text: str) -> List[Dict[str, Any]]:
+        prefiltered = prefilter_statement(text)
+        chunks = chunk_lines(prefiltered.model_lines)
+        self.stats = {'lines': len(text.splitlines()), 'chunks': len(chunks), 'failed_chunks': 0,
+                      'invalid_items': 0, 'duplicates_removed': 0, 'prompt_tokens': 0,
+                      'completion_tokens': 0, 'prefilter': prefiltered.stats}
+
+        results = []
+        if chunks:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(chunks)))) as executor:
+                results = list(executor.map(self._extract_chunk, chunks))
+
+        errors = [error for _, _, error in results if error]
+        self.stats['failed_chunks'] = len(errors)
+        if chunks and len(errors) == len(chunks) and not prefiltered.transactions:
+            raise Exception(errors[0])
+
+        # Reduce: keep one copy of each transaction found in an overlap
+        kept = []  # model transactions kept so far, from earlier chunks
+        overlap_end = 0  # last line of the previous chunk
+        for chunk, (transactions, invalid, _) in zip(chunks, results):
+            self.stats['invalid_items'] += invalid
+            # Copies earlier chunks already reported from the lines they share with this one
+            candidates = defaultdict(list)
+            for tx in kept:
+                if tx['line'] >= chunk.first_line:
+                    candidates[self._overlap_key(tx)].append(tx)
+
+            for tx in sorted(transactions, key=lambda tx: tx['line']):
+                matches = candidates.get(self._overlap_key(tx)) if tx['line'] <= overlap_end else None
+                if matches:
+                    # The same charge can appear twice; pair each copy with the nearest line
+                    matches.remove(min(matches, key=lambda other: abs(other['line'] - tx['line'])))
+                    self.stats['duplicates_removed'] += 1
+                else:
+                    kept.append(tx)
+            overlap_end = chunk.last_line
+
+        transactions = sorted(prefiltered.transactions + kept, key=lambda tx: tx['line'])
+        for tx in transactions:
+            del tx['line']
+        return transactions
+
+    @staticmethod
+    def _overlap_key(tx: Dict[str, Any]) -> str:
+        """Two chunks' copies of one transaction agree on this even when they read its line differently"""
+        return CreditCardTransaction.make_fingerprint(tx['date'], normalize_merchant(tx['merchant']), tx['amount'])
+
+    def _extract_chunk(self, chunk: StatementChunk) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """Extract one chunk; returns (transactions, invalid item count, error)"""
+        error = None
+        for _ in range(CHUNK_ATTEMPTS):
+            try:
+                response = self.client.chat_completion(
+                    priority=PRIORITY_BULK,
+                    model="gpt-4.1-mini",
+                    messages=[
+                        {"role": "system", "content": EXTRACTION_PROMPT},
+                        {"role": "user", "content": f"Extract transactions from this statement excerpt:\n\n{chunk.numbered_text()}"}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=4000,
+                    temperature=0.1
+                )
+                self._record_usage(response)
+                transactions, invalid = validate_chunk_output(
+                    json.loads(response.choices[0].message.content), chunk
+                )
+                return transactions, invalid, None
+            except LLMUnavailableError as e:
+                return [], 0, str(e)
+            except Exception as e:
+                error = f"Lines {chunk.first_line}-{chunk.last_line}: {str(e)}"
+                print(f"Error extracting statement chunk: {error}")
+
+        return [], 0, error
+
+    def _record_usage(self, response):
+        usage = getattr(response, 'usage', None)
+        with self._lock:
+            self.stats['prompt_tokens'] += getattr(usage, 'prompt_tokens', 0) or 0
+            self.stats['completion_tokens'] += getattr(usage, 'completion_tokens', 0) or 0
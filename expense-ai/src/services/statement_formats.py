@@ -0,0 +1,277 @@
+import io
+import os
+import re
+import json
+import html
+import codecs
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Iterator, Tuple, BinaryIO, TextIO
+from src.services.statement_schema import (SAMPLE_BYTES, parse_amount, pick_date_format,
+                                           sniff_encoding, rewind, rejected_row)
+
+# Configuration
+OFX_READ_BLOCK = 64 * 1024
+MIN_FIXED_WIDTH_ROWS = 3  # fewer sampled transaction lines than this isn't a table
+
+# <TAG>value up to the next tag; matches SGML (unclosed leaves) and XML alike
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+# A line that starts with a numeric date and ends with an amount
+FIXED_WIDTH_ROW = re.compile(r'^\s*\d{1,4}[/.-]\d{1,2}[/.-]\d{2,4}\s.*\S\s+\(?-?\$?[\d,]+[.,]\d{2}\)?-?(?:\s*CR)?\s*$')
+# One money amount: 1,234.56  $4.50  -12.00  (12.00)  12.00 CR
+AMOUNT_TOKEN = r'\(?-?\$?-?\d[\d,]*[.,]\d{2}\)?-?(?: ?CR)?'
+# The amount ending a line, however far a long description pushed it
+TRAILING_AMOUNT = re.compile(r'(?:^|\s)(?P<amount>' + AMOUNT_TOKEN + r')\s*$', re.IGNORECASE)
+SINGLE_AMOUNT = re.compile(r'^' + AMOUNT_TOKEN + r'$', re.IGNORECASE)
+
+class OfxLayout:
+    """Dialect of one OFX/QFX download"""
+
+    def __init__(self, variant: str, encoding: str):
+        self.variant = variant  # 'sgml' (OFX 1.x) or 'xml' (OFX 2.x)
+        self.encoding = encoding
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'format': 'ofx', 'variant': self.variant, 'encoding': self.encoding}
+
+def open_ofx(stream: BinaryIO) -> Tuple[OfxLayout, Iterator[Dict[str, Any]]]:
+    """Sniff an OFX/QFX stream and return its dialect with a lazy transaction iterator"""
+    sample = stream.read(SAMPLE_BYTES)
+    encoding = sniff_encoding(sample)
+    head = sample[:1024].decode(encoding, errors='replace').lower()
+    variant = 'xml' if '<?xml' in head or '<?ofx' in head else 'sgml'
+    text = io.TextIOWrapper(rewind(stream, sample), encoding=encoding, errors='replace')
+    return OfxLayout(variant, encoding), iter_ofx_transactions(text)
+
+def iter_ofx_transactions(text: TextIO, block_size: int = OFX_READ_BLOCK) -> Iterator[Dict[str, Any]]:
+    """Stream <STMTTRN> records out of an OFX document, one block at a time.
+
+    Leaf values run up to the next tag, so SGML files without closing tags
+    and XML files parse the same way; closing leaf tags are ignored.
+    """
+    buffer = ''
+    account = None
+    current = None
+
+    while True:
+        block = text.read(block_size)
+        buffer += block
+        # The tag starting at the last '<' may continue in the next block
+        end = buffer.rfind('<') if block else len(buffer)
+
+        for opening_slash, tag, value in OFX_TAG.findall(buffer, 0, max(end, 0)):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if opening_slash:
+                    transaction = _ofx_transaction(current or {}, account)
+                    current = None
+                    if transaction:
+                        yield transaction
+                else:
+                    current = {}
+            elif not opening_slash:
+                value = value.strip()
+                if current is not None and value:
+                    current[tag] = html.unescape(value)
+                elif tag == 'ACCTID' and value:
+                    account = value
+
+        buffer = buffer[max(end, 0):]
+        if not block:
+            break
+
+def _ofx_transaction(fields: Dict[str, str], account: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Convert one STMTTRN's fields; charges come out positive and credits negative"""
+    try:
+        raw_date = fields.get('DTUSER') or fields['DTPOSTED']
+        transaction_date = datetime.strptime(raw_date[:8], '%Y%m%d').date()
+        raw_amount = fields['TRNAMT']
+        amount = parse_amount(raw_amount, decimal_comma=',' in raw_amount and '.' not in raw_amount)
+    except (KeyError, ValueError):
+        return None
+    if amount is None:
+        return None
+
+    merchant = fields.get('NAME') or fields.get('PAYEE') or fields.get('MEMO')
+    if not merchant:
+        return None
+    fitid = fields.get('FITID')
+    return {
+        'date': transaction_date,
+        'merchant': merchant,
+        # OFX amounts are from the account holder's side, so a charge is negative
+        'amount': -amount,
+        'description': fields.get('MEMO') or merchant,
+        # FITIDs are only unique within an account
+        'external_id': (f"{account}:{fitid}" if account else fitid) if fitid else None
+    }
+
+class FixedWidthLayout:
+    """Column positions of a fixed-width text statement; a span of (start, None) runs to line end"""
+
+    def __init__(self, name: str, date_span: Tuple[int, Optional[int]], description_span: Tuple[int, Optional[int]],
+                 amount_span: Tuple[int, Optional[int]], date_format: str, charge_sign: int = 1,
+                 header: Optional[str] = None):
+        self.name = name
+        self.date_span = tuple(date_span)
+        self.description_span = tuple(description_span)
+        self.amount_span = tuple(amount_span)
+        self.date_format = date_format
+        self.charge_sign = charge_sign
+        self.header = header.lower() if header else None  # text that identifies the layout
+
+    def compile(self) -> Callable[[str], Optional[Dict[str, Any]]]:
+        """Build a parser for one line; returns None for lines that aren't transactions.
+
+        Like single-amount CSV columns, amounts come out positive unless the
+        layout's charge_sign gives the bank's sign convention. A dated line
+        whose amount can't be told apart from its text comes back as a
+        rejected_row so the import counts it.
+        """
+        date_start, date_end = self.date_span
+        description_start, description_end = self.description_span
+        amount_start, amount_end = self.amount_span
+        date_format = self.date_format
+        charge_sign = self.charge_sign
+        strptime = datetime.strptime
+
+        def parse(line: str) -> Optional[Dict[str, Any]]:
+            line = line.rstrip('\r\n')
+            try:
+                transaction_date = strptime(line[date_start:date_end].strip(), date_format).date()
+            except ValueError:
+                return None
+
+            if amount_end is None:
+                # An amount running to line end is read from the end, not from the
+                # gutter a sample suggested, so a long description can't leak into it
+                match = TRAILING_AMOUNT.search(line, description_start)
+                if match is None:
+                    return None
+                raw_amount = match.group('amount')
+                description = line[description_start:match.start()]
+                if TRAILING_AMOUNT.search(description.rstrip()):
+                    return rejected_row('more than one amount at the end of the line')
+            else:
+                raw_amount = line[amount_start:amount_end].strip()
+                if not raw_amount:
+                    return None
+                if not SINGLE_AMOUNT.match(raw_amount):
+                    return rejected_row(f"amount column holds '{raw_amount}'")
+                description = line[description_start:description_end]
+
+            amount = parse_amount(raw_amount)
+            description = ' '.join(description.split())
+            if amount is None or not description:
+                return None
+            return {
+                'date': transaction_date,
+                'merchant': description,
+                'amount': abs(amount) if charge_sign == 1 else amount * charge_sign,
+                'description': description
+            }
+
+        return parse
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format': 'fixed_width',
+            'layout': self.name,
+            'date_span': list(self.date_span),
+            'description_span': list(self.description_span),
+            'amount_span': list(self.amount_span),
+            'date_format': self.date_format
+        }
+
+def _layouts_from_env() -> List[FixedWidthLayout]:
+    """Site-specific layouts, e.g. STATEMENT_FIXED_WIDTH_LAYOUTS='[{"name": "acme", "header": "ACME BANK",
+    "date": [0, 10], "description": [12, 52], "amount": [52, null], "date_format": "%m/%d/%Y"}]'"""
+    layouts = []
+    try:
+        for entry in json.loads(os.environ.get('STATEMENT_FIXED_WIDTH_LAYOUTS', '[]')):
+            layouts.append(FixedWidthLayout(entry['name'], entry['date'], entry['description'], entry['amount'],
+                                            entry['date_format'], entry.get('charge_sign', 1), entry.get('header')))
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Error loading fixed-width statement layouts: {str(e)}")
+    return layouts
+
+FIXED_WIDTH_LAYOUTS: List[FixedWidthLayout] = _layouts_from_env()
+
+def register_fixed_width_layout(layout: FixedWidthLayout):
+    """Add a fixed-width layout; later registrations are checked first"""
+    FIXED_WIDTH_LAYOUTS.insert(0, layout)
+
+def infer_fixed_width_layout(lines: List[str]) -> Optional[FixedWidthLayout]:
+    """Find column gutters shared by every 'DATE ... AMOUNT' line of a sample.
+
+    Returns None unless the first column holds dates in one format and the
+    last holds amounts, so free-form text is left to AI extraction.
+    """
+    rows = [line.rstrip('\r\n') for line in lines if FIXED_WIDTH_ROW.match(line)]
+    if len(rows) < MIN_FIXED_WIDTH_ROWS:
+        return None
+
+    width = max(len(row) for row in rows)
+    padded = [row.ljust(width) for row in rows]
+    blank = [all(row[i] == ' ' for row in padded) for i in range(width)]
+
+    # Columns are maximal runs of positions where some row has text
+    spans = []
+    start = None
+    for i, is_blank in enumerate(blank + [True]):
+        if not is_blank and start is None:
+            start = i
+        elif is_blank and start is not None:
+            spans.append((start, i))
+            start = None
+    if len(spans) < 3:
+        return None
+
+    def values(span):
+        return [row[span[0]:span[1]].strip() for row in padded]
+
+    date_format = pick_date_format(values(spans[0]))
+    if date_format is None:
+        return None
+    # Skip a posting date column after the transaction date
+    description_index = 2 if len(spans) > 3 and pick_date_format(values(spans[1])) else 1
+
+    amount_span = spans[-1]
+    if any(parse_amount(value) is None for value in values(amount_span)):
+        return None
+
+    # Wider amounts right-align further left, so the amount owns the gutter before it
+    gutter = spans[-2][1]
+    return FixedWidthLayout('inferred', (0, spans[0][1]), (spans[description_index][0], gutter),
+                            (gutter, None), date_format)
+
+def open_fixed_width(stream: BinaryIO) -> Optional[Tuple[FixedWidthLayout, Iterator[Dict[str, Any]]]]:
+    """Match a registered layout or infer one.
+
+    Returns None, with a seekable stream rewound, when the text isn't a
+    fixed-width table.
+    """
+    sample = stream.read(SAMPLE_BYTES)
+    encoding = sniff_encoding(sample)
+    text_sample = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+    lines = text_sample.splitlines()
+    if len(sample) >= SAMPLE_BYTES and len(lines) > 1:
+        lines = lines[:-1]  # The last sampled line may be cut off
+
+    lowered = text_sample.lower()
+    layout = next((l for l in FIXED_WIDTH_LAYOUTS if l.header and l.header in lowered), None)
+    if layout is None:
+        layout = infer_fixed_width_layout(lines)
+    if layout is None:
+        rewind(stream, sample)
+        return None
+
+    text = io.TextIOWrapper(rewind(stream, sample), encoding=encoding, errors='replace', newline='')
+    return layout, _iter_fixed_width(text, layout)
+
+def _iter_fixed_width(text: TextIO, layout: FixedWidthLayout) -> Iterator[Dict[str, Any]]:
+    """Yield each line's transaction, including rejected rows for the import to count"""
+    parse = layout.compile()
+    for line in text:
+        transaction = parse(line)
+        if transaction:
+            yield transaction
@@ -0,0 +1,219 @@
+import os
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, BinaryIO, Tuple
+from flask import current_app
+from src.models.user import db
+from src.models.statement_import import StatementImport
+from src.services.statement_processor import StatementProcessor
+from src.services.merchant_rules import get_merchant_rules
+from src.services.upload_storage import UploadRejected, UPLOAD_CHUNK_SIZE, TEMP_PREFIX, TEMP_SUFFIX
+
+# Configuration
+STATEMENT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads', 'statements')
+STATEMENT_WORKERS = int(os.environ.get('STATEMENT_WORKERS', 2))
+MAX_STATEMENT_FILE_SIZE = int(os.environ.get('MAX_STATEMENT_FILE_SIZE', 50 * 1024 * 1024))
+# A running job untouched this long is taken to have lost its worker and may be claimed again
+STALE_IMPORT_SECONDS = int(os.environ.get('STATEMENT_STALE_IMPORT_SECONDS', 30 * 60))
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('completed', 'partial', 'failed')
+
+def store_statement_file(stream: BinaryIO, extension: str, folder: str = STATEMENT_FOLDER) -> Tuple[str, str]:
+    """Stream an upload to disk at <sha256>.<ext>; returns (path, content hash)"""
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > MAX_STATEMENT_FILE_SIZE:
+                    raise UploadRejected(
+                        f'File exceeds the maximum size of {MAX_STATEMENT_FILE_SIZE // (1024 * 1024)}MB', 413
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        if size == 0:
+            raise UploadRejected('File is empty')
+
+        content_hash = digest.hexdigest()
+        path = os.path.join(folder, f"{content_hash}.{extension.lower()}")
+        os.replace(temp_path, path)
+        return path, content_hash
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class StatementJobQueue:
+    """Worker pool that imports statements outside the request cycle.
+
+    Job state lives in StatementImport rows: the phase and counters are
+    committed together with each batch of transactions. Workers claim a job
+    with a conditional update, so when several processes resume the same
+    jobs only one runs each. A natively parsed
+    job picked up again after a restart skips straight past its committed
+    batches. A statement the model extracted is extracted again, and it
+    may not return the same rows in the same order, so nothing is skipped by
+    position; fingerprint dedup drops the rows already imported.
+    """
+
+    def __init__(self, max_workers: int = STATEMENT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='statement-import')
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def enqueue(self, statement_import: StatementImport) -> bool:
+        """Mark an import as queued, commit it and schedule it"""
+        statement_import.status = 'queued'
+        statement_import.phase = None
+        statement_import.error = None
+        statement_import.rows = statement_import.imported = statement_import.duplicates = 0
+        statement_import.errors = statement_import.matched = statement_import.rows_committed = 0
+        statement_import.stats = statement_import.result = statement_import.layout = None
+        statement_import.started_at = statement_import.completed_at = None
+        db.session.commit()
+        return self.submit(current_app._get_current_object(), statement_import.id)
+
+    def submit(self, app, import_id: int) -> bool:
+        """Schedule an import unless this process is already running it"""
+        with self._lock:
+            if import_id in self._active:
+                return False
+            self._active.add(import_id)
+        self.executor.submit(self._run, app, import_id)
+        return True
+
+    def _run(self, app, import_id: int):
+        """Worker entry point: import one statement"""
+        try:
+            with app.app_context():
+                self._process(import_id)
+        except Exception as e:
+            print(f"Error running statement import {import_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._active.discard(import_id)
+
+    def _process(self, import_id: int):
+        if not self._claim(import_id):
+            return
+
+        job = db.session.get(StatementImport, import_id)
+        resume_from = dict(job.stats or {}) if job.rows_committed else None
+        job.started_at = job.started_at or datetime.utcnow()
+        filename, file_path = job.filename, job.file_path
+        db.session.commit()
+
+        processor = StatementProcessor()
+        try:
+            with open(file_path, 'rb') as stream:
+                layout, transactions = processor.read_statement(filename, stream)
+                job = db.session.get(StatementImport, import_id)
+                job.layout = layout.to_dict() if layout else None
+                db.session.commit()
+
+                stats = processor.save_transactions(
+                    transactions, filename,
+                    progress=lambda phase, stats: self._report(import_id, phase, stats),
+                    resume_from=resume_from,
+                    # Only native parsers yield the same rows in the same order again
+                    skip_committed=layout is not None
+                )
+
+            if stats['rows'] == 0:
+                self._finish(import_id, 'failed', error='No transactions found in the statement')
+                return
+
+            self._report(import_id, 'match', stats)
+            match_results = processor.auto_match_transactions()
+            # Chunks the model failed on leave the statement incomplete; unlike a
+            # completed import, a partial one runs again when the file is re-uploaded
+            failed_chunks = (processor.extraction_stats or {}).get('failed_chunks', 0)
+            self._finish(import_id, 'partial' if failed_chunks else 'completed', stats, {
+                'extraction_stats': processor.extraction_stats,
+                'auto_match_results': match_results
+            }, error=(f"{failed_chunks} of {processor.extraction_stats['chunks']} statement chunks could not be "
+                      f"extracted; upload the file again to retry them") if failed_chunks else None)
+        except Exception as e:
+            db.session.rollback()
+            # A rolled-back batch may have taught rules that were never stored
+            get_merchant_rules().invalidate()
+            self._finish(import_id, 'failed', error=str(e))
+
+    def _claim(self, import_id: int) -> bool:
+        """Atomically mark a queued (or abandoned running) import as ours; False if another worker has it"""
+        now = datetime.utcnow()
+        claimed = StatementImport.query.filter(
+            StatementImport.id == import_id,
+            db.or_(StatementImport.status == 'queued',
+                   db.and_(StatementImport.status == 'running',
+                           StatementImport.updated_at < now - timedelta(seconds=STALE_IMPORT_SECONDS)))
+        ).update({'status': 'running', 'phase': 'parse', 'updated_at': now}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _report(self, import_id: int, phase: str, stats: Dict[str, Any]):
+        """Record progress; 'save' progress is staged to commit with its batch"""
+        job = db.session.get(StatementImport, import_id)
+        job.phase = phase
+        job.rows = stats['rows']
+        job.imported = stats['imported']
+        job.duplicates = stats['duplicates']
+        job.errors = stats['errors']
+        job.rows_committed = stats['committed_rows']
+        job.stats = dict(stats)
+        if phase != 'save':
+            db.session.commit()
+
+    def _finish(self, import_id: int, status: str, stats: Optional[Dict[str, Any]] = None,
+                result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        job = db.session.get(StatementImport, import_id)
+        job.status = status
+        job.error = error
+        job.result = result
+        job.completed_at = datetime.utcnow()
+        if stats:
+            job.stats = dict(stats)
+            job.rows = stats['rows']
+            job.imported = stats['imported']
+            job.duplicates = stats['duplicates']
+        if result:
+            job.matched = result['auto_match_results'].get('matched', 0)
+        file_path = job.file_path
+        job.file_path = None
+        db.session.commit()
+
+        # Finished imports are never re-read; a re-upload stores the file again
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+_queue: Optional[StatementJobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_statement_job_queue() -> StatementJobQueue:
+    """Return the process-wide statement job queue"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = StatementJobQueue()
+    return _queue
+
+def resume_statement_imports(app) -> int:
+    """Pick up imports a previous worker left queued or running; returns how many"""
+    with app.app_context():
+        import_ids = [import_id for (import_id,) in db.session.query(StatementImport.id)
+                      .filter(StatementImport.status.in_(ACTIVE_STATUSES))]
+    queue = get_statement_job_queue()
+    return sum(1 for import_id in import_ids if queue.submit(app, import_id))
@@ -0,0 +1,205 @@
+import re
+from datetime import date
+from typing import Dict, Any, List, Optional, Tuple
+from src.services.statement_schema import parse_amount
+
+# Configuration
+CONTEXT_LINES_AFTER = 1  # descriptions that wrap onto the next line
+CHARS_PER_TOKEN = 4  # rough estimate, for reporting savings only
+MIN_CANDIDATE_LINES = 3  # keeping fewer, with nothing parsed locally, means the layout wasn't recognized
+
+MONTHS = {name: index + 1 for index, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+
+# A date at the start of a line: 01/05, 01/05/24, 01/05/2024, 2024-01-05, Jan 5, Jan 05, 2024
+LEADING_DATE = re.compile(
+    r'^\s*(?:(?P<iso_y>\d{4})-(?P<iso_m>\d{2})-(?P<iso_d>\d{2})'
+    r'|(?P<m>\d{1,2})[/-](?P<d>\d{1,2})(?:[/-](?P<y>\d{2}|\d{4}))?'
+    r'|(?P<mon>[A-Za-z]{3})[a-z]*\.? (?P<mon_d>\d{1,2})(?:, (?P<mon_y>\d{4}))?)(?=\s)'
+)
+# A money amount at the end of a line: 1,234.56  $4.50  -12.00  (12.00)  12.00 CR
+TRAILING_AMOUNT = re.compile(r'\s(?P<amount>\(?-?\$?-?\d{1,3}(?:,\d{3})*\.\d{2}\)?-?(?: ?CR)?)\s*$', re.IGNORECASE)
+ANY_AMOUNT = re.compile(r'\$?\d{1,3}(?:,\d{3})*\.\d{2}\b')
+# A date anywhere in a line, for layouts that print a card suffix, reference or merchant first
+ANY_DATE = re.compile(
+    r'(?<![\d.,])(?:\d{4}-\d{2}-\d{2}|\d{1,2}[/-]\d{1,2}(?:[/-](?:\d{4}|\d{2}))?'
+    r'|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2})(?![\d.,])', re.IGNORECASE)
+FULL_DATE = re.compile(r'\b(?:(\d{1,2})/(\d{1,2})/(\d{4})|(\d{4})-(\d{2})-(\d{2}))\b')
+
+# Balance summaries and boilerplate that also carry a date or an amount
+SUMMARY_WORDS = re.compile(
+    r'\b(?:total|balance|minimum|payment due|credit limit|available credit|cash advance limit'
+    r'|interest charged|fees charged|annual percentage rate|statement|closing date|opening date'
+    r'|rewards?|points|page \d)\b'
+    # APR as a rate ('APR 24.99%', '24.99% APR'), never the month in 'Apr 05'
+    r'|\bapr\b:?\s*\d+(?:\.\d+)?\s*%|\bapr\b:?\s*\d+\.\d+|%\s*apr\b', re.IGNORECASE)
+
+class PrefilterResult:
+    """What the local pass parsed itself and the numbered lines still worth a model call"""
+
+    def __init__(self, transactions: List[Dict[str, Any]], model_lines: List[Tuple[int, str]],
+                 stats: Dict[str, Any]):
+        self.transactions = transactions
+        self.model_lines = model_lines
+        self.stats = stats
+
+def statement_date_order(lines: List[str]) -> Optional[str]:
+    """'mdy' or 'dmy' when the statement's numeric dates settle it, else None.
+
+    One order holds for the whole statement, like pick_date_format does for
+    CSV columns: a first part above 12 means DD/MM, a second part above 12
+    means MM/DD. Statements showing neither (or both) stay undecided.
+    """
+    seen = set()
+    for line in lines:
+        parts = [(m.group('m'), m.group('d')) for m in [LEADING_DATE.match(line)] if m and m.group('m')]
+        parts += [(m.group(1), m.group(2)) for m in FULL_DATE.finditer(line) if m.group(3)]
+        for first, second in parts:
+            if int(first) > 12 and int(second) <= 12:
+                seen.add('dmy')
+            elif int(second) > 12 and int(first) <= 12:
+                seen.add('mdy')
+    return seen.pop() if len(seen) == 1 else None
+
+def _month_day(first: int, second: int, order: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Read a numeric NN/NN date in the statement's order; None when that can't be told"""
+    if order == 'dmy':
+        return second, first
+    if order == 'mdy' or first == second:
+        return first, second
+    # Undecided: only a part above 12 says which one is the day
+    if first > 12:
+        return second, first
+    if second > 12:
+        return first, second
+    return None
+
+def statement_reference_date(lines: List[str], order: Optional[str] = None) -> Optional[date]:
+    """The latest full date printed anywhere, which anchors year-less transaction dates"""
+    latest = None
+    for line in lines:
+        for m in FULL_DATE.finditer(line):
+            try:
+                if m.group(3):
+                    month_day = _month_day(int(m.group(1)), int(m.group(2)), order)
+                    if month_day is None:
+                        continue
+                    found = date(int(m.group(3)), *month_day)
+                else:
+                    found = date(int(m.group(4)), int(m.group(5)), int(m.group(6)))
+            except ValueError:
+                continue
+            if latest is None or found > latest:
+                latest = found
+    return latest
+
+def _leading_date(line: str, reference: Optional[date], order: Optional[str] = None) -> Tuple[Optional[date], int]:
+    """Parse a date at the start of the line; returns (date or None, characters consumed)"""
+    m = LEADING_DATE.match(line)
+    if not m:
+        return None, 0
+
+    year = None
+    if m.group('iso_y'):
+        year, month, day = int(m.group('iso_y')), int(m.group('iso_m')), int(m.group('iso_d'))
+    elif m.group('m'):
+        month_day = _month_day(int(m.group('m')), int(m.group('d')), order)
+        if month_day is None:
+            return None, m.end()
+        month, day = month_day
+        if m.group('y'):
+            year = int(m.group('y'))
+            year += 2000 if year < 100 else 0
+    else:
+        month = MONTHS.get(m.group('mon').lower())
+        day = int(m.group('mon_d'))
+        if month is None:
+            return None, 0
+        if m.group('mon_y'):
+            year = int(m.group('mon_y'))
+
+    if year is None:
+        if reference is None:
+            return None, m.end()
+        # A December charge on a January statement belongs to the year before
+        year = reference.year - 1 if (month, day) > (reference.month, reference.day) else reference.year
+
+    try:
+        return date(year, month, day), m.end()
+    except ValueError:
+        return None, 0
+
+def parse_transaction_line(line: str, reference: Optional[date], order: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Turn an unambiguous 'DATE [POST DATE] MERCHANT AMOUNT' charge line into a transaction.
+
+    Anything less certain (credits, missing year, summary wording, an NN/NN
+    date whose order the statement doesn't settle) returns None and is left
+    to the model.
+    """
+    if SUMMARY_WORDS.search(line):
+        return None
+    tx_date, consumed = _leading_date(line, reference, order)
+    amount_match = TRAILING_AMOUNT.search(line)
+    if tx_date is None or amount_match is None:
+        return None
+
+    raw_amount = amount_match.group('amount')
+    if '-' in raw_amount or '(' in raw_amount or 'cr' in raw_amount.lower():
+        return None
+    amount = parse_amount(raw_amount)
+
+    middle = line[consumed:amount_match.start()].strip()
+    # Most statements print the posting date right after the transaction date
+    _, post_consumed = _leading_date(middle, reference, order)
+    middle = middle[post_consumed:].strip()
+    if ANY_AMOUNT.search(middle) or len(re.findall(r'[A-Za-z]', middle)) < 3 or not amount:
+        return None
+
+    merchant = ' '.join(middle.split())
+    return {'date': tx_date, 'merchant': merchant, 'amount': amount, 'description': merchant}
+
+def is_candidate_line(line: str) -> bool:
+    """Could hold (part of) a transaction: starts with a date and has an amount or text after
+    it, or has a date and an amount anywhere"""
+    m = LEADING_DATE.match(line)
+    if not m:
+        return bool(ANY_DATE.search(line) and ANY_AMOUNT.search(line))
+    rest = line[m.end():]
+    return bool(ANY_AMOUNT.search(rest) or re.search(r'[A-Za-z]{3}', rest))
+
+def prefilter_statement(text: str) -> PrefilterResult:
+    """Parse certain transaction lines locally and keep only likely transaction lines for the model"""
+    lines = text.splitlines()
+    order = statement_date_order(lines)
+    reference = statement_reference_date(lines, order)
+
+    transactions = []
+    keep = set()
+    for index, line in enumerate(lines):
+        tx = parse_transaction_line(line, reference, order)
+        if tx is not None:
+            tx['line'] = index + 1
+            transactions.append(tx)
+        elif is_candidate_line(line):
+            keep.update(range(index, min(index + CONTEXT_LINES_AFTER + 1, len(lines))))
+
+    parsed = {tx['line'] - 1 for tx in transactions}
+    fallback = not transactions and len(keep) < MIN_CANDIDATE_LINES
+    if fallback:
+        # A layout the classifier doesn't know; let the model see everything
+        keep = set(range(len(lines)))
+    model_lines = [(index + 1, lines[index]) for index in sorted(keep - parsed) if lines[index].strip()]
+
+    chars_in = sum(len(line) + 1 for line in lines)
+    chars_sent = sum(len(line) + 1 for _, line in model_lines)
+    stats = {
+        'input_lines': len(lines),
+        'parsed_locally': len(transactions),
+        'lines_sent': len(model_lines),
+        'fallback': fallback,
+        'chars_in': chars_in,
+        'chars_sent': chars_sent,
+        'estimated_tokens_saved': (chars_in - chars_sent) // CHARS_PER_TOKEN,
+        'reduction': round(1 - chars_sent / chars_in, 3) if chars_in else 0.0
+    }
+    return PrefilterResult(transactions, model_lines, stats)
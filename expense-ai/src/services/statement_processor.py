@@ -1,149 +1,117 @@
 import csv
 import io
-import re
-import openai
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Callable, BinaryIO, TextIO
 from src.models.expense import CreditCardTransaction, Expense, Category
+from src.models.match_state import MatchState
 from src.models.user import db
-from sqlalchemy import func
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from src.services.llm_client import get_llm_client
+from src.services.llm_scheduler import LLMUnavailableError, PRIORITY_BULK
+from src.services.merchant_rules import get_merchant_rules
+from src.services.merchant_normalizer import normalize_merchant
+from src.services.transaction_matcher import TransactionMatcher, merchants_similar
+from src.services.statement_extraction import StatementExtractor
+from src.services.statement_formats import OfxLayout, FixedWidthLayout, open_ofx, open_fixed_width
+from src.services.pdf_pages import load_pdf_pages
+from src.services.statement_schema import StatementSchema, detect_schema, open_statement, SAMPLE_BYTES
+
+# Configuration
+IMPORT_BATCH_SIZE = int(os.environ.get('STATEMENT_IMPORT_BATCH_SIZE', 500))  # rows per commit
+FINGERPRINT_QUERY_CHUNK = 500  # stays under SQLite's bound parameter limit
+CATEGORIZE_BATCH_SIZE = int(os.environ.get('CATEGORIZE_BATCH_SIZE', 25))  # transactions per prompt
+CATEGORIZE_CONCURRENCY = int(os.environ.get('CATEGORIZE_CONCURRENCY', 4))
+MAX_MATCH_DATE_RANGES = 50  # more than this and one covering range is queried instead
+# Unstructured statements are extracted in chunks, so this only bounds model spend per upload
+MAX_AI_STATEMENT_BYTES = int(os.environ.get('MAX_AI_STATEMENT_BYTES', 4 * 1024 * 1024))
+MAX_STATEMENT_PDF_PAGES = int(os.environ.get('STATEMENT_MAX_PDF_PAGES', 100))
 
 class StatementProcessor:
     def __init__(self):
-        self.client = openai.OpenAI()
+        self.client = get_llm_client()
+        self.extraction_stats = None
+        self._replayed = 0  # rows a resumed AI import expects to find already imported
     
     def parse_csv_statement(self, file_content: str, filename: str) -> List[Dict[str, Any]]:
         """Parse CSV credit card statement and extract transactions"""
+        schema = detect_schema(file_content[:SAMPLE_BYTES], truncated=len(file_content) > SAMPLE_BYTES)
+        return [tx for tx in self._iter_csv_rows(io.StringIO(file_content), schema) if not tx.get('rejected')]
+    
+    def open_csv_statement(self, stream: BinaryIO) -> Tuple[Optional[StatementSchema], Iterator[Dict[str, Any]]]:
+        """Detect a CSV statement's layout once, then stream its transactions with the compiled parser"""
+        schema, text = open_statement(stream)
+        return schema, self._iter_csv_rows(text, schema)
+    
+    def open_ofx_statement(self, stream: BinaryIO) -> Tuple[OfxLayout, Iterator[Dict[str, Any]]]:
+        """Stream transactions out of an OFX/QFX download (SGML or XML)"""
+        return open_ofx(stream)
+    
+    def open_fixed_width_statement(self, stream: BinaryIO) -> Optional[Tuple[FixedWidthLayout, Iterator[Dict[str, Any]]]]:
+        """Stream transactions out of a fixed-width text statement, or None if it has no column layout"""
+        return open_fixed_width(stream)
+    
+    def open_native_statement(self, extension: str, stream: BinaryIO) -> Optional[Tuple[Any, Iterator[Dict[str, Any]]]]:
+        """Open a statement with a built-in parser; None means it needs AI extraction"""
+        opener = STATEMENT_PARSERS.get(extension.lower())
+        return opener(self, stream) if opener else None
+    
+    def read_statement(self, filename: str, stream: BinaryIO) -> Tuple[Any, Iterable[Dict[str, Any]]]:
+        """Open a statement file with its built-in parser, falling back to AI extraction.
+        
+        Returns the detected layout (None for AI extraction) and its transactions.
+        """
+        native = self.open_native_statement(filename.rsplit('.', 1)[-1], stream)
+        if native is not None:
+            return native
+        
+        if filename.lower().endswith('.pdf'):
+            # Read the text layer rather than feeding raw PDF bytes to the model
+            pages = load_pdf_pages(stream, max_pages=MAX_STATEMENT_PDF_PAGES)
+            file_content = '\n'.join(page.text for page in pages)[:MAX_AI_STATEMENT_BYTES]
+        else:
+            file_content = stream.read(MAX_AI_STATEMENT_BYTES).decode('utf-8', errors='replace')
+        return None, self.extract_transactions_with_ai(file_content)
+    
+    def _iter_csv_rows(self, text: TextIO, schema: Optional[StatementSchema]) -> Iterator[Dict[str, Any]]:
+        """Yield each row's transaction, including rejected rows for the import to count"""
+        if schema is None:
+            return  # No recognizable date, description and amount columns
+        
+        parse = schema.compile()
+        reader = csv.reader(text, delimiter=schema.delimiter)
         try:
-            # Try to detect CSV format and parse
-            csv_reader = csv.DictReader(io.StringIO(file_content))
-            transactions = []
-            
-            for row in csv_reader:
-                # Common CSV column mappings
-                transaction = self._normalize_csv_row(row)
+            # Skip any preamble and the header
+            for _ in range(schema.header_row + 1):
+                next(reader, None)
+            for row in reader:
+                transaction = parse(row)
                 if transaction:
-                    transactions.append(transaction)
-            
-            return transactions
-            
-        except Exception as e:
+                    yield transaction
+        except csv.Error as e:
             raise Exception(f"Error parsing CSV statement: {str(e)}")
     
-    def _normalize_csv_row(self, row: Dict[str, str]) -> Optional[Dict[str, Any]]:
-        """Normalize CSV row to standard transaction format"""
-        try:
-            # Common column name variations
-            date_fields = ['Date', 'Transaction Date', 'Posted Date', 'date']
-            description_fields = ['Description', 'Merchant', 'Transaction Description', 'description']
-            amount_fields = ['Amount', 'Transaction Amount', 'Debit', 'Credit', 'amount']
-            
-            # Find the actual column names
-            date_col = next((col for col in date_fields if col in row), None)
-            desc_col = next((col for col in description_fields if col in row), None)
-            amount_col = next((col for col in amount_fields if col in row), None)
-            
-            if not all([date_col, desc_col, amount_col]):
-                return None
-            
-            # Parse date
-            date_str = row[date_col].strip()
-            try:
-                # Try common date formats
-                for fmt in ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y', '%d/%m/%Y']:
-                    try:
-                        transaction_date = datetime.strptime(date_str, fmt).date()
-                        break
-                    except ValueError:
-                        continue
-                else:
-                    return None
-            except:
-                return None
-            
-            # Parse amount
-            amount_str = row[amount_col].strip()
-            amount_str = re.sub(r'[^\d.-]', '', amount_str)  # Remove currency symbols
-            try:
-                amount = abs(float(amount_str))  # Use absolute value
-            except ValueError:
-                return None
-            
-            # Clean description
-            description = row[desc_col].strip()
-            
-            return {
-                'date': transaction_date,
-                'merchant': description,
-                'amount': amount,
-                'description': description
-            }
-            
-        except Exception:
-            return None
-    
     def extract_transactions_with_ai(self, file_content: str) -> List[Dict[str, Any]]:
-        """Use AI to extract transactions from unstructured text"""
+        """Use AI to extract transactions from unstructured text, chunk by chunk"""
+        extractor = StatementExtractor(self.client)
         try:
-            system_prompt = """
-You are a financial data extraction expert. Extract credit card transactions from the provided text.
-Return a JSON array of transactions with the following format:
-[
-  {
-    "date": "YYYY-MM-DD",
-    "merchant": "Merchant Name",
-    "amount": 123.45,
-    "description": "Transaction description"
-  }
-]
-
-Rules:
-- Only extract actual transactions (ignore headers, totals, etc.)
-- Use positive amounts for all transactions
-- Parse dates to YYYY-MM-DD format
-- Clean up merchant names (remove extra spaces, codes)
-- If you can't parse a transaction clearly, skip it
-"""
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Extract transactions from this credit card statement:\n\n{file_content[:4000]}"}
-                ],
-                max_tokens=2000,
-                temperature=0.1
-            )
-            
-            # Parse JSON response
-            import json
-            transactions_data = json.loads(response.choices[0].message.content)
-            
-            # Convert to our format
-            transactions = []
-            for tx in transactions_data:
-                try:
-                    transaction = {
-                        'date': datetime.strptime(tx['date'], '%Y-%m-%d').date(),
-                        'merchant': tx['merchant'],
-                        'amount': float(tx['amount']),
-                        'description': tx.get('description', tx['merchant'])
-                    }
-                    transactions.append(transaction)
-                except:
-                    continue
-            
-            return transactions
-            
+            return extractor.extract(file_content)
         except Exception as e:
             raise Exception(f"Error extracting transactions with AI: {str(e)}")
+        finally:
+            self.extraction_stats = extractor.stats
     
-    def categorize_transaction(self, merchant: str, description: str) -> Optional[str]:
+    def categorize_transaction(self, merchant: str, description: str,
+                               category_names: Optional[List[str]] = None) -> Optional[str]:
         """Use AI to categorize a transaction"""
         try:
             # Get available categories
-            categories = Category.query.all()
-            category_names = [cat.name for cat in categories]
+            if category_names is None:
+                category_names = self._category_names()
             
             system_prompt = f"""
 You are a transaction categorization expert. Categorize the transaction based on the merchant and description.
@@ -153,7 +121,8 @@ Available categories: {', '.join(category_names)}
 Return only the category name that best matches the transaction. If no category fits well, return "Other".
 """
             
-            response = self.client.chat.completions.create(
+            response = self.client.chat_completion(
+                priority=PRIORITY_BULK,
                 model="gpt-4.1-mini",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -174,115 +143,351 @@ Return only the category name that best matches the transaction. If no category
         except Exception:
             return "Other"
     
-    def save_transactions(self, transactions: List[Dict[str, Any]], filename: str) -> List[CreditCardTransaction]:
-        """Save transactions to database"""
-        saved_transactions = []
+    def categorize_transactions(self, transactions: List[Dict[str, Any]],
+                                category_names: Optional[List[str]] = None) -> List[str]:
+        """Categorize many transactions, CATEGORIZE_BATCH_SIZE per prompt with batches run concurrently"""
+        if not transactions:
+            return []
+        if category_names is None:
+            category_names = self._category_names()
+        
+        batches = [transactions[i:i + CATEGORIZE_BATCH_SIZE]
+                   for i in range(0, len(transactions), CATEGORIZE_BATCH_SIZE)]
+        if len(batches) == 1:
+            return self._categorize_batch(batches[0], category_names)
+        
+        with ThreadPoolExecutor(max_workers=min(CATEGORIZE_CONCURRENCY, len(batches))) as executor:
+            results = executor.map(lambda batch: self._categorize_batch(batch, category_names), batches)
+            return [category for batch_result in results for category in batch_result]
+    
+    def _categorize_batch(self, transactions: List[Dict[str, Any]], category_names: List[str]) -> List[str]:
+        """Categorize one batch in a single prompt, falling back per item for any bad answer"""
+        items = [
+            {'id': str(i), 'merchant': tx['merchant'], 'description': tx.get('description') or ''}
+            for i, tx in enumerate(transactions)
+        ]
+        system_prompt = f"""
+You are a transaction categorization expert. Categorize each transaction based on its merchant and description.
+
+Available categories: {', '.join(category_names)}
+
+Return a JSON object mapping every transaction id to exactly one available category name, e.g. {{"0": "Travel", "1": "Other"}}.
+If no category fits well, use "Other".
+"""
+        
+        answers = {}
+        try:
+            response = self.client.chat_completion(
+                priority=PRIORITY_BULK,
+                model="gpt-4.1-mini",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": json.dumps(items)}
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=20 * len(items) + 50,
+                temperature=0.1
+            )
+            answers = json.loads(response.choices[0].message.content)
+            if not isinstance(answers, dict):
+                answers = {}
+        except LLMUnavailableError:
+            # Single calls would be refused too
+            return ["Other"] * len(transactions)
+        except Exception as e:
+            print(f"Error categorizing transaction batch: {str(e)}")
+        
+        categories = []
+        for item, tx in zip(items, transactions):
+            category_name = answers.get(item['id'])
+            if category_name not in category_names:
+                category_name = self.categorize_transaction(tx['merchant'], tx.get('description') or '',
+                                                            category_names)
+            categories.append(category_name)
+        return categories
+    
+    def _category_names(self) -> List[str]:
+        return [name for (name,) in db.session.query(Category.name)]
+    
+    def save_transactions(self, transactions: Iterable[Dict[str, Any]], filename: str,
+                          batch_size: int = IMPORT_BATCH_SIZE,
+                          progress: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                          resume_from: Optional[Dict[str, Any]] = None,
+                          skip_committed: bool = True) -> Dict[str, Any]:
+        """Save transactions to database in batches, committing after each one.
+        
+        transactions may be a generator; only one batch is held in memory.
+        Each batch is categorized with a few concurrent batched prompts.
+        progress(phase, stats) is called as each batch moves through dedup,
+        categorize and save; during 'save' anything it stages in the session
+        is committed together with the batch. resume_from takes the stats of
+        an interrupted run. With skip_committed, for native parsers that yield
+        the same rows in the same order every time, the rows its committed
+        batches covered are skipped by position. Otherwise, as for a statement
+        the model extracts again, every row is read again and fingerprint
+        dedup drops the ones already imported without counting them as
+        duplicates. Returns import counts and throughput.
+        """
+        started = time.perf_counter()
+        category_ids = {name: id for id, name in db.session.query(Category.id, Category.name)}
+        category_names = list(category_ids)
+        stats = {'rows': 0, 'imported': 0, 'duplicates': 0, 'errors': 0,
+                 'categorized_by_rule': 0, 'categorized_by_model': 0, 'committed_rows': 0}
+        skip = self._replayed = 0
+        if resume_from and skip_committed:
+            stats.update({key: resume_from.get(key, 0) for key in stats})
+            stats['rows'] = skip = stats['committed_rows']
+        elif resume_from:
+            # Re-read rows are counted afresh; only work they can't redo carries over
+            for key in ('imported', 'categorized_by_rule', 'categorized_by_model'):
+                stats[key] = resume_from.get(key, 0)
+            self._replayed = stats['imported']
+        batch = []
+        batch_fingerprints = set()
         
         for tx_data in transactions:
+            if skip:
+                skip -= 1
+                continue
+            stats['rows'] += 1
+            if tx_data.get('rejected'):
+                # A row the parser recognized but couldn't read safely
+                stats['errors'] += 1
+                continue
             try:
-                # Check if transaction already exists
-                existing = CreditCardTransaction.query.filter_by(
-                    date=tx_data['date'],
-                    merchant=tx_data['merchant'],
-                    amount=tx_data['amount']
-                ).first()
-                
-                if existing:
-                    continue
-                
-                # Categorize transaction
-                category_name = self.categorize_transaction(
-                    tx_data['merchant'], 
-                    tx_data['description']
-                )
-                
-                category = Category.query.filter_by(name=category_name).first()
-                
-                # Create transaction
-                transaction = CreditCardTransaction(
+                if tx_data.get('external_id'):
+                    fingerprint = CreditCardTransaction.make_external_fingerprint(tx_data['external_id'])
+                else:
+                    fingerprint = CreditCardTransaction.make_fingerprint(
+                        tx_data['date'], tx_data['merchant'], tx_data['amount']
+                    )
+            except Exception as e:
+                print(f"Error saving transaction: {e}")
+                stats['errors'] += 1
+                continue
+            
+            # Duplicates within the batch; earlier batches are already committed
+            # and caught by the batch's fingerprint query
+            if fingerprint in batch_fingerprints:
+                stats['duplicates'] += 1
+                continue
+            
+            tx_data['fingerprint'] = fingerprint
+            batch.append(tx_data)
+            batch_fingerprints.add(fingerprint)
+            
+            if len(batch) >= batch_size:
+                self._save_batch(batch, filename, category_ids, category_names, stats, progress)
+                batch_fingerprints.clear()
+        
+        self._save_batch(batch, filename, category_ids, category_names, stats, progress)
+        
+        elapsed = time.perf_counter() - started
+        stats['elapsed_seconds'] = round(elapsed, 3)
+        stats['rows_per_second'] = round(stats['rows'] / elapsed, 1) if elapsed > 0 else 0.0
+        return stats
+    
+    def _save_batch(self, batch: List[Dict[str, Any]], filename: str, category_ids: Dict[str, int],
+                    category_names: List[str], stats: Dict[str, Any],
+                    progress: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        """Drop already-imported rows, categorize and commit one batch, then let its rows go"""
+        if not batch:
+            return
+        
+        report = progress or (lambda phase, stats: None)
+        report('dedup', stats)
+        new_rows = self._without_existing(batch, stats)
+        report('categorize', stats)
+        categories = self._categorize_with_rules(new_rows, category_ids, category_names, stats)
+        
+        for attempt in range(2):
+            for tx_data, category_name in zip(new_rows, categories):
+                db.session.add(CreditCardTransaction(
                     date=tx_data['date'],
                     merchant=tx_data['merchant'],
                     amount=tx_data['amount'],
                     description=tx_data['description'],
-                    category_id=category.id if category else None,
+                    category=category_name,
+                    category_id=category_ids.get(category_name),
                     statement_file=filename,
-                    status='unmatched'
-                )
-                
-                db.session.add(transaction)
-                saved_transactions.append(transaction)
-                
-            except Exception as e:
-                print(f"Error saving transaction: {e}")
-                continue
+                    status='unmatched',
+                    fingerprint=tx_data['fingerprint'],
+                    external_id=tx_data.get('external_id')
+                ))
+            # Counts as of this commit, so progress staged with it is exact
+            committed = stats['imported'], stats['committed_rows']
+            stats['imported'] += len(new_rows)
+            stats['committed_rows'] = stats['rows']
+            report('save', stats)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # A concurrent import committed some of these rows first
+                db.session.rollback()
+                stats['imported'], stats['committed_rows'] = committed
+                if attempt:
+                    raise
+                kept = {id(tx_data) for tx_data in self._without_existing(new_rows, stats)}
+                categories = [category for tx_data, category in zip(new_rows, categories) if id(tx_data) in kept]
+                new_rows = [tx_data for tx_data in new_rows if id(tx_data) in kept]
         
-        db.session.commit()
-        return saved_transactions
+        batch.clear()
+        db.session.expunge_all()
+    
+    def _without_existing(self, rows: List[Dict[str, Any]], stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Filter out rows whose fingerprint is already stored, with one query per chunk"""
+        fingerprints = [tx_data['fingerprint'] for tx_data in rows]
+        existing = set()
+        for i in range(0, len(fingerprints), FINGERPRINT_QUERY_CHUNK):
+            existing.update(fingerprint for (fingerprint,) in db.session.query(CreditCardTransaction.fingerprint)
+                            .filter(CreditCardTransaction.fingerprint.in_(fingerprints[i:i + FINGERPRINT_QUERY_CHUNK])))
+        
+        kept = [tx_data for tx_data in rows if tx_data['fingerprint'] not in existing]
+        # A resumed import meets the rows it already imported again; those aren't duplicates
+        replayed = min(len(rows) - len(kept), self._replayed)
+        self._replayed -= replayed
+        stats['duplicates'] += len(rows) - len(kept) - replayed
+        return kept
+    
+    def _categorize_with_rules(self, batch: List[Dict[str, Any]], category_ids: Dict[str, int],
+                               category_names: List[str], stats: Dict[str, Any]) -> List[str]:
+        """Categorize from learned merchant rules, asking the model once per unknown merchant"""
+        rules = get_merchant_rules()
+        known = rules.lookup_many([tx['merchant'] for tx in batch])
+        
+        # Rules pointing at a deleted category count as unknown
+        unknown = {}
+        for tx_data, category_name in zip(batch, known):
+            if category_name not in category_ids:
+                unknown.setdefault(normalize_merchant(tx_data['merchant']) or tx_data['merchant'], tx_data)
+        
+        answers = dict(zip(unknown, self.categorize_transactions(list(unknown.values()), category_names)))
+        for key, category_name in answers.items():
+            # "Other" is also the fallback for failed calls, so it isn't worth remembering
+            if category_name != "Other":
+                rules.learn(unknown[key]['merchant'], category_name, category_ids.get(category_name))
+        
+        categories = []
+        for tx_data, category_name in zip(batch, known):
+            if category_name in category_ids:
+                stats['categorized_by_rule'] += 1
+            else:
+                category_name = answers[normalize_merchant(tx_data['merchant']) or tx_data['merchant']]
+                stats['categorized_by_model'] += 1
+            categories.append(category_name)
+        return categories
     
-    def auto_match_transactions(self) -> Dict[str, int]:
-        """Automatically match credit card transactions with existing expenses"""
-        unmatched_transactions = CreditCardTransaction.query.filter_by(status='unmatched').all()
-        matched_count = 0
+    def auto_match_transactions(self, full: bool = False) -> Dict[str, Any]:
+        """Automatically match credit card transactions with existing expenses.
+        
+        Runs incrementally from the watermarks saved by the previous run: only
+        unmatched transactions added or changed since then, and unmatched
+        transactions near expenses added or changed since then, are matched
+        against the expenses in their windows. full=True rescans everything.
+        """
+        matcher = TransactionMatcher()
+        state = MatchState.query.filter_by(name='auto_match').first()
+        if state is None:
+            state = MatchState(name='auto_match')
+            db.session.add(state)
+        full = full or state.last_full_run_at is None
+        
+        # Read the new watermarks first, so rows changed while we run are seen next time
+        transaction_watermark = db.session.query(func.max(CreditCardTransaction.updated_at)).scalar()
+        expense_watermark = db.session.query(func.max(Expense.updated_at)).scalar()
+        
+        query = CreditCardTransaction.query.filter_by(status='unmatched')
+        if full:
+            unmatched_transactions = query.all()
+        else:
+            changed = []
+            if state.transaction_watermark is None:
+                changed.append(CreditCardTransaction.id.isnot(None))
+            else:
+                changed.append(CreditCardTransaction.updated_at > state.transaction_watermark)
+            
+            changed_expense_dates = db.session.query(Expense.date).distinct()
+            if state.expense_watermark is not None:
+                changed_expense_dates = changed_expense_dates.filter(Expense.updated_at > state.expense_watermark)
+            for start, end in self._date_ranges([date for (date,) in changed_expense_dates], matcher.window):
+                changed.append(CreditCardTransaction.date.between(start, end))
+            
+            unmatched_transactions = query.filter(or_(*changed)).all()
         
-        for transaction in unmatched_transactions:
-            # Look for matching expenses within 3 days and similar amount
-            date_range_start = transaction.date
-            date_range_end = transaction.date
+        matches = {}
+        expense_count = 0
+        if unmatched_transactions:
+            transactions = [(t.id, t.date, t.amount, t.merchant, t.merchant_key, t.merchant_tokens)
+                            for t in unmatched_transactions]
             
-            # Extend date range by a few days
-            from datetime import timedelta
-            date_range_start = transaction.date - timedelta(days=3)
-            date_range_end = transaction.date + timedelta(days=3)
+            # Every expense that could match, loaded once
+            ranges = self._date_ranges([t.date for t in unmatched_transactions], matcher.window)
+            expenses = db.session.query(
+                Expense.id, Expense.date, Expense.amount,
+                Expense.merchant, Expense.merchant_key, Expense.merchant_tokens
+            ).filter(or_(*[Expense.date.between(start, end) for start, end in ranges])).all()
             
-            # Find potential matches
-            potential_matches = Expense.query.filter(
-                Expense.date >= date_range_start,
-                Expense.date <= date_range_end,
-                Expense.amount.between(
-                    transaction.amount * 0.95,  # 5% tolerance
-                    transaction.amount * 1.05
-                )
-            ).all()
+            # Matches are one-to-one, so expenses already claimed by a transaction are out
+            claimed = {expense_id for (expense_id,) in db.session.query(CreditCardTransaction.matched_expense_id)
+                       .filter(CreditCardTransaction.matched_expense_id.isnot(None))}
+            expenses = [expense for expense in expenses if expense[0] not in claimed]
+            expense_count = len(expenses)
             
-            # Check for merchant similarity
-            for expense in potential_matches:
-                if self._merchants_similar(transaction.merchant, expense.merchant):
-                    # Match found
+            matches = matcher.match(transactions, expenses)
+            for transaction in unmatched_transactions:
+                expense_id = matches.get(transaction.id)
+                if expense_id is not None:
                     transaction.status = 'matched'
-                    transaction.matched_expense_id = expense.id
-                    matched_count += 1
-                    break
-        
-        db.session.commit()
+                    transaction.is_matched = True
+                    transaction.matched_expense_id = expense_id
         
-        return {
+        results = {
+            'mode': 'full' if full else 'incremental',
             'total_transactions': len(unmatched_transactions),
-            'matched': matched_count,
-            'unmatched': len(unmatched_transactions) - matched_count
+            'matched': len(matches),
+            'unmatched': len(unmatched_transactions) - len(matches),
+            'expenses_considered': expense_count,
+            **matcher.stats
         }
+        
+        now = datetime.utcnow()
+        state.transaction_watermark = transaction_watermark
+        state.expense_watermark = expense_watermark
+        state.last_run_at = now
+        if full:
+            state.last_full_run_at = now
+        state.last_results = results
+        db.session.commit()
+        
+        return results
+    
+    def _date_ranges(self, dates: List, window) -> List[Tuple]:
+        """Merge date +/- window spans into as few ranges as possible"""
+        ranges = []
+        for date in sorted(set(dates)):
+            start, end = date - window, date + window
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+        if len(ranges) > MAX_MATCH_DATE_RANGES:
+            # Keep the SQL small; the matcher ignores expenses outside each window anyway
+            ranges = [(ranges[0][0], ranges[-1][1])]
+        return ranges
     
     def _merchants_similar(self, merchant1: str, merchant2: str) -> bool:
         """Check if two merchant names are similar"""
-        # Simple similarity check - can be improved
-        merchant1 = merchant1.lower().strip()
-        merchant2 = merchant2.lower().strip()
-        
-        # Exact match
-        if merchant1 == merchant2:
-            return True
-        
-        # Check if one contains the other
-        if merchant1 in merchant2 or merchant2 in merchant1:
-            return True
-        
-        # Check for common words
-        words1 = set(merchant1.split())
-        words2 = set(merchant2.split())
-        
-        # If they share significant words
-        common_words = words1.intersection(words2)
-        if len(common_words) > 0 and len(common_words) >= min(len(words1), len(words2)) * 0.5:
-            return True
-        
-        return False
+        return merchants_similar(merchant1, merchant2)
+
+# Built-in parsers by file extension; each returns (layout, transactions) or None
+STATEMENT_PARSERS = {
+    'csv': StatementProcessor.open_csv_statement,
+    'ofx': StatementProcessor.open_ofx_statement,
+    'qfx': StatementProcessor.open_ofx_statement,
+    'txt': StatementProcessor.open_fixed_width_statement
+}
 
+def register_statement_parser(extension: str, opener: Callable[[StatementProcessor, BinaryIO], Any]):
+    """Add or replace the parser for a file extension"""
+    STATEMENT_PARSERS[extension.lower()] = opener
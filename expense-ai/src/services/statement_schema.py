@@ -0,0 +1,380 @@
+import csv
+import io
+import re
+import codecs
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Tuple, BinaryIO, TextIO
+
+# Configuration
+SAMPLE_BYTES = 64 * 1024
+SAMPLE_ROWS = 50
+MAX_PREAMBLE_ROWS = 10  # account details some banks print above the header
+DELIMITERS = ',;\t|'
+
+# Tried in order; the first that decodes the sample wins
+ENCODINGS = ['utf-8-sig', 'cp1252']
+
+# Tried in order; the first that parses every sampled date wins, so
+# ambiguous day/month files resolve to US order like before
+DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y', '%d/%m/%Y', '%m/%d/%y', '%d.%m.%Y', '%d/%m/%y', '%Y/%m/%d']
+NUMERIC_DATE = re.compile(r'^\d{1,4}[/.-]\d{1,2}[/.-]\d{2,4}$')
+
+# Lower-case header names for each role, most specific first
+DATE_COLUMNS = ['transaction date', 'trans. date', 'trans date', 'date', 'posted date', 'post date', 'posting date']
+DESCRIPTION_COLUMNS = ['description', 'merchant', 'transaction description', 'payee', 'merchant name', 'details', 'name']
+AMOUNT_COLUMNS = ['amount', 'transaction amount', 'amount (usd)']
+DEBIT_COLUMNS = ['debit', 'debits', 'withdrawal', 'withdrawals', 'charges']
+CREDIT_COLUMNS = ['credit', 'credits', 'deposit', 'deposits', 'payments']
+
+class StatementProfile:
+    """A known bank export layout"""
+
+    def __init__(self, name: str, date_column: str, description_column: str, date_format: str,
+                 amount_column: Optional[str] = None, debit_column: Optional[str] = None,
+                 credit_column: Optional[str] = None, charge_sign: int = 1,
+                 extra_columns: Optional[List[str]] = None):
+        self.name = name
+        self.date_column = date_column
+        self.description_column = description_column
+        self.date_format = date_format
+        self.amount_column = amount_column
+        self.debit_column = debit_column
+        self.credit_column = credit_column
+        self.charge_sign = charge_sign  # -1 when the bank exports charges as negative amounts
+        # Every column the layout must have, so generic headers don't match by accident
+        self.required = {c for c in [date_column, description_column, amount_column,
+                                     debit_column, credit_column] + (extra_columns or []) if c}
+
+    def matches(self, headers: List[str]) -> bool:
+        return self.required.issubset(headers)
+
+STATEMENT_PROFILES: List[StatementProfile] = [
+    StatementProfile('chase', 'transaction date', 'description', '%m/%d/%Y',
+                     amount_column='amount', charge_sign=-1, extra_columns=['post date', 'type']),
+    StatementProfile('capital_one', 'transaction date', 'description', '%Y-%m-%d',
+                     debit_column='debit', credit_column='credit', extra_columns=['posted date', 'card no.']),
+    StatementProfile('discover', 'trans. date', 'description', '%m/%d/%Y',
+                     amount_column='amount', extra_columns=['post date']),
+    StatementProfile('amex', 'date', 'description', '%m/%d/%Y',
+                     amount_column='amount', extra_columns=['card member']),
+    StatementProfile('citi', 'date', 'description', '%m/%d/%Y',
+                     debit_column='debit', credit_column='credit', extra_columns=['status']),
+    StatementProfile('bank_of_america', 'posted date', 'payee', '%m/%d/%Y',
+                     amount_column='amount', charge_sign=-1, extra_columns=['reference number'])
+]
+
+def register_profile(profile: StatementProfile):
+    """Add a bank layout; later registrations are checked first"""
+    STATEMENT_PROFILES.insert(0, profile)
+
+def parse_amount(value: str, decimal_comma: bool = False) -> Optional[float]:
+    """Parse '$1,234.56', '(12.00)', '-3.50' or, with decimal_comma, '1.234,56'"""
+    value = value.strip()
+    if not value:
+        return None
+    negative = value.startswith('(') and value.endswith(')') or '-' in value
+    digits = re.sub(r'[^\d.,]', '', value)
+    if decimal_comma:
+        digits = digits.replace('.', '').replace(',', '.')
+    else:
+        digits = digits.replace(',', '')
+    if not digits:
+        return None
+    amount = float(digits)
+    return -amount if negative else amount
+
+def rejected_row(reason: str) -> Dict[str, Any]:
+    """Stands in for a row that looks like a transaction but can't be read safely; imports count it as an error"""
+    return {'rejected': reason}
+
+class StatementSchema:
+    """Column layout of one statement file, detected once and compiled into a row parser"""
+
+    def __init__(self, delimiter: str, encoding: str, header_row: int, headers: List[str],
+                 date_index: int, description_index: int, date_format: str,
+                 amount_index: Optional[int] = None, debit_index: Optional[int] = None,
+                 credit_index: Optional[int] = None, charge_sign: int = 1,
+                 decimal_comma: bool = False, profile: Optional[str] = None):
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.header_row = header_row
+        self.headers = headers
+        self.date_index = date_index
+        self.description_index = description_index
+        self.date_format = date_format
+        self.amount_index = amount_index
+        self.debit_index = debit_index
+        self.credit_index = credit_index
+        self.charge_sign = charge_sign
+        self.decimal_comma = decimal_comma
+        self.profile = profile
+
+    def compile(self) -> Callable[[List[str]], Optional[Dict[str, Any]]]:
+        """Build a parser for one csv.reader row; returns None for rows that aren't transactions.
+
+        Charges come out positive. With split debit/credit columns, credits
+        (payments, refunds) come out negative; a single amount column keeps
+        the absolute value unless the profile knows the bank's sign convention.
+        The date format comes from a sample, which may not settle it (a DD/MM
+        file whose sampled days are all 12 or less reads as MM/DD). When a
+        later date doesn't fit, the other formats are tried and the first
+        that fits is used from then on; a date none fits is a rejected_row.
+        """
+        date_index = self.date_index
+        description_index = self.description_index
+        date_format = self.date_format
+        decimal_comma = self.decimal_comma
+        strptime = datetime.strptime
+
+        def date_of(value):
+            nonlocal date_format
+            try:
+                return strptime(value, date_format).date()
+            except ValueError:
+                if not NUMERIC_DATE.match(value):
+                    raise
+            for candidate in DATE_FORMATS:
+                try:
+                    parsed = strptime(value, candidate).date()
+                except ValueError:
+                    continue
+                date_format = self.date_format = candidate
+                return parsed
+            return None
+
+        if self.debit_index is not None and self.credit_index is not None:
+            debit_index, credit_index = self.debit_index, self.credit_index
+
+            def amount_of(row):
+                debit = parse_amount(row[debit_index], decimal_comma)
+                if debit:
+                    return abs(debit)
+                credit = parse_amount(row[credit_index], decimal_comma)
+                return -abs(credit) if credit else None
+        elif self.charge_sign != 1:
+            amount_index, charge_sign = self.amount_index, self.charge_sign
+
+            def amount_of(row):
+                amount = parse_amount(row[amount_index], decimal_comma)
+                return amount * charge_sign if amount is not None else None
+        else:
+            amount_index = self.amount_index
+
+            def amount_of(row):
+                amount = parse_amount(row[amount_index], decimal_comma)
+                return abs(amount) if amount is not None else None
+
+        def parse(row: List[str]) -> Optional[Dict[str, Any]]:
+            try:
+                transaction_date = date_of(row[date_index].strip())
+                amount = amount_of(row)
+            except (IndexError, ValueError):
+                return None
+            if transaction_date is None:
+                return rejected_row(f"date '{row[date_index].strip()}' matches no known format")
+            if amount is None:
+                return None
+
+            description = row[description_index].strip()
+            return {
+                'date': transaction_date,
+                'merchant': description,
+                'amount': amount,
+                'description': description
+            }
+
+        return parse
+
+    def to_dict(self) -> Dict[str, Any]:
+        def column(index):
+            return self.headers[index] if index is not None else None
+
+        return {
+            'profile': self.profile,
+            'delimiter': self.delimiter,
+            'encoding': self.encoding,
+            'header_row': self.header_row,
+            'date_column': column(self.date_index),
+            'description_column': column(self.description_index),
+            'amount_column': column(self.amount_index),
+            'debit_column': column(self.debit_index),
+            'credit_column': column(self.credit_index),
+            'date_format': self.date_format,
+            'decimal_comma': self.decimal_comma
+        }
+
+def sniff_encoding(sample: bytes) -> str:
+    """Pick the first encoding that decodes the sample, ignoring a cut-off last character"""
+    for encoding in ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'  # decodes anything
+
+def sniff_delimiter(sample: str) -> str:
+    """Pick the delimiter that splits the most sample lines into the same number of fields.
+
+    csv.Sniffer is easily thrown by preamble lines and decimal commas.
+    """
+    lines = [line for line in sample.splitlines()[:SAMPLE_ROWS] if line.strip()]
+    best, best_score = ',', (0, 0)
+    for delimiter in DELIMITERS:
+        counts = [len(row) for row in csv.reader(lines, delimiter=delimiter)]
+        widths = [count for count in counts if count > 1]
+        if not widths:
+            continue
+        width = max(set(widths), key=widths.count)
+        score = (widths.count(width), width)
+        if score > best_score:
+            best, best_score = delimiter, score
+    return best
+
+def _find_column(headers: List[str], candidates: List[str]) -> Optional[int]:
+    for candidate in candidates:
+        if candidate in headers:
+            return headers.index(candidate)
+    return None
+
+def pick_date_format(values: List[str], preferred: Optional[str] = None) -> Optional[str]:
+    values = [v.strip() for v in values if v.strip()]
+    if not values:
+        return None
+    formats = ([preferred] if preferred else []) + DATE_FORMATS
+    for date_format in formats:
+        try:
+            for value in values:
+                datetime.strptime(value, date_format)
+            return date_format
+        except ValueError:
+            continue
+    return None
+
+def _uses_decimal_comma(values: List[str]) -> bool:
+    values = [v.strip() for v in values if v.strip()]
+    return bool(values) and all(re.search(r',\d{1,2}\)?$', v) for v in values)
+
+def detect_schema(sample: str, encoding: str = 'utf-8', truncated: bool = False) -> Optional[StatementSchema]:
+    """Detect the layout of a CSV statement from its first few KB"""
+    delimiter = sniff_delimiter(sample)
+    rows = list(csv.reader(io.StringIO(sample), delimiter=delimiter))
+    if truncated and len(rows) > 1:
+        rows = rows[:-1]  # The last sampled line may be cut off mid-row
+
+    for header_row, header in enumerate(rows[:MAX_PREAMBLE_ROWS + 1]):
+        headers = [h.strip().lower() for h in header]
+        data = rows[header_row + 1:header_row + 1 + SAMPLE_ROWS]
+
+        profile = next((p for p in STATEMENT_PROFILES if p.matches(headers)), None)
+        if profile is not None:
+            schema = _schema_from_profile(profile, headers, data, delimiter, encoding, header_row)
+        else:
+            schema = _schema_from_headers(headers, data, delimiter, encoding, header_row)
+        if schema is not None:
+            return schema
+
+    return None
+
+def _schema_from_profile(profile: StatementProfile, headers: List[str], data: List[List[str]],
+                         delimiter: str, encoding: str, header_row: int) -> Optional[StatementSchema]:
+    def index(name):
+        return headers.index(name) if name else None
+
+    date_index = headers.index(profile.date_column)
+    date_format = pick_date_format(_column_values(data, date_index), profile.date_format)
+    if date_format is None:
+        return None
+
+    amount_indexes = [i for i in (index(profile.amount_column), index(profile.debit_column),
+                                  index(profile.credit_column)) if i is not None]
+    return StatementSchema(
+        delimiter, encoding, header_row, headers,
+        date_index=date_index,
+        description_index=headers.index(profile.description_column),
+        date_format=date_format,
+        amount_index=index(profile.amount_column),
+        debit_index=index(profile.debit_column),
+        credit_index=index(profile.credit_column),
+        charge_sign=profile.charge_sign,
+        decimal_comma=_uses_decimal_comma([v for i in amount_indexes for v in _column_values(data, i)]),
+        profile=profile.name
+    )
+
+def _schema_from_headers(headers: List[str], data: List[List[str]], delimiter: str,
+                         encoding: str, header_row: int) -> Optional[StatementSchema]:
+    date_index = _find_column(headers, DATE_COLUMNS)
+    description_index = _find_column(headers, DESCRIPTION_COLUMNS)
+    amount_index = _find_column(headers, AMOUNT_COLUMNS)
+    debit_index = _find_column(headers, DEBIT_COLUMNS)
+    credit_index = _find_column(headers, CREDIT_COLUMNS)
+
+    if date_index is None or description_index is None:
+        return None
+    if amount_index is None and debit_index is None:
+        return None
+
+    date_format = pick_date_format(_column_values(data, date_index))
+    if date_format is None:
+        return None
+
+    if amount_index is not None:
+        # A single signed column beats a split layout
+        debit_index = credit_index = None
+        amount_values = _column_values(data, amount_index)
+    elif credit_index is None:
+        # A lone debit column is just an amount column
+        amount_index, debit_index = debit_index, None
+        amount_values = _column_values(data, amount_index)
+    else:
+        amount_values = _column_values(data, debit_index) + _column_values(data, credit_index)
+
+    return StatementSchema(
+        delimiter, encoding, header_row, headers,
+        date_index=date_index,
+        description_index=description_index,
+        date_format=date_format,
+        amount_index=amount_index,
+        debit_index=debit_index,
+        credit_index=credit_index,
+        decimal_comma=delimiter != ',' and _uses_decimal_comma(amount_values)
+    )
+
+def _column_values(rows: List[List[str]], index: int) -> List[str]:
+    return [row[index] for row in rows if index < len(row)]
+
+def open_statement(stream: BinaryIO) -> Tuple[Optional[StatementSchema], TextIO]:
+    """Detect a binary statement stream's schema and return it with a text stream at the start"""
+    sample = stream.read(SAMPLE_BYTES)
+    encoding = sniff_encoding(sample)
+    text_sample = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+    schema = detect_schema(text_sample, encoding, truncated=len(sample) >= SAMPLE_BYTES)
+
+    return schema, io.TextIOWrapper(rewind(stream, sample), encoding=encoding, errors='replace', newline='')
+
+def rewind(stream: BinaryIO, sample: bytes) -> BinaryIO:
+    """Return the stream positioned back at its start after sample was read from it"""
+    if stream.seekable():
+        stream.seek(0)
+        return stream
+    return io.BufferedReader(_ReplayStream(sample, stream))
+
+class _ReplayStream(io.RawIOBase):
+    """Re-read a consumed sample before the rest of a non-seekable stream"""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self.prefix = prefix
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            count = min(len(buffer), len(self.prefix))
+            buffer[:count] = self.prefix[:count]
+            self.prefix = self.prefix[count:]
+            return count
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
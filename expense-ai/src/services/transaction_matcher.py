@@ -0,0 +1,257 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+from typing import Dict, List, Tuple, Iterable, Optional
+from src.services.merchant_normalizer import normalize_merchant, merchant_token_set, trigrams, trigram_similarity
+from src.services.merchant_index import MERCHANT_SIMILARITY_THRESHOLD
+
+# Matching rules
+MATCH_WINDOW_DAYS = 3
+AMOUNT_TOLERANCE = 0.05
+
+# How much each signal contributes to a pair's score; they sum to 1
+AMOUNT_WEIGHT = 0.4
+DATE_WEIGHT = 0.2
+MERCHANT_WEIGHT = 0.4
+
+# Blocks larger than this are assigned greedily, best pair first, to bound O(n^3)
+MAX_ASSIGNMENT_BLOCK = 150
+
+def merchant_profile(merchant: str, merchant_key: Optional[str] = None,
+                     merchant_tokens: Optional[str] = None) -> Tuple[str, frozenset, frozenset]:
+    """Key, token set and trigrams of a merchant, preferring the values stored at write time"""
+    if merchant_key is None:
+        merchant_key = normalize_merchant(merchant or '')
+        merchant_tokens = None
+    if merchant_tokens is None:
+        merchant_tokens = merchant_token_set(merchant_key)
+    return merchant_key, frozenset(merchant_tokens.split()), trigrams(merchant_key)
+
+def profiles_similar(profile1: Tuple, profile2: Tuple,
+                     threshold: float = MERCHANT_SIMILARITY_THRESHOLD) -> bool:
+    key1, words1, grams1 = profile1
+    key2, words2, grams2 = profile2
+    if not key1 or not key2:
+        return False  # Nothing but store numbers and codes to compare
+
+    # Exact match, or one contains the other
+    if key1 == key2 or key1 in key2 or key2 in key1:
+        return True
+
+    # If they share significant words
+    common_words = words1 & words2
+    if len(common_words) > 0 and len(common_words) >= min(len(words1), len(words2)) * 0.5:
+        return True
+
+    # Misspellings and truncated descriptors
+    return trigram_similarity(grams1, grams2) >= threshold
+
+def merchants_similar(merchant1: str, merchant2: str) -> bool:
+    """Check if two merchant names are similar"""
+    return profiles_similar(merchant_profile(merchant1), merchant_profile(merchant2))
+
+def merchant_score(profile1: Tuple, profile2: Tuple) -> float:
+    """How alike two similar merchants are, from 0.0 to 1.0"""
+    key1, words1, grams1 = profile1
+    key2, words2, grams2 = profile2
+    if key1 == key2:
+        return 1.0
+    if key1 in key2 or key2 in key1:
+        return 0.9
+    overlap = len(words1 & words2) / min(len(words1), len(words2)) if words1 and words2 else 0.0
+    return min(1.0, max(overlap, trigram_similarity(grams1, grams2)))
+
+def max_weight_assignment(weights: List[List[float]]) -> List[Tuple[int, int]]:
+    """Pick row/column pairs maximizing total weight, each row and column at most once.
+
+    Hungarian algorithm with potentials on the negated weights, O(n^2 m).
+    Zero weights mean "no edge", so pairs assigned at weight 0 are dropped.
+    """
+    if not weights or not weights[0]:
+        return []
+    transposed = len(weights) > len(weights[0])
+    if transposed:
+        weights = [list(column) for column in zip(*weights)]
+    n, m = len(weights), len(weights[0])
+
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    owner = [0] * (m + 1)  # column j -> assigned row (1-based), 0 when free
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        min_reduced = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            row = weights[i0 - 1]
+            delta, j1 = inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    reduced = -row[j - 1] - u[i0] - v[j]
+                    if reduced < min_reduced[j]:
+                        min_reduced[j] = reduced
+                        way[j] = j0
+                    if min_reduced[j] < delta:
+                        delta, j1 = min_reduced[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_reduced[j] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+
+    pairs = []
+    for j in range(1, m + 1):
+        i = owner[j]
+        if i and weights[i - 1][j - 1] > 0:
+            pairs.append((j - 1, i - 1) if transposed else (i - 1, j - 1))
+    return pairs
+
+class TransactionMatcher:
+    """Assign card transactions to expenses one-to-one, maximizing total match quality.
+
+    A pair is a candidate when the expense is dated within MATCH_WINDOW_DAYS,
+    its amount is within AMOUNT_TOLERANCE (both bounds inclusive) and the
+    normalized merchants are similar. Candidates are found in one date-ordered
+    sweep with an amount-sorted window of expenses, scored on amount delta,
+    date delta and merchant similarity, split into independent blocks of
+    transactions and expenses connected by candidate pairs, and each block is
+    solved as a max-weight assignment.
+    """
+
+    def __init__(self, window_days: int = MATCH_WINDOW_DAYS, tolerance: float = AMOUNT_TOLERANCE):
+        self.window_days = window_days
+        self.window = timedelta(days=window_days)
+        self.tolerance = tolerance
+        self.stats = {}
+
+    def date_range(self, transactions: List[Tuple]) -> Tuple:
+        """Expense dates that can match any of the given transactions"""
+        dates = [transaction[1] for transaction in transactions]
+        return min(dates) - self.window, max(dates) + self.window
+
+    def match(self, transactions: Iterable[Tuple], expenses: Iterable[Tuple]) -> Dict[int, int]:
+        """Map transaction id -> expense id, using each expense at most once.
+
+        Both take (id, date, amount, merchant, merchant_key, merchant_tokens)
+        tuples; the key and tokens may be None for rows stored before they existed.
+        """
+        pairs = self.candidate_pairs(transactions, expenses)
+        blocks = self._blocks(pairs)
+
+        matches = {}
+        for block in blocks:
+            matches.update(self._assign(block))
+
+        self.stats = {
+            'candidate_pairs': len(pairs),
+            'blocks': len(blocks),
+            'largest_block_pairs': max((len(block) for block in blocks), default=0)
+        }
+        return matches
+
+    def candidate_pairs(self, transactions: Iterable[Tuple], expenses: Iterable[Tuple]) -> List[Tuple[int, int, float]]:
+        """Every eligible (transaction id, expense id, score), found in one sweep"""
+        transactions = sorted(transactions, key=lambda t: t[1])
+        expenses = sorted(expenses, key=lambda e: e[1])
+        details = {}  # expense id -> (date, amount, merchant profile), for the window
+        pairs = []
+
+        window = []  # (amount, expense id), sorted
+        added = removed = 0
+
+        for transaction_id, date, amount, *merchant in transactions:
+            # Slide the window to [date - days, date + days]
+            while added < len(expenses) and expenses[added][1] <= date + self.window:
+                expense_id, expense_date, expense_amount, *expense_merchant = expenses[added]
+                insort(window, (expense_amount, expense_id))
+                details[expense_id] = (expense_date, expense_amount, merchant_profile(*expense_merchant))
+                added += 1
+            while removed < added and expenses[removed][1] < date - self.window:
+                expense_id, _, expense_amount = expenses[removed][:3]
+                del window[bisect_left(window, (expense_amount, expense_id))]
+                del details[expense_id]
+                removed += 1
+
+            low = amount * (1 - self.tolerance)
+            high = amount * (1 + self.tolerance)
+            start = bisect_left(window, (low,))
+            if start == len(window) or window[start][0] > high:
+                continue
+
+            profile = merchant_profile(*merchant)
+            for i in range(start, len(window)):
+                if window[i][0] > high:
+                    break
+                expense_id = window[i][1]
+                expense_date, expense_amount, expense_profile = details[expense_id]
+                if profiles_similar(profile, expense_profile):
+                    score = self.score(date, amount, profile, expense_date, expense_amount, expense_profile)
+                    pairs.append((transaction_id, expense_id, score))
+
+        return pairs
+
+    def score(self, date, amount: float, profile: Tuple, expense_date, expense_amount: float,
+              expense_profile: Tuple) -> float:
+        """Quality of an eligible pair, in (0, 1]; exact amount, same day and same merchant score 1"""
+        allowed = self.tolerance * abs(amount)
+        amount_score = 1 - abs(expense_amount - amount) / allowed if allowed else 1.0
+        date_score = 1 - abs((expense_date - date).days) / (self.window_days + 1)
+        return (AMOUNT_WEIGHT * max(0.0, amount_score) + DATE_WEIGHT * date_score
+                + MERCHANT_WEIGHT * merchant_score(profile, expense_profile))
+
+    def _blocks(self, pairs: List[Tuple[int, int, float]]) -> List[List[Tuple[int, int, float]]]:
+        """Split pairs into groups that share no transaction or expense (union-find)"""
+        parent = {}
+
+        def find(node):
+            root = node
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[node] != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        for transaction_id, expense_id, _ in pairs:
+            parent[find(('t', transaction_id))] = find(('e', expense_id))
+
+        blocks = {}
+        for pair in pairs:
+            blocks.setdefault(find(('t', pair[0])), []).append(pair)
+        return list(blocks.values())
+
+    def _assign(self, block: List[Tuple[int, int, float]]) -> Dict[int, int]:
+        transaction_ids = sorted({pair[0] for pair in block})
+        expense_ids = sorted({pair[1] for pair in block})
+
+        if len(transaction_ids) == 1 or len(expense_ids) == 1:
+            # One side has a single member: its best pair wins (lowest ids on ties)
+            best = min(block, key=lambda pair: (-pair[2], pair[0], pair[1]))
+            return {best[0]: best[1]}
+
+        if max(len(transaction_ids), len(expense_ids)) > MAX_ASSIGNMENT_BLOCK:
+            matches, used = {}, set()
+            for transaction_id, expense_id, _ in sorted(block, key=lambda pair: (-pair[2], pair[0], pair[1])):
+                if transaction_id not in matches and expense_id not in used:
+                    matches[transaction_id] = expense_id
+                    used.add(expense_id)
+            return matches
+
+        rows = {transaction_id: i for i, transaction_id in enumerate(transaction_ids)}
+        columns = {expense_id: j for j, expense_id in enumerate(expense_ids)}
+        weights = [[0.0] * len(expense_ids) for _ in transaction_ids]
+        for transaction_id, expense_id, score in block:
+            weights[rows[transaction_id]][columns[expense_id]] = score
+
+        return {transaction_ids[i]: expense_ids[j] for i, j in max_weight_assignment(weights)}
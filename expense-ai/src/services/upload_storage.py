@@ -0,0 +1,136 @@
+import os
+import hashlib
+import tempfile
+from typing import Optional, Iterable, BinaryIO
+
+# Configuration
+UPLOAD_CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 16
+TEMP_PREFIX = '.upload-'
+TEMP_SUFFIX = '.part'
+
+# Leading bytes of every file type we accept
+MAGIC_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'%PDF-', 'pdf')
+]
+
+# Extensions that are spellings of the same type
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+class UploadRejected(Exception):
+    """Raised when an upload fails size or content checks"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class StoredUpload:
+    """A file that was streamed to disk, with the facts gathered on the way"""
+
+    def __init__(self, path: str, size: int, content_hash: str, file_type: str):
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+        self.file_type = file_type
+
+def sniff_file_type(header: bytes) -> Optional[str]:
+    """Identify a file type from its magic bytes"""
+    for signature, file_type in MAGIC_SIGNATURES:
+        if header.startswith(signature):
+            return file_type
+    return None
+
+def normalize_extension(extension: str) -> str:
+    extension = extension.lower().lstrip('.')
+    return EXTENSION_ALIASES.get(extension, extension)
+
+def hash_stream(stream: BinaryIO) -> Optional[str]:
+    """SHA-256 of a seekable stream's content, rewound afterwards; None if it can't be rewound"""
+    if not stream.seekable():
+        return None
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def stream_to_file(stream: BinaryIO, dest_path: str, max_size: int,
+                   allowed_types: Iterable[str], expected_type: Optional[str] = None) -> StoredUpload:
+    """Copy a stream to dest_path in fixed-size chunks.
+
+    The copy goes to a temp file in the destination directory and is renamed
+    into place only once it is complete, so readers never see a partial file.
+    """
+    stored = stream_to_temp_file(stream, os.path.dirname(dest_path), max_size,
+                                 allowed_types, expected_type)
+    os.replace(stored.path, dest_path)
+    stored.path = dest_path
+    return stored
+
+def stream_to_temp_file(stream: BinaryIO, temp_dir: str, max_size: int,
+                        allowed_types: Iterable[str], expected_type: Optional[str] = None) -> StoredUpload:
+    """Copy a stream in fixed-size chunks to a temp file in temp_dir.
+
+    Aborts as soon as the stream exceeds max_size or its magic bytes don't
+    match an allowed type (or expected_type, when given). The caller moves
+    the temp file into place, typically once the content hash is known.
+    """
+    allowed_types = {normalize_extension(t) for t in allowed_types}
+    expected_type = normalize_extension(expected_type) if expected_type else None
+
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX)
+    digest = hashlib.sha256()
+    size = 0
+    header = b''
+    file_type = None
+
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadRejected(
+                        f'File exceeds the maximum size of {max_size // (1024 * 1024)}MB', 413
+                    )
+
+                # Check the content type as soon as we have enough bytes
+                if file_type is None and len(header) < SNIFF_BYTES:
+                    header += chunk[:SNIFF_BYTES - len(header)]
+                    if len(header) >= SNIFF_BYTES:
+                        file_type = _check_type(header, allowed_types, expected_type)
+
+                digest.update(chunk)
+                out.write(chunk)
+
+            out.flush()
+            os.fsync(out.fileno())
+
+        if size == 0:
+            raise UploadRejected('File is empty')
+        if file_type is None:
+            # Files shorter than the sniff window
+            file_type = _check_type(header, allowed_types, expected_type)
+
+        return StoredUpload(temp_path, size, digest.hexdigest(), file_type)
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _check_type(header: bytes, allowed_types: set, expected_type: Optional[str]) -> str:
+    file_type = sniff_file_type(header)
+    if file_type is None or file_type not in allowed_types:
+        raise UploadRejected('File content is not a supported image or PDF', 415)
+    # A PNG named .jpg is harmless, a PDF named .jpg is not
+    if expected_type and (file_type == 'pdf') != (expected_type == 'pdf'):
+        raise UploadRejected('File content does not match its extension', 415)
+    return file_type
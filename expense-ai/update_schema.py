@@ -89,6 +89,7 @@ def update_database_schema():
                 file_type=receipt_data['file_type'],
                 extracted_data=receipt_data['extracted_data'],
                 is_processed=receipt_data['is_processed'],
+                processing_status='done',
                 review_status=receipt_data['review_status']
             )
             db.session.add(receipt)